@@ -0,0 +1,57 @@
+from .backtest import (
+    load_price_matrix,
+    yearly_returns,
+    lag_signal,
+    top_n_weights,
+    normalize_weights,
+    run_backtest,
+    summarize,
+    value_factors,
+    prediction_scores,
+)
+from .features import (
+    compute_growth_features,
+    refresh_growth_features,
+)
+from .ranking import (
+    compute_ratios,
+    rank_groups,
+    refresh_sector_ranks,
+    sector_percentiles,
+)
+from .dcf import (
+    load_dcf_inputs,
+    simulate_dcf,
+    value_universe,
+)
+from .point_in_time import (
+    load_statement_history,
+    statements_as_of,
+    daily_prices_as_of,
+    yearly_prices_as_of,
+    build_point_in_time,
+)
+from .risk import (
+    compute_risk_metrics,
+    benchmark_returns,
+    refresh_risk_metrics,
+)
+from .similarity import (
+    SimilarityIndex,
+    build_index,
+    update_index,
+    get_index,
+)
+
+__all__ = [
+    'load_price_matrix', 'yearly_returns', 'lag_signal', 'top_n_weights',
+    'normalize_weights', 'run_backtest', 'summarize', 'value_factors',
+    'prediction_scores',
+    'compute_growth_features', 'refresh_growth_features',
+    'compute_ratios', 'rank_groups', 'refresh_sector_ranks', 'sector_percentiles',
+    'load_dcf_inputs', 'simulate_dcf', 'value_universe',
+    'load_statement_history', 'statements_as_of', 'daily_prices_as_of',
+    'yearly_prices_as_of', 'build_point_in_time',
+    'compute_risk_metrics', 'benchmark_returns', 'refresh_risk_metrics',
+    'SimilarityIndex', 'build_index', 'update_index', 'get_index',
+]
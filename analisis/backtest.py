@@ -0,0 +1,223 @@
+"""Vectorized backtesting of yearly rebalanced portfolios.
+
+Prices, scores and weights are held as dense ``symbols × years`` NumPy
+matrices. Strategy variants are stacked on a leading axis so hundreds of
+them are evaluated with the same array operations as a single one.
+"""
+
+from typing import Dict, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+from conf import *
+import bbdd
+
+
+@bbdd.cached_query('fiscal_year')
+def load_price_matrix(session: Session) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Load yearly first/last prices as dense matrices.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for querying.
+
+    Returns
+    -------
+    tuple
+        ``(symbols, years, price_first, price_last)`` where both price
+        matrices have shape ``(len(symbols), len(years))`` and missing
+        values are ``NaN``.
+    """
+    query = session.query(
+        bbdd.FiscalYear.symbol,
+        bbdd.FiscalYear.fiscal_year,
+        bbdd.FiscalYear.price_first,
+        bbdd.FiscalYear.price_last,
+    )
+    df = pd.read_sql(query.statement, session.bind)
+    symbols = np.sort(df['symbol'].unique())
+    years = np.arange(df['fiscal_year'].min(), df['fiscal_year'].max() + 1) if len(df) else np.array([], dtype=int)
+    first = pivot(df, symbols, years, 'price_first')
+    last = pivot(df, symbols, years, 'price_last')
+    return symbols, years, first, last
+
+
+def pivot(df: pd.DataFrame, symbols: np.ndarray, years: np.ndarray, column: str) -> np.ndarray:
+    """Scatter a long ``(symbol, fiscal_year, column)`` frame into a matrix.
+
+    Parameters
+    ----------
+    df:
+        Long DataFrame with ``symbol`` and ``fiscal_year`` columns.
+    symbols:
+        Sorted symbols defining the row axis.
+    years:
+        Consecutive years defining the column axis.
+    column:
+        Name of the value column.
+
+    Returns
+    -------
+    numpy.ndarray
+        ``float64`` matrix with ``NaN`` where no value exists.
+    """
+    matrix = np.full((len(symbols), len(years)), np.nan)
+    if df.empty or not len(years):
+        return matrix
+    rows = np.searchsorted(symbols, df['symbol'].to_numpy())
+    cols = df['fiscal_year'].to_numpy(dtype=np.int64) - years[0]
+    valid = (rows < len(symbols)) & (cols >= 0) & (cols < len(years))
+    valid[valid] &= symbols[rows[valid]] == df['symbol'].to_numpy()[valid]
+    matrix[rows[valid], cols[valid]] = df[column].to_numpy(dtype=np.float64)[valid]
+    return matrix
+
+
+def yearly_returns(price_first: np.ndarray, price_last: np.ndarray) -> np.ndarray:
+    """Return the within-year return ``price_last / price_first - 1``."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = price_last / price_first - 1
+    returns[~np.isfinite(returns)] = np.nan
+    return returns
+
+
+def lag_signal(scores: np.ndarray, lag: int = 1) -> np.ndarray:
+    """Shift scores ``lag`` years forward along the last axis.
+
+    Fundamentals of fiscal year ``y`` are only known after the year
+    closes, so by default they drive the portfolio held during ``y + 1``.
+    """
+    if lag <= 0:
+        return scores
+    shifted = np.full_like(scores, np.nan, dtype=np.float64)
+    shifted[..., lag:] = scores[..., :-lag]
+    return shifted
+
+
+def top_n_weights(scores: np.ndarray, top_n: Sequence[int], tradable: Optional[np.ndarray] = None) -> np.ndarray:
+    """Equal-weight the ``n`` best scored symbols of every year.
+
+    Parameters
+    ----------
+    scores:
+        Matrix ``(symbols, years)`` or stack ``(variants, symbols, years)``
+        where higher is better and ``NaN`` means not eligible.
+    top_n:
+        Portfolio size per variant. A single matrix of scores is
+        broadcast against every value.
+    tradable:
+        Optional boolean ``(symbols, years)`` mask of symbols with a
+        known return in each year.
+
+    Returns
+    -------
+    numpy.ndarray
+        Weights of shape ``(variants, symbols, years)`` summing to one
+        in every year with at least one selected symbol.
+    """
+    top_n = np.asarray(top_n, dtype=np.int64)
+    if scores.ndim == 2:
+        scores = np.broadcast_to(scores, (len(top_n),) + scores.shape)
+    eligible = ~np.isnan(scores)
+    if tradable is not None:
+        eligible &= tradable
+    ranked = np.where(eligible, scores, -np.inf)
+    # Rango descendente de cada símbolo dentro de su año
+    order = np.argsort(-ranked, axis=1, kind='stable')
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(scores.shape[1])[None, :, None], axis=1)
+    selected = eligible & (ranks < top_n[:, None, None])
+    return normalize_weights(selected)
+
+
+def normalize_weights(mask: np.ndarray) -> np.ndarray:
+    """Turn a boolean screen mask into equal weights per year."""
+    mask = mask.astype(np.float64)
+    counts = mask.sum(axis=-2, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(counts > 0, mask / counts, 0.0)
+
+
+def run_backtest(weights: np.ndarray, returns: np.ndarray, cost: float = 0.0) -> Dict[str, np.ndarray]:
+    """Simulate yearly rebalanced portfolios.
+
+    Parameters
+    ----------
+    weights:
+        Stack ``(variants, symbols, years)`` of portfolio weights.
+    returns:
+        Matrix ``(symbols, years)`` of yearly returns.
+    cost:
+        Proportional transaction cost charged on turnover.
+
+    Returns
+    -------
+    dict
+        ``returns``, ``turnover``, ``equity`` and ``drawdown`` arrays of
+        shape ``(variants, years)`` plus per variant ``cagr``,
+        ``volatility`` and ``max_drawdown``.
+    """
+    if weights.ndim == 2:
+        weights = weights[None]
+    portfolio = np.einsum('vsy,sy->vy', weights, np.nan_to_num(returns))
+    previous = np.concatenate([np.zeros_like(weights[..., :1]), weights[..., :-1]], axis=-1)
+    turnover = 0.5 * np.abs(weights - previous).sum(axis=1)
+    portfolio = portfolio - cost * turnover
+    invested = weights.sum(axis=1) > 0
+
+    equity = np.cumprod(1 + portfolio, axis=-1)
+    drawdown = equity / np.maximum.accumulate(equity, axis=-1) - 1
+    years = np.maximum(invested.sum(axis=-1), 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cagr = equity[:, -1] ** (1 / years) - 1 if equity.shape[-1] else np.zeros(len(weights))
+    mean = np.where(invested, portfolio, 0).sum(axis=-1) / years
+    volatility = np.sqrt(np.where(invested, (portfolio - mean[:, None]) ** 2, 0).sum(axis=-1) / years)
+    return {
+        'returns': portfolio,
+        'turnover': turnover,
+        'equity': equity,
+        'drawdown': drawdown,
+        'cagr': cagr,
+        'volatility': volatility,
+        'max_drawdown': drawdown.min(axis=-1) if drawdown.shape[-1] else np.zeros(len(weights)),
+    }
+
+
+def summarize(result: Dict[str, np.ndarray], names: Sequence[str]) -> pd.DataFrame:
+    """Return one row of headline statistics per strategy variant."""
+    return pd.DataFrame({
+        'strategy': list(names),
+        'cagr': result['cagr'],
+        'volatility': result['volatility'],
+        'max_drawdown': result['max_drawdown'],
+        'avg_turnover': result['turnover'].mean(axis=-1),
+        'final_equity': result['equity'][:, -1],
+    }).sort_values('cagr', ascending=False, ignore_index=True)
+
+
+def value_factors(session: Session, symbols: np.ndarray, years: np.ndarray) -> Dict[str, np.ndarray]:
+    """Build classic value screen scores as ``(symbols, years)`` matrices."""
+    df = bbdd.extract_all_data(session)
+    market_cap = df['price_last'] * df['acciones_promedio']
+    df['earnings_yield'] = df['ingreso_neto'] / market_cap
+    df['fcf_yield'] = df['flujo_libre_caja'] / market_cap
+    df['book_to_price'] = df['total_patrimonio_accionistas'] / market_cap
+    df['sales_to_price'] = df['ingresos'] / market_cap
+    factors = ['earnings_yield', 'fcf_yield', 'book_to_price', 'sales_to_price']
+    df[factors] = df[factors].replace([np.inf, -np.inf], np.nan)
+    return {name: pivot(df, symbols, years, name) for name in factors}
+
+
+def prediction_scores(session: Session, symbols: np.ndarray, years: np.ndarray) -> Dict[str, np.ndarray]:
+    """Return the stored model scores of every model version."""
+    query = session.query(
+        bbdd.Prediction.symbol,
+        bbdd.Prediction.fiscal_year,
+        bbdd.Prediction.model_version,
+        bbdd.Prediction.puntuacion,
+    )
+    df = pd.read_sql(query.statement, session.bind)
+    return {
+        f'model_{version}': pivot(group, symbols, years, 'puntuacion')
+        for version, group in df.groupby('model_version')
+    }
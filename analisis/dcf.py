@@ -0,0 +1,192 @@
+"""Monte Carlo discounted cash flow valuation of the whole universe.
+
+Every company is valued at once by broadcasting over a ``companies ×
+paths`` grid. Growth and discount rates are sampled per cell and the
+explicit forecast period is summed with the closed form of the geometric
+series, so no Python loop runs over years, paths or companies. The grid
+is processed in company blocks to keep memory bounded.
+"""
+
+from typing import Dict, Optional, Sequence, Union
+import numpy as np
+import pandas as pd
+from sqlalchemy import and_, func
+from sqlalchemy.orm import Session
+from conf import *
+import bbdd
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+@bbdd.cached_query('cash_flow', 'balance_sheet', 'income_statement', 'company')
+def load_dcf_inputs(session: Session) -> pd.DataFrame:
+    """Return the latest free cash flow, net debt and share count per symbol.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for querying.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns ``symbol``, ``fiscal_year``, ``flujo_libre_caja``,
+        ``deuda_neta``, ``acciones_promedio`` and ``price``.
+    """
+    latest = session.query(
+        bbdd.CashFlow.symbol.label('symbol'),
+        func.max(bbdd.CashFlow.fiscal_year).label('fiscal_year'),
+    ).group_by(bbdd.CashFlow.symbol).subquery()
+    query = session.query(
+        bbdd.CashFlow.symbol,
+        bbdd.CashFlow.fiscal_year,
+        bbdd.CashFlow.flujo_libre_caja,
+        bbdd.BalanceSheet.deuda_neta,
+        bbdd.IncomeStatement.acciones_promedio,
+        bbdd.Company.price,
+    ).join(latest, and_(bbdd.CashFlow.symbol == latest.c.symbol, bbdd.CashFlow.fiscal_year == latest.c.fiscal_year))\
+     .join(bbdd.IncomeStatement, and_(bbdd.CashFlow.symbol == bbdd.IncomeStatement.symbol, bbdd.CashFlow.fiscal_year == bbdd.IncomeStatement.fiscal_year))\
+     .outerjoin(bbdd.BalanceSheet, and_(bbdd.CashFlow.symbol == bbdd.BalanceSheet.symbol, bbdd.CashFlow.fiscal_year == bbdd.BalanceSheet.fiscal_year))\
+     .outerjoin(bbdd.Company, bbdd.CashFlow.symbol == bbdd.Company.symbol)
+    return pd.read_sql(query.statement, session.bind)
+
+
+def simulate_dcf(
+    fcf: np.ndarray,
+    net_debt: np.ndarray,
+    shares: np.ndarray,
+    growth_mean: Union[float, np.ndarray] = 0.05,
+    growth_std: float = 0.03,
+    discount_mean: float = 0.09,
+    discount_std: float = 0.015,
+    terminal_growth: float = 0.025,
+    years: int = 10,
+    paths: int = 10_000,
+    percentiles: Sequence[float] = PERCENTILES,
+    seed: Optional[int] = 42,
+    max_cells: int = 20_000_000,
+) -> Dict[str, np.ndarray]:
+    """Simulate per-share intrinsic values for many companies.
+
+    Parameters
+    ----------
+    fcf, net_debt, shares:
+        Arrays of length ``companies`` with the latest free cash flow,
+        net debt and share count. Missing net debt counts as zero.
+    growth_mean:
+        Mean yearly FCF growth during the forecast period, either one
+        value or one per company.
+    growth_std, discount_mean, discount_std:
+        Parameters of the normal distributions sampled per path. The
+        same standard normal draws are shared by every company.
+    terminal_growth:
+        Perpetual growth after the forecast period. Sampled discount
+        rates are floored one point above it.
+    years:
+        Length of the explicit forecast period.
+    paths:
+        Simulation paths per company.
+    percentiles:
+        Percentiles of the per-share value distribution to return.
+    seed:
+        Seed of the random generator for reproducible runs.
+    max_cells:
+        Upper bound of ``companies × paths`` cells held in memory at once.
+
+    Returns
+    -------
+    dict
+        ``percentiles`` array of shape ``(companies, len(percentiles))``
+        and ``mean`` of shape ``(companies,)``. Companies with
+        non-positive FCF or shares get ``NaN``.
+    """
+    fcf = np.asarray(fcf, dtype=np.float32)
+    net_debt = np.nan_to_num(np.asarray(net_debt, dtype=np.float32))
+    shares = np.asarray(shares, dtype=np.float32)
+    growth_mean = np.broadcast_to(np.asarray(growth_mean, dtype=np.float32), fcf.shape)
+    n = len(fcf)
+
+    result = np.full((n, len(percentiles)), np.nan, dtype=np.float32)
+    mean = np.full(n, np.nan, dtype=np.float32)
+    valid = (fcf > 0) & (shares > 0)
+    # Números aleatorios comunes: los mismos escenarios para todas las empresas.
+    # Las distribuciones marginales por empresa no cambian y se evita muestrear
+    # companies × paths valores.
+    rng = np.random.default_rng(seed)
+    z_growth = rng.standard_normal(paths, dtype=np.float32)
+    r = np.float32(discount_mean) + np.float32(discount_std) * rng.standard_normal(paths, dtype=np.float32)
+    r = np.maximum(r, np.float32(terminal_growth + 0.01))[None, :]
+    terminal_factor = (1 + np.float32(terminal_growth)) / (r - np.float32(terminal_growth))
+
+    # Posiciones de los percentiles (interpolación lineal) en la muestra ordenada
+    position = np.asarray(percentiles, dtype=np.float64) / 100 * (paths - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, paths - 1)
+    fraction = (position - lower).astype(np.float32)
+
+    block = max(1, max_cells // paths)
+    index = np.flatnonzero(valid)
+    for start in range(0, len(index), block):
+        rows = index[start:start + block]
+        g = growth_mean[rows, None] + np.float32(growth_std) * z_growth[None, :]
+
+        # Suma de FCF·q^t para t=1..years con q=(1+g)/(1+r)
+        q = (1 + g) / (1 + r)
+        q_n = q ** years
+        near_one = np.abs(1 - q) < 1e-6
+        annuity = np.where(near_one, np.float32(years), q * (1 - q_n) / np.where(near_one, 1, 1 - q))
+        enterprise = fcf[rows, None] * (annuity + q_n * terminal_factor)
+
+        per_share = (enterprise - net_debt[rows, None]) / shares[rows, None]
+        per_share.sort(axis=1)
+        result[rows] = per_share[:, lower] + (per_share[:, upper] - per_share[:, lower]) * fraction
+        mean[rows] = per_share.mean(axis=1)
+    return {'percentiles': result, 'mean': mean}
+
+
+def value_universe(session: Session, growth_from_history: bool = True, **kwargs) -> pd.DataFrame:
+    """Run :func:`simulate_dcf` for every company with statements.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for querying.
+    growth_from_history:
+        Center each company's growth on its stored five-year FCF CAGR,
+        clipped to ``[-5%, 15%]``, instead of the global default.
+    **kwargs:
+        Forwarded to :func:`simulate_dcf`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per symbol with ``p<k>`` value columns, ``mean`` and the
+        ``margen_seguridad`` of the median against the latest price.
+    """
+    df = load_dcf_inputs(session)
+    if growth_from_history and 'growth_mean' not in kwargs:
+        cagr = pd.read_sql(
+            session.query(
+                bbdd.GrowthFeature.symbol,
+                bbdd.GrowthFeature.fiscal_year,
+                bbdd.GrowthFeature.cagr_flujo_libre_caja_5a,
+            ).statement,
+            session.bind,
+        )
+        df = df.merge(cagr, on=['symbol', 'fiscal_year'], how='left')
+        kwargs['growth_mean'] = df['cagr_flujo_libre_caja_5a'].clip(-0.05, 0.15).fillna(0.05).to_numpy()
+
+    percentiles = kwargs.get('percentiles', PERCENTILES)
+    simulated = simulate_dcf(
+        df['flujo_libre_caja'].to_numpy(dtype=np.float64),
+        df['deuda_neta'].to_numpy(dtype=np.float64),
+        df['acciones_promedio'].to_numpy(dtype=np.float64),
+        **kwargs,
+    )
+    out = df[['symbol', 'fiscal_year', 'price']].copy()
+    for i, p in enumerate(percentiles):
+        out[f'p{p:g}'] = simulated['percentiles'][:, i]
+    out['mean'] = simulated['mean']
+    if 50 in percentiles:
+        out['margen_seguridad'] = out['p50'] / out['price'] - 1
+    return out
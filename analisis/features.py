@@ -0,0 +1,182 @@
+"""Lagged growth, CAGR and rolling-window features per symbol.
+
+Lags are resolved by looking up ``(symbol, fiscal_year - k)`` on a
+``MultiIndex`` instead of shifting rows, so gaps in a company's filing
+history never pair a year with the wrong predecessor. All features are
+computed for every loaded symbol at once with vectorized pandas
+operations and only the years affected by new filings are rewritten.
+"""
+
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+import pandas as pd
+from sqlalchemy import and_, func, select, union_all
+from sqlalchemy.orm import Session
+from conf import *
+import bbdd
+
+# nombre -> (columna origen, años de retardo)
+CRECIMIENTOS = {
+    'crecimiento_ingresos': ('ingresos', 1),
+    'crecimiento_eps': ('eps', 1),
+    'crecimiento_flujo_libre_caja': ('flujo_libre_caja', 1),
+    'crecimiento_patrimonio': ('total_patrimonio_accionistas', 1),
+}
+CAGRS = {
+    'cagr_ingresos_3a': ('ingresos', 3),
+    'cagr_ingresos_5a': ('ingresos', 5),
+    'cagr_eps_3a': ('eps', 3),
+    'cagr_eps_5a': ('eps', 5),
+    'cagr_flujo_libre_caja_3a': ('flujo_libre_caja', 3),
+    'cagr_flujo_libre_caja_5a': ('flujo_libre_caja', 5),
+}
+VARIACIONES = {
+    'variacion_margen_bruto': ('margen_ganancia_bruta', 1),
+    'variacion_margen_operativo': ('margen_ingreso_operativo', 1),
+    'variacion_margen_neto': ('margen_ingreso_neto', 1),
+    'variacion_deuda_neta': ('deuda_neta', 1),
+}
+MEDIAS = {
+    'media_flujo_libre_caja_3a': ('flujo_libre_caja', 3),
+    'media_margen_operativo_5a': ('margen_ingreso_operativo', 5),
+}
+FEATURES = list(CRECIMIENTOS) + list(CAGRS) + list(VARIACIONES) + list(MEDIAS)
+
+
+def lag(values: pd.Series, k: int) -> pd.Series:
+    """Return ``values`` of ``fiscal_year - k`` for every ``(symbol, fiscal_year)``."""
+    index = values.index
+    lagged = pd.MultiIndex.from_arrays([
+        index.get_level_values('symbol'),
+        index.get_level_values('fiscal_year') - k,
+    ])
+    return pd.Series(values.reindex(lagged).to_numpy(), index=index)
+
+
+def compute_growth_features(statements: pd.DataFrame) -> pd.DataFrame:
+    """Derive every growth feature from a frame of yearly statement values.
+
+    Parameters
+    ----------
+    statements:
+        Frame indexed by ``(symbol, fiscal_year)`` with the source
+        columns referenced in :data:`FEATURES`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One column per feature, same index as ``statements``.
+    """
+    out = pd.DataFrame(index=statements.index)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for name, (column, k) in CRECIMIENTOS.items():
+            previous = lag(statements[column], k)
+            out[name] = (statements[column] - previous) / previous.abs()
+        for name, (column, k) in CAGRS.items():
+            previous = lag(statements[column], k)
+            ratio = statements[column] / previous
+            out[name] = np.where((statements[column] > 0) & (previous > 0), ratio ** (1 / k) - 1, np.nan)
+        for name, (column, k) in VARIACIONES.items():
+            out[name] = statements[column] - lag(statements[column], k)
+        for name, (column, k) in MEDIAS.items():
+            window = [statements[column]] + [lag(statements[column], i) for i in range(1, k)]
+            # La media sólo se publica cuando la ventana está completa
+            out[name] = pd.concat(window, axis=1).mean(axis=1, skipna=False)
+    return out.replace([np.inf, -np.inf], np.nan)
+
+
+def load_statements(session: Session, symbols: Iterable[str]) -> pd.DataFrame:
+    """Load the source columns of the growth features for ``symbols``."""
+    frames: List[pd.DataFrame] = []
+    for batch in bbdd.chunked(sorted(symbols), 500):
+        query = session.query(
+            bbdd.IncomeStatement.symbol,
+            bbdd.IncomeStatement.fiscal_year,
+            bbdd.IncomeStatement.ingresos,
+            bbdd.IncomeStatement.eps,
+            bbdd.IncomeStatement.margen_ganancia_bruta,
+            bbdd.IncomeStatement.margen_ingreso_operativo,
+            bbdd.IncomeStatement.margen_ingreso_neto,
+            bbdd.CashFlow.flujo_libre_caja,
+            bbdd.BalanceSheet.total_patrimonio_accionistas,
+            bbdd.BalanceSheet.deuda_neta,
+        ).outerjoin(bbdd.CashFlow, and_(
+            bbdd.IncomeStatement.symbol == bbdd.CashFlow.symbol,
+            bbdd.IncomeStatement.fiscal_year == bbdd.CashFlow.fiscal_year,
+        )).outerjoin(bbdd.BalanceSheet, and_(
+            bbdd.IncomeStatement.symbol == bbdd.BalanceSheet.symbol,
+            bbdd.IncomeStatement.fiscal_year == bbdd.BalanceSheet.fiscal_year,
+        )).filter(bbdd.IncomeStatement.symbol.in_(batch))
+        frames.append(pd.read_sql(query.statement, session.bind))
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True)
+    df = df.loc[:, ~df.columns.duplicated()]
+    # Un estado aún sin descargar deja columnas de solo None (tipo object)
+    return df.set_index(['symbol', 'fiscal_year']).astype('float64').sort_index()
+
+
+def pending_years(session: Session) -> Dict[str, int]:
+    """Return the first fiscal year whose features are missing or stale for each symbol.
+
+    A year is pending when it has statements but no features, or when one
+    of its statements was stored (see ``statement_hashes``) at or after
+    its features were computed, e.g. after a restatement or a statement
+    that arrived late.
+    """
+    nuevos = select(bbdd.IncomeStatement.symbol.label('symbol'), bbdd.IncomeStatement.fiscal_year.label('fiscal_year'))\
+        .outerjoin(bbdd.GrowthFeature, and_(
+            bbdd.IncomeStatement.symbol == bbdd.GrowthFeature.symbol,
+            bbdd.IncomeStatement.fiscal_year == bbdd.GrowthFeature.fiscal_year,
+        )).where(bbdd.GrowthFeature.symbol.is_(None))
+    # Marcas de segundo: a igualdad se recalcula para no perder una revisión
+    revisados = select(bbdd.StatementHash.symbol, bbdd.StatementHash.fiscal_year)\
+        .join(bbdd.GrowthFeature, and_(
+            bbdd.StatementHash.symbol == bbdd.GrowthFeature.symbol,
+            bbdd.StatementHash.fiscal_year == bbdd.GrowthFeature.fiscal_year,
+        )).where(bbdd.StatementHash.fecha_actualizacion >= bbdd.GrowthFeature.fecha_calculo)
+    pendientes = union_all(nuevos, revisados).subquery('pendientes')
+    rows = session.execute(
+        select(pendientes.c.symbol, func.min(pendientes.c.fiscal_year)).group_by(pendientes.c.symbol)
+    ).all()
+    return {symbol: int(year) for symbol, year in rows}
+
+
+def refresh_growth_features(session: Session, changed: Optional[Dict[str, int]] = None) -> int:
+    """Recompute and store the features affected by new or revised filings.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for querying and persistence.
+    changed:
+        Mapping of symbol to the first fiscal year whose statements
+        changed, as returned by ``bbdd.save_statements``. When omitted,
+        pending years are detected with :func:`pending_years`.
+
+    Returns
+    -------
+    int
+        Number of feature rows written.
+    """
+    if changed is None:
+        changed = pending_years(session)
+    if not changed:
+        logging.info("Growth features are up to date.")
+        return 0
+
+    statements = load_statements(session, changed)
+    if statements.empty:
+        return 0
+    features = compute_growth_features(statements)
+
+    # Un cambio en el año y sólo afecta a los años >= y de ese símbolo
+    first_year = pd.Series(changed).reindex(features.index.get_level_values('symbol')).to_numpy()
+    features = features[features.index.get_level_values('fiscal_year') >= first_year]
+
+    features = features.astype(object).where(features.notna(), None).reset_index()
+    features['fiscal_year'] = features['fiscal_year'].astype(int)
+    features['fecha_calculo'] = pd.Timestamp.now().isoformat(timespec='seconds')
+    written = bbdd.upsert_rows(session, bbdd.GrowthFeature, features.to_dict('records'))
+    logging.info(f"Growth features written: {written} rows for {len(changed)} symbols")
+    return written
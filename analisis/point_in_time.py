@@ -0,0 +1,209 @@
+"""Point-in-time datasets free of look-ahead bias.
+
+:func:`bbdd.extract_all_data` pairs each fiscal year's statements with
+the prices of the same calendar year, although the filing is only
+public weeks after the year closes. Here every evaluation date only sees
+the statements accepted before it and the last close before it:
+
+* statements are matched with an as-of join on their acceptance time
+  (the filing date plus one day when the acceptance time is missing),
+* prices are looked up with one indexed seek per symbol and date on
+  the ``daily_prices`` primary key, or taken from the
+  previous year's close when only yearly prices are stored.
+
+All evaluation dates are built in a single vectorized pass, so training
+sets for many rebalance dates cost about as much as one. Statements are
+stored in their latest restated form, so restatements are not undone.
+"""
+
+from datetime import timedelta
+from typing import Iterable, List
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, literal, select, true, union_all
+from sqlalchemy.orm import Session
+from conf import *
+import bbdd
+import metricas
+from .ranking import RATIOS, compute_ratios
+
+# Columnas de precio del año natural: son las que introducen el sesgo
+PRECIOS_ANUALES = ['price_first', 'price_last']
+ANTIGUEDAD_MAXIMA_PRECIO = timedelta(days=10)
+TAMANO_LOTE_FECHAS = 400
+
+
+def evaluation_dates(dates: Iterable) -> pd.DatetimeIndex:
+    """Normalize ``dates`` to sorted, unique midnight timestamps."""
+    return pd.DatetimeIndex(pd.to_datetime(list(dates))).normalize().unique().sort_values()
+
+
+def load_statement_history(session: Session) -> pd.DataFrame:
+    """Return every stored statement with the time it became public.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The columns of :func:`bbdd.extract_all_data` without the
+        calendar-year prices, plus ``conocido_desde``, sorted by it.
+        Statements without any filing date are dropped, since when they
+        became known cannot be told.
+    """
+    df = bbdd.extract_all_data(session).drop(columns=PRECIOS_ANUALES)
+    aceptacion = pd.to_datetime(df['fecha_aceptacion'], errors='coerce')
+    presentacion = pd.to_datetime(df['fecha_presentacion'], errors='coerce') + pd.Timedelta(days=1)
+    df['conocido_desde'] = aceptacion.fillna(presentacion)
+    df = df[df['conocido_desde'].notna()].sort_values('conocido_desde', kind='stable')
+    # Una corrección de un año antiguo no sustituye a un año más reciente ya publicado
+    df = df[df['fiscal_year'] >= df.groupby('symbol')['fiscal_year'].cummax()]
+    return df.reset_index(drop=True)
+
+
+def statements_as_of(statements: pd.DataFrame, dates: pd.DatetimeIndex) -> pd.DataFrame:
+    """Pick the latest statement of each symbol known strictly before each date.
+
+    Parameters
+    ----------
+    statements:
+        Output of :func:`load_statement_history`.
+    dates:
+        Evaluation dates from :func:`evaluation_dates`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per symbol and evaluation date with a known statement,
+        with the evaluation date in ``fecha_evaluacion``.
+    """
+    symbols = statements['symbol'].unique()
+    grid = pd.DataFrame({
+        'fecha_evaluacion': np.repeat(dates.to_numpy(), len(symbols)),
+        'symbol': np.tile(symbols, len(dates)),
+    })
+    merged = pd.merge_asof(
+        grid, statements,
+        left_on='fecha_evaluacion', right_on='conocido_desde', by='symbol',
+        allow_exact_matches=False,
+    )
+    return merged[merged['fiscal_year'].notna()].reset_index(drop=True)
+
+
+def daily_prices_as_of(session: Session, dates: pd.DatetimeIndex,
+                       max_age: timedelta = ANTIGUEDAD_MAXIMA_PRECIO) -> pd.DataFrame:
+    """Return each company's last close before every evaluation date.
+
+    Each lookup is a descending seek on the ``(symbol, fecha)`` primary
+    key bounded by ``max_age``, so the cost depends on the number of
+    symbols and dates, not on the length of the history.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns ``fecha_evaluacion``, ``symbol``, ``fecha_precio`` and
+        ``precio``.
+    """
+    frames: List[pd.DataFrame] = []
+    empresas = select(bbdd.Company.symbol).subquery('empresas')
+    precio = bbdd.DailyPrice
+    for batch in bbdd.chunked([d.date().isoformat() for d in dates], TAMANO_LOTE_FECHAS):
+        selects = [select(literal(fecha).label('fecha_evaluacion')) for fecha in batch]
+        fechas = (union_all(*selects) if len(selects) > 1 else selects[0]).subquery('fechas')
+
+        # Subconsultas correlacionadas: sin ellas SQLite recorre toda la tabla de precios
+        def ultimo(column):
+            return select(column).where(
+                precio.symbol == empresas.c.symbol,
+                precio.fecha < fechas.c.fecha_evaluacion,
+                precio.fecha >= func.date(fechas.c.fecha_evaluacion, f'-{max_age.days} days'),
+            ).order_by(precio.fecha.desc()).limit(1).correlate(empresas, fechas).scalar_subquery()
+
+        stmt = select(
+            fechas.c.fecha_evaluacion,
+            empresas.c.symbol,
+            ultimo(precio.fecha).label('fecha_precio'),
+            ultimo(precio.close).label('precio'),
+        ).select_from(fechas).join(empresas, true())
+        frame = pd.read_sql(stmt, session.bind)
+        frames.append(frame[frame['fecha_precio'].notna()])
+    if not frames:
+        return pd.DataFrame(columns=['fecha_evaluacion', 'symbol', 'fecha_precio', 'precio'])
+    prices = pd.concat(frames, ignore_index=True)
+    prices['fecha_evaluacion'] = pd.to_datetime(prices['fecha_evaluacion'])
+    prices['fecha_precio'] = pd.to_datetime(prices['fecha_precio'])
+    return prices
+
+
+def yearly_prices_as_of(session: Session, dates: pd.DatetimeIndex) -> pd.DataFrame:
+    """Return the previous calendar year's close for every evaluation date.
+
+    Used when no daily prices are stored: the close of year ``Y - 1`` is
+    the last price certainly known on any date of year ``Y``.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Same columns as :func:`daily_prices_as_of`.
+    """
+    query = session.query(bbdd.FiscalYear.symbol, bbdd.FiscalYear.fiscal_year, bbdd.FiscalYear.price_last)\
+        .filter(bbdd.FiscalYear.fiscal_year.in_(sorted({d.year - 1 for d in dates})))
+    yearly = pd.read_sql(query.statement, session.bind)
+    grid = pd.DataFrame({'fecha_evaluacion': dates, 'fiscal_year': dates.year - 1})
+    prices = grid.merge(yearly, on='fiscal_year')
+    prices['fecha_precio'] = pd.to_datetime(prices['fiscal_year'].astype(str) + '-12-31')
+    return prices.rename(columns={'price_last': 'precio'})[['fecha_evaluacion', 'symbol', 'fecha_precio', 'precio']]
+
+
+def build_point_in_time(session: Session, dates: Iterable, prices: str = 'daily',
+                        max_price_age: timedelta = ANTIGUEDAD_MAXIMA_PRECIO) -> pd.DataFrame:
+    """Build leak-free features for every symbol at every evaluation date.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for querying.
+    dates:
+        Evaluation (rebalance) dates. Only data public before each date
+        is used.
+    prices:
+        ``'daily'`` for the last stored close before the date or
+        ``'yearly'`` for the previous year-end close.
+    max_price_age:
+        Daily closes older than this are treated as missing.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per ``(fecha_evaluacion, symbol)`` with the statement
+        columns of the latest known fiscal year, ``conocido_desde``,
+        ``precio``, ``fecha_precio``, the ratios of
+        :data:`analisis.ranking.RATIOS` at that price, and
+        ``rentabilidad_siguiente``: the return until the next evaluation
+        date, meant as the training target.
+    """
+    dates = evaluation_dates(dates)
+    statements = load_statement_history(session)
+    if statements.empty or not len(dates):
+        return pd.DataFrame()
+
+    with metricas.timed('point_in_time', stage='statements'):
+        df = statements_as_of(statements, dates)
+    with metricas.timed('point_in_time', stage='prices'):
+        if prices == 'daily':
+            precios = daily_prices_as_of(session, dates, max_price_age)
+        elif prices == 'yearly':
+            precios = yearly_prices_as_of(session, dates)
+        else:
+            raise ValueError(f"Unknown price source: {prices}")
+    df = df.merge(precios, on=['fecha_evaluacion', 'symbol'], how='left')
+    df['fiscal_year'] = df['fiscal_year'].astype('int64')
+
+    ratios = compute_ratios(df.assign(price_last=df['precio']))
+    df[RATIOS] = ratios[RATIOS]
+
+    # Objetivo: rentabilidad hasta la siguiente fecha de evaluación
+    df['fecha_siguiente'] = df['fecha_evaluacion'].map(dict(zip(dates[:-1], dates[1:])))
+    siguiente = precios.rename(columns={'fecha_evaluacion': 'fecha_siguiente', 'precio': 'precio_siguiente'})
+    df = df.merge(siguiente[['fecha_siguiente', 'symbol', 'precio_siguiente']], on=['fecha_siguiente', 'symbol'], how='left')
+    df['rentabilidad_siguiente'] = (df['precio_siguiente'] / df['precio'] - 1).replace([np.inf, -np.inf], np.nan)
+    return df.drop(columns=['fecha_siguiente', 'precio_siguiente'])\
+        .sort_values(['fecha_evaluacion', 'symbol'], ignore_index=True)
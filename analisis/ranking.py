@@ -0,0 +1,208 @@
+"""Cross-sectional ranking of valuation ratios within sector and year.
+
+Percentile ranks and z-scores are computed for every ``(sector,
+fiscal_year)`` group in one grouped pass and cached in the
+``sector_ranks`` table. Only groups touched by new rows, by statements or
+prices stored after the group was ranked, or by companies changing
+sector are recomputed on refresh.
+"""
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+import pandas as pd
+from sqlalchemy import and_, func, or_, tuple_
+from sqlalchemy.orm import Session
+from conf import *
+import bbdd
+
+RATIOS = ['per', 'pfcf', 'pb', 'ps', 'ev_ebit']
+
+Group = Tuple[Optional[str], int]
+
+
+def compute_ratios(df: pd.DataFrame) -> pd.DataFrame:
+    """Vectorized equivalent of the ``FiscalYear`` ratio properties.
+
+    Parameters
+    ----------
+    df:
+        Frame with the price, share count and statement columns used by
+        :class:`bbdd.FiscalYear`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One column per name in :data:`RATIOS`, ``NaN`` where the
+        property would return ``None``.
+    """
+    market_cap = df['price_last'] * df['acciones_promedio']
+    enterprise_value = (
+        market_cap.fillna(0)
+        + df['total_deuda'].fillna(0)
+        - df['efectivo_y_equivalentes'].fillna(0)
+    )
+    ratios = pd.DataFrame({
+        'per': market_cap / df['ingreso_neto'],
+        'pfcf': market_cap / df['flujo_libre_caja'],
+        'pb': market_cap / df['total_patrimonio_accionistas'],
+        'ps': market_cap / df['ingresos'],
+        'ev_ebit': enterprise_value / df['ingreso_operativo'],
+    }, index=df.index)
+    return ratios.replace([np.inf, -np.inf], np.nan)
+
+
+def rank_groups(df: pd.DataFrame) -> pd.DataFrame:
+    """Add ``<ratio>_percentil`` and ``<ratio>_zscore`` columns per group."""
+    grouped = df.groupby(['sector', 'fiscal_year'], dropna=False)[RATIOS]
+    percentiles = grouped.rank(pct=True)
+    mean = grouped.transform('mean')
+    std = grouped.transform('std', ddof=0).replace(0, np.nan)
+    zscores = (df[RATIOS] - mean) / std
+    out = df[['symbol', 'fiscal_year', 'sector'] + RATIOS].copy()
+    for ratio in RATIOS:
+        out[f'{ratio}_percentil'] = percentiles[ratio]
+        out[f'{ratio}_zscore'] = zscores[ratio]
+    return out
+
+
+def _group_filter(column_sector, column_year, groups: Iterable[Group]):
+    """Return a SQL condition matching any of ``groups``."""
+    groups = list(groups)
+    conditions = [tuple_(column_sector, column_year).in_([g for g in groups if g[0] is not None])]
+    null_years = [year for sector, year in groups if sector is None]
+    if null_years:
+        conditions.append(and_(column_sector.is_(None), column_year.in_(null_years)))
+    return or_(*conditions)
+
+
+def load_ratio_inputs(session: Session, groups: Iterable[Group]) -> pd.DataFrame:
+    """Load the ratio inputs of every company in ``groups``."""
+    frames: List[pd.DataFrame] = []
+    for batch in bbdd.chunked(sorted(groups, key=lambda g: (g[0] or '', g[1])), 400):
+        query = session.query(
+            bbdd.FiscalYear.symbol,
+            bbdd.FiscalYear.fiscal_year,
+            bbdd.Company.sector,
+            bbdd.FiscalYear.price_last,
+            bbdd.IncomeStatement.acciones_promedio,
+            bbdd.IncomeStatement.ingreso_neto,
+            bbdd.IncomeStatement.ingresos,
+            bbdd.IncomeStatement.ingreso_operativo,
+            bbdd.CashFlow.flujo_libre_caja,
+            bbdd.BalanceSheet.total_patrimonio_accionistas,
+            bbdd.BalanceSheet.total_deuda,
+            bbdd.BalanceSheet.efectivo_y_equivalentes,
+        ).join(bbdd.Company, bbdd.Company.symbol == bbdd.FiscalYear.symbol)\
+         .outerjoin(bbdd.IncomeStatement, and_(bbdd.FiscalYear.symbol == bbdd.IncomeStatement.symbol, bbdd.FiscalYear.fiscal_year == bbdd.IncomeStatement.fiscal_year))\
+         .outerjoin(bbdd.CashFlow, and_(bbdd.FiscalYear.symbol == bbdd.CashFlow.symbol, bbdd.FiscalYear.fiscal_year == bbdd.CashFlow.fiscal_year))\
+         .outerjoin(bbdd.BalanceSheet, and_(bbdd.FiscalYear.symbol == bbdd.BalanceSheet.symbol, bbdd.FiscalYear.fiscal_year == bbdd.BalanceSheet.fiscal_year))\
+         .filter(_group_filter(bbdd.Company.sector, bbdd.FiscalYear.fiscal_year, batch))
+        frames.append(pd.read_sql(query.statement, session.bind))
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+def stale_groups(session: Session) -> Set[Group]:
+    """Return the groups with unranked rows, newer data or companies that changed sector.
+
+    A ranked group is stale when a statement of one of its members
+    (``statement_hashes``) or its price metrics (``fiscal_year``) were
+    stored at or after the group was ranked.
+    """
+    new_rows = session.query(bbdd.Company.sector, bbdd.FiscalYear.fiscal_year)\
+        .join(bbdd.FiscalYear, bbdd.Company.symbol == bbdd.FiscalYear.symbol)\
+        .outerjoin(bbdd.SectorRank, and_(bbdd.FiscalYear.symbol == bbdd.SectorRank.symbol, bbdd.FiscalYear.fiscal_year == bbdd.SectorRank.fiscal_year))\
+        .filter(bbdd.SectorRank.symbol.is_(None))\
+        .distinct().all()
+    moved = session.query(bbdd.SectorRank.sector, bbdd.Company.sector, bbdd.SectorRank.fiscal_year)\
+        .join(bbdd.Company, bbdd.Company.symbol == bbdd.SectorRank.symbol)\
+        .filter(bbdd.SectorRank.sector.is_distinct_from(bbdd.Company.sector))\
+        .distinct().all()
+    calculados = session.query(
+        bbdd.SectorRank.sector.label('sector'),
+        bbdd.SectorRank.fiscal_year.label('fiscal_year'),
+        func.min(bbdd.SectorRank.fecha_calculo).label('fecha_calculo'),
+    ).group_by(bbdd.SectorRank.sector, bbdd.SectorRank.fiscal_year).subquery('calculados')
+    # Marcas de segundo: a igualdad se recalcula para no perder una escritura
+    updated = session.query(calculados.c.sector, calculados.c.fiscal_year)\
+        .join(bbdd.FiscalYear, bbdd.FiscalYear.fiscal_year == calculados.c.fiscal_year)\
+        .join(bbdd.Company, and_(bbdd.Company.symbol == bbdd.FiscalYear.symbol, bbdd.Company.sector.is_not_distinct_from(calculados.c.sector)))\
+        .outerjoin(bbdd.StatementHash, and_(bbdd.FiscalYear.symbol == bbdd.StatementHash.symbol, bbdd.FiscalYear.fiscal_year == bbdd.StatementHash.fiscal_year))\
+        .filter(or_(
+            bbdd.FiscalYear.fecha_actualizacion >= calculados.c.fecha_calculo,
+            bbdd.StatementHash.fecha_actualizacion >= calculados.c.fecha_calculo,
+        )).distinct().all()
+    groups = {(sector, year) for sector, year in new_rows}
+    groups.update((sector, year) for sector, year in updated)
+    for old_sector, new_sector, year in moved:
+        groups.add((old_sector, year))
+        groups.add((new_sector, year))
+    return groups
+
+
+def changed_groups(session: Session, changed: Dict[str, int]) -> Set[Group]:
+    """Return the groups of every symbol in ``changed`` from its first changed year on."""
+    groups: Set[Group] = set()
+    for batch in bbdd.chunked(sorted(changed), 500):
+        rows = session.query(bbdd.FiscalYear.symbol, bbdd.Company.sector, bbdd.FiscalYear.fiscal_year)\
+            .join(bbdd.Company, bbdd.Company.symbol == bbdd.FiscalYear.symbol)\
+            .filter(bbdd.FiscalYear.symbol.in_(batch))
+        groups.update((sector, year) for symbol, sector, year in rows if year >= changed[symbol])
+    return groups
+
+
+def refresh_sector_ranks(session: Session, groups: Optional[Iterable[Group]] = None,
+                         changed: Optional[Dict[str, int]] = None) -> int:
+    """Recompute the cached ranks of the given or stale groups.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for querying and persistence.
+    groups:
+        ``(sector, fiscal_year)`` pairs to recompute.
+    changed:
+        Mapping of symbol to the first fiscal year whose data changed;
+        the groups of those years are recomputed too. When neither
+        ``groups`` nor ``changed`` is given, :func:`stale_groups` decides
+        which groups are out of date.
+
+    Returns
+    -------
+    int
+        Number of ranked rows written.
+    """
+    if groups is None and changed is None:
+        groups = stale_groups(session)
+    groups = set(groups or ()) | changed_groups(session, changed or {})
+    if not groups:
+        logging.info("Sector ranks are up to date.")
+        return 0
+
+    df = load_ratio_inputs(session, groups)
+    ranked = rank_groups(pd.concat([df, compute_ratios(df)], axis=1)) if not df.empty else df
+
+    for batch in bbdd.chunked(list(groups), 400):
+        session.query(bbdd.SectorRank)\
+            .filter(_group_filter(bbdd.SectorRank.sector, bbdd.SectorRank.fiscal_year, batch))\
+            .delete(synchronize_session=False)
+    if ranked.empty:
+        session.commit()
+        return 0
+
+    ranked = ranked.astype(object).where(ranked.notna(), None)
+    ranked['fiscal_year'] = ranked['fiscal_year'].astype(int)
+    ranked['fecha_calculo'] = pd.Timestamp.now().isoformat(timespec='seconds')
+    written = bbdd.upsert_rows(session, bbdd.SectorRank, ranked.to_dict('records'))
+    logging.info(f"Sector ranks written: {written} rows in {len(groups)} groups")
+    return written
+
+
+@bbdd.cached_query('sector_ranks')
+def sector_percentiles(session: Session, fiscal_year: int, sector: Optional[str] = None) -> pd.DataFrame:
+    """Return the cached ranks of a year, optionally for a single sector."""
+    query = session.query(bbdd.SectorRank).filter(bbdd.SectorRank.fiscal_year == fiscal_year)
+    if sector is not None:
+        query = query.filter(bbdd.SectorRank.sector == sector)
+    return pd.read_sql(query.statement, session.bind)
@@ -0,0 +1,361 @@
+"""Yearly risk metrics from the stored daily prices.
+
+``fiscal_year`` only keeps simple yearly price statistics. Here every
+``(symbol, calendar year)`` gets its total return, annualized volatility,
+downside deviation, maximum drawdown and beta against a benchmark index.
+All symbols of a batch are processed at once with grouped pandas
+operations: returns come from a shift within each symbol, the drawdown
+from a cumulative maximum within each year and the beta from grouped sums
+of the paired returns, so there is no loop over symbols.
+
+Only the years whose last stored trading day changed since the metrics
+were computed are rewritten. The benchmark series is stored in
+``benchmark_returns``; when a year of it changes, which happens with the
+equal-weighted index whenever any symbol gets new prices, the metrics of
+every symbol in that year are rewritten too.
+"""
+
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from sqlalchemy import Integer, and_, cast, delete, func, or_, select
+from sqlalchemy.orm import Session
+from conf import *
+import bbdd
+import metricas
+
+DIAS_BURSATILES = 252
+# Por debajo de este número de rentabilidades diarias las métricas no se publican
+MIN_DIAS = 20
+TAMANO_LOTE_SIMBOLOS = 250
+METRICAS = ['rentabilidad_anual', 'volatilidad_anual', 'desviacion_bajista', 'max_drawdown', 'beta']
+INDICE_EQUIPONDERADO = 'equiponderado'
+# Diferencia a partir de la cual una rentabilidad guardada del índice cambió
+TOLERANCIA_INDICE = 1e-12
+
+
+def _year(column):
+    return cast(func.substr(column, 1, 4), Integer)
+
+
+def _price():
+    # El cierre ajustado evita caídas ficticias en los splits
+    return func.coalesce(bbdd.DailyPrice.adj_close, bbdd.DailyPrice.close)
+
+
+def load_prices(session: Session, symbols: List[str], since: str) -> pd.DataFrame:
+    """Return the daily prices of ``symbols`` from ``since`` on.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns ``symbol``, ``fecha`` (datetime) and ``precio``, sorted by
+        symbol and date. ``precio`` is the adjusted close when stored.
+    """
+    query = select(bbdd.DailyPrice.symbol, bbdd.DailyPrice.fecha, _price().label('precio'))\
+        .where(bbdd.DailyPrice.symbol.in_(symbols), bbdd.DailyPrice.fecha >= since)\
+        .order_by(bbdd.DailyPrice.symbol, bbdd.DailyPrice.fecha)
+    df = pd.DataFrame(session.execute(query).all(), columns=['symbol', 'fecha', 'precio'])
+    df['fecha'] = pd.to_datetime(df['fecha'])
+    df['precio'] = df['precio'].astype('float64')
+    return df
+
+
+def _since(year: int) -> str:
+    # La rentabilidad del primer día necesita el último cierre del año anterior
+    return f'{year - 1}-12-01'
+
+
+def benchmark_index(session: Session, symbol: Optional[str] = None) -> str:
+    """Return the name of the benchmark index in use.
+
+    ``symbol`` when it has stored daily prices, otherwise
+    :data:`INDICE_EQUIPONDERADO`.
+    """
+    if symbol:
+        query = select(bbdd.DailyPrice.fecha).where(bbdd.DailyPrice.symbol == symbol).limit(1)
+        if session.execute(query).first() is not None:
+            return symbol
+        logging.warning(f"No daily prices stored for benchmark {symbol}; using an equal-weighted index")
+    return INDICE_EQUIPONDERADO
+
+
+def benchmark_returns(session: Session, since: str, symbol: Optional[str] = None) -> pd.Series:
+    """Return the daily returns of the benchmark index from ``since`` on.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for querying.
+    since:
+        First trading day (``YYYY-MM-DD``).
+    symbol:
+        Index whose daily prices are stored. When missing, or when it has
+        no stored prices, the equal-weighted mean of the daily returns of
+        every stored symbol is used.
+
+    Returns
+    -------
+    pandas.Series
+        Returns indexed by date.
+    """
+    if symbol:
+        prices = load_prices(session, [symbol], since)
+        if len(prices) > 1:
+            return prices.set_index('fecha')['precio'].pct_change().iloc[1:]
+        logging.warning(f"No daily prices stored for benchmark {symbol}; using an equal-weighted index")
+
+    # Rentabilidad de cada símbolo con LAG, agregada por día en la propia base de datos
+    anterior = func.lag(_price()).over(partition_by=bbdd.DailyPrice.symbol, order_by=bbdd.DailyPrice.fecha)
+    diarias = select(
+        bbdd.DailyPrice.fecha.label('fecha'),
+        (_price() / anterior - 1).label('rentabilidad'),
+    ).where(bbdd.DailyPrice.fecha >= since).subquery('diarias')
+    query = select(diarias.c.fecha, func.avg(diarias.c.rentabilidad))\
+        .where(diarias.c.rentabilidad.isnot(None)).group_by(diarias.c.fecha).order_by(diarias.c.fecha)
+    rows = session.execute(query).all()
+    return pd.Series([float(r) for _, r in rows], index=pd.to_datetime([f for f, _ in rows]), dtype='float64')
+
+
+def compute_risk_metrics(prices: pd.DataFrame, benchmark: pd.Series) -> pd.DataFrame:
+    """Compute the yearly risk metrics of every symbol in ``prices``.
+
+    Parameters
+    ----------
+    prices:
+        Output of :func:`load_prices`, sorted by symbol and date.
+    benchmark:
+        Daily returns of the index, indexed by date.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Indexed by ``(symbol, fiscal_year)`` with the columns of
+        :data:`METRICAS`, ``dias`` and ``ultima_fecha``. A return belongs
+        to the year of the day it ends on, so the first return of a year
+        starts at the previous year's last close.
+    """
+    df = prices[['symbol', 'fecha', 'precio']].copy()
+    df['fiscal_year'] = df['fecha'].dt.year
+    nuevo_simbolo = df['symbol'].ne(df['symbol'].shift())
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df['r'] = (df['precio'] / df['precio'].shift() - 1).mask(nuevo_simbolo)
+    df['r'] = df['r'].replace([np.inf, -np.inf], np.nan)
+    df['m'] = benchmark.reindex(df['fecha']).to_numpy()
+
+    grupos = [df['symbol'], df['fiscal_year']]
+    pico = df.groupby(grupos)['precio'].cummax()
+    df['drawdown'] = df['precio'] / pico - 1
+    df['log_r'] = np.log1p(df['r'])
+    df['bajista'] = np.minimum(df['r'], 0) ** 2
+
+    # Sumas de los pares (r, m) con ambos valores para la covarianza
+    pares = df['r'].notna() & df['m'].notna()
+    df['pr'] = df['r'].where(pares)
+    df['pm'] = df['m'].where(pares)
+    df['prm'] = df['pr'] * df['pm']
+    df['pmm'] = df['pm'] ** 2
+
+    agg = df.groupby(grupos).agg(
+        dias=('r', 'count'),
+        ultima_fecha=('fecha', 'max'),
+        volatilidad=('r', 'std'),
+        bajista=('bajista', 'mean'),
+        log_r=('log_r', 'sum'),
+        max_drawdown=('drawdown', 'min'),
+        n=('pr', 'count'),
+        sr=('pr', 'sum'),
+        sm=('pm', 'sum'),
+        srm=('prm', 'sum'),
+        smm=('pmm', 'sum'),
+    )
+    out = pd.DataFrame(index=agg.index)
+    anual = np.sqrt(DIAS_BURSATILES)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out['rentabilidad_anual'] = np.expm1(agg['log_r'])
+        out['volatilidad_anual'] = agg['volatilidad'] * anual
+        out['desviacion_bajista'] = np.sqrt(agg['bajista']) * anual
+        out['max_drawdown'] = agg['max_drawdown']
+        covarianza = agg['srm'] - agg['sr'] * agg['sm'] / agg['n']
+        varianza = agg['smm'] - agg['sm'] ** 2 / agg['n']
+        out['beta'] = (covarianza / varianza).where(agg['n'] >= MIN_DIAS)
+    out[METRICAS] = out[METRICAS].where(agg['dias'] >= MIN_DIAS).replace([np.inf, -np.inf], np.nan)
+    out['dias'] = agg['dias']
+    out['ultima_fecha'] = agg['ultima_fecha'].dt.strftime('%Y-%m-%d')
+    return out
+
+
+def load_benchmark(session: Session, indice: str, since: str) -> pd.Series:
+    """Return the stored daily returns of ``indice`` from ``since`` on, indexed by date."""
+    query = select(bbdd.BenchmarkReturn.fecha, bbdd.BenchmarkReturn.rentabilidad)\
+        .where(bbdd.BenchmarkReturn.indice == indice, bbdd.BenchmarkReturn.fecha >= since)\
+        .order_by(bbdd.BenchmarkReturn.fecha)
+    rows = session.execute(query).all()
+    return pd.Series([r for _, r in rows], index=pd.to_datetime([f for f, _ in rows]), dtype='float64')
+
+
+def update_benchmark(session: Session, indice: str, year: int) -> List[int]:
+    """Recompute the stored returns of ``indice`` from ``year`` on.
+
+    Only the years where a day was added, removed or changed are
+    rewritten, all their rows with the same ``fecha_calculo``.
+
+    Returns
+    -------
+    List[int]
+        Years rewritten.
+    """
+    nuevo = benchmark_returns(session, _since(year), None if indice == INDICE_EQUIPONDERADO else indice)
+    nuevo = nuevo[nuevo.index.year >= year]
+    guardado = load_benchmark(session, indice, f'{year}-01-01')
+    dias = nuevo.index.union(guardado.index)
+    iguales = np.isclose(nuevo.reindex(dias), guardado.reindex(dias), rtol=0, atol=TOLERANCIA_INDICE, equal_nan=True)
+    anios = sorted({int(y) for y in dias[~iguales].year})
+    if not anios:
+        return []
+
+    nuevo = nuevo[nuevo.index.year.isin(anios)]
+    rows = [{
+        'indice': indice, 'fecha': fecha.strftime('%Y-%m-%d'),
+        'rentabilidad': None if pd.isna(r) else float(r),
+        'fecha_calculo': pd.Timestamp.now().isoformat(timespec='seconds'),
+    } for fecha, r in nuevo.items()]
+    try:
+        for anio in anios:
+            session.execute(delete(bbdd.BenchmarkReturn).where(
+                bbdd.BenchmarkReturn.indice == indice,
+                bbdd.BenchmarkReturn.fecha >= f'{anio}-01-01', bbdd.BenchmarkReturn.fecha < f'{anio + 1}-01-01',
+            ))
+        bbdd.upsert_rows(session, bbdd.BenchmarkReturn, rows, commit=False)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    logging.info(f"Benchmark {indice} rewritten for {len(anios)} years from {anios[0]}")
+    return anios
+
+
+def _benchmark_years(indice: str):
+    anio = _year(bbdd.BenchmarkReturn.fecha)
+    return select(anio.label('fiscal_year'), func.max(bbdd.BenchmarkReturn.fecha_calculo).label('fecha_calculo'))\
+        .where(bbdd.BenchmarkReturn.indice == indice).group_by(anio)
+
+
+def stale_years(session: Session, indice: str) -> Dict[str, int]:
+    """Return the first year of each symbol whose beta used another version of the benchmark.
+
+    Every metric row keeps in ``fecha_indice`` the ``fecha_calculo`` of
+    the benchmark year it was computed with; a rewritten year no longer
+    matches it.
+    """
+    escritos = _benchmark_years(indice).subquery('indice')
+    query = select(bbdd.RiskMetric.symbol, func.min(bbdd.RiskMetric.fiscal_year))\
+        .join(escritos, escritos.c.fiscal_year == bbdd.RiskMetric.fiscal_year)\
+        .where(or_(
+            bbdd.RiskMetric.fecha_indice.is_(None),
+            bbdd.RiskMetric.fecha_indice != escritos.c.fecha_calculo,
+        )).group_by(bbdd.RiskMetric.symbol)
+    return {symbol: int(year) for symbol, year in session.execute(query)}
+
+
+def pending_years(session: Session, symbols: Optional[List[str]] = None) -> Dict[str, int]:
+    """Return the first year with new daily prices for each symbol.
+
+    A year is pending when it has no metrics or when its last stored
+    trading day differs from the one the metrics were computed with.
+    Without ``symbols`` every stored price is read; with them only their
+    ranges of the ``(symbol, fecha)`` primary key are.
+    """
+    if symbols is not None:
+        pendientes: Dict[str, int] = {}
+        for batch in bbdd.chunked(sorted(symbols), TAMANO_LOTE_SIMBOLOS):
+            pendientes.update(_pending_years(session, batch))
+        return pendientes
+    return _pending_years(session)
+
+
+def _pending_years(session: Session, symbols: Optional[List[str]] = None) -> Dict[str, int]:
+    anios = select(
+        bbdd.DailyPrice.symbol.label('symbol'),
+        _year(bbdd.DailyPrice.fecha).label('fiscal_year'),
+        func.max(bbdd.DailyPrice.fecha).label('ultima_fecha'),
+    )
+    if symbols is not None:
+        anios = anios.where(bbdd.DailyPrice.symbol.in_(symbols))
+    anios = anios.group_by(bbdd.DailyPrice.symbol, _year(bbdd.DailyPrice.fecha)).subquery('anios')
+    query = select(anios.c.symbol, func.min(anios.c.fiscal_year))\
+        .outerjoin(bbdd.RiskMetric, and_(
+            anios.c.symbol == bbdd.RiskMetric.symbol,
+            anios.c.fiscal_year == bbdd.RiskMetric.fiscal_year,
+        )).where(or_(
+            bbdd.RiskMetric.symbol.is_(None),
+            bbdd.RiskMetric.ultima_fecha != anios.c.ultima_fecha,
+        )).group_by(anios.c.symbol)
+    return {symbol: int(year) for symbol, year in session.execute(query)}
+
+
+def refresh_risk_metrics(session: Session, changed: Optional[Dict[str, int]] = None,
+                         benchmark: Optional[str] = None) -> int:
+    """Recompute and store the risk metrics of years with new daily prices.
+
+    The benchmark series is brought up to date first, and every year
+    where it changed is recomputed for all symbols, since their ``beta``
+    depends on it.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for querying and persistence.
+    changed:
+        Symbols written since the last refresh (mapping of symbol to its
+        first changed year). Only their prices are checked with
+        :func:`pending_years`; when omitted, every symbol is.
+    benchmark:
+        Index symbol for ``beta`` (default: ``BENCHMARK_SYMBOL``).
+
+    Returns
+    -------
+    int
+        Number of metric rows written.
+    """
+    with metricas.timed('risk_metrics', stage='pending'):
+        changed = pending_years(session, None if changed is None else list(changed))
+    indice = benchmark_index(session, benchmark or settings.benchmark_symbol)
+    with metricas.timed('risk_metrics', stage='benchmark'):
+        desde = list(changed.values())
+        guardado = select(bbdd.BenchmarkReturn.fecha).where(bbdd.BenchmarkReturn.indice == indice).limit(1)
+        if session.execute(guardado).first() is None:
+            # Índice sin serie guardada (primera ejecución o nuevo BENCHMARK_SYMBOL): se guarda entera
+            primero = session.execute(select(func.min(bbdd.RiskMetric.fiscal_year))).scalar()
+            desde += [] if primero is None else [int(primero)]
+        if desde:
+            update_benchmark(session, indice, min(desde))
+        for symbol, year in stale_years(session, indice).items():
+            changed[symbol] = min(year, changed.get(symbol, year))
+    if not changed:
+        logging.info("Risk metrics are up to date.")
+        return 0
+    serie = load_benchmark(session, indice, _since(min(changed.values())))
+    versiones = dict(session.execute(_benchmark_years(indice)).all())
+
+    written = 0
+    fecha_calculo = pd.Timestamp.now().isoformat(timespec='seconds')
+    # Ordenados por año para que cada lote lea sólo el historial que necesita
+    ordenados = sorted(changed, key=lambda symbol: (changed[symbol], symbol))
+    for batch in bbdd.chunked(ordenados, TAMANO_LOTE_SIMBOLOS):
+        with metricas.timed('risk_metrics', stage='compute'):
+            prices = load_prices(session, batch, _since(min(changed[s] for s in batch)))
+            if prices.empty:
+                continue
+            risk = compute_risk_metrics(prices, serie)
+            first_year = pd.Series(changed).reindex(risk.index.get_level_values('symbol')).to_numpy()
+            risk = risk[risk.index.get_level_values('fiscal_year') >= first_year]
+
+        rows = risk.astype(object).where(risk.notna(), None).reset_index()
+        rows['fiscal_year'] = rows['fiscal_year'].astype(int)
+        rows['dias'] = rows['dias'].astype(int)
+        rows['fecha_calculo'] = fecha_calculo
+        rows['fecha_indice'] = rows['fiscal_year'].map(versiones).astype(object).where(lambda v: v.notna(), None)
+        written += bbdd.upsert_rows(session, bbdd.RiskMetric, rows.to_dict('records'))
+    logging.info(f"Risk metrics written: {written} rows for {len(changed)} symbols")
+    return written
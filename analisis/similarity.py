@@ -0,0 +1,471 @@
+"""Comparable companies by their fundamentals.
+
+Every ``(symbol, fiscal_year)`` is described by a vector of scale-free
+fundamentals (size, margins, returns, leverage, growth). Each feature is
+centred on its median and divided by its robust spread, clipped and
+stored as ``float32`` in a flat file that is memory-mapped for search:
+
+* ``vectores-<generacion>.f32``: one row of :data:`FEATURES` per indexed
+  key. Every update writes a new generation instead of changing rows in
+  place, so open readers keep a consistent snapshot.
+* ``indice.json``: keys, the source timestamp of each key, feature names,
+  scaling parameters and the name of the vector file. It is replaced
+  atomically after the vectors are written and is the commit point of
+  an update; the previous vector file is kept for readers that loaded
+  the previous manifest.
+
+Searches are exact: squared euclidean distances to every row come from a
+blocked matrix product against the precomputed row norms, and the best
+``k`` of each block are kept with ``argpartition``. Keys whose statements
+or growth features were stored after they were indexed (new filings,
+late statements, restatements, including keys skipped for missing data)
+are vectorized again with the stored scaling; :func:`build_index` refits
+the scaling from scratch.
+"""
+
+import json
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session
+from conf import *
+import bbdd
+import metricas
+
+# Nombre del fichero de vectores de los índices sin generaciones
+VECTORES = 'vectores.f32'
+MANIFEST = 'indice.json'
+# Filas por bloque del producto matricial
+TAMANO_BLOQUE = 65536
+# Las desviaciones robustas se recortan para que un valor extremo no domine la distancia
+CORTE = 4.0
+# Mínimo de características presentes para indexar un año
+MIN_PRESENTES = 6
+FEATURES = [
+    'log_ingresos', 'log_activos',
+    'margen_bruto', 'margen_operativo', 'margen_neto', 'margen_flujo_libre',
+    'roe', 'roa', 'rotacion_activos',
+    'apalancamiento', 'deuda_neta_activos', 'liquidez',
+    'intensidad_id', 'intensidad_capex',
+    'crecimiento_ingresos', 'cagr_ingresos_3a',
+]
+
+
+def _signed_log(values: pd.Series) -> pd.Series:
+    return np.sign(values) * np.log1p(values.abs())
+
+
+def load_fundamentals(session: Session, symbols: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """Load the statement columns of the vectors, indexed by ``(symbol, fiscal_year)``.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for querying.
+    symbols:
+        Symbols to load; every symbol when omitted.
+    """
+    def query(batch: Optional[List[str]]):
+        q = session.query(
+            bbdd.IncomeStatement.symbol,
+            bbdd.IncomeStatement.fiscal_year,
+            bbdd.IncomeStatement.ingresos,
+            bbdd.IncomeStatement.margen_ganancia_bruta,
+            bbdd.IncomeStatement.margen_ingreso_operativo,
+            bbdd.IncomeStatement.margen_ingreso_neto,
+            bbdd.IncomeStatement.ingreso_neto,
+            bbdd.IncomeStatement.gastos_investigacion_desarrollo,
+            bbdd.BalanceSheet.total_activos,
+            bbdd.BalanceSheet.total_activos_corrientes,
+            bbdd.BalanceSheet.total_pasivos_corrientes,
+            bbdd.BalanceSheet.total_pasivos,
+            bbdd.BalanceSheet.total_patrimonio_accionistas,
+            bbdd.BalanceSheet.deuda_neta,
+            bbdd.CashFlow.flujo_libre_caja,
+            bbdd.CashFlow.inversiones_propiedad_planta_y_equipo,
+            bbdd.GrowthFeature.crecimiento_ingresos,
+            bbdd.GrowthFeature.cagr_ingresos_3a,
+        )
+        for model in (bbdd.BalanceSheet, bbdd.CashFlow, bbdd.GrowthFeature):
+            q = q.outerjoin(model, and_(
+                bbdd.IncomeStatement.symbol == model.symbol,
+                bbdd.IncomeStatement.fiscal_year == model.fiscal_year,
+            ))
+        if batch is not None:
+            q = q.filter(bbdd.IncomeStatement.symbol.in_(batch))
+        return pd.read_sql(q.statement, session.bind)
+
+    if symbols is None:
+        frames = [query(None)]
+    else:
+        frames = [query(batch) for batch in bbdd.chunked(sorted(symbols), 500)]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if df.empty:
+        return df
+    df = df.loc[:, ~df.columns.duplicated()]
+    return df.set_index(['symbol', 'fiscal_year']).astype('float64').sort_index()
+
+
+def compute_fundamental_features(statements: pd.DataFrame) -> pd.DataFrame:
+    """Derive the raw (unscaled) :data:`FEATURES` from :func:`load_fundamentals`."""
+    s = statements
+    out = pd.DataFrame(index=s.index)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out['log_ingresos'] = _signed_log(s['ingresos'])
+        out['log_activos'] = _signed_log(s['total_activos'])
+        out['margen_bruto'] = s['margen_ganancia_bruta']
+        out['margen_operativo'] = s['margen_ingreso_operativo']
+        out['margen_neto'] = s['margen_ingreso_neto']
+        out['margen_flujo_libre'] = s['flujo_libre_caja'] / s['ingresos']
+        out['roe'] = s['ingreso_neto'] / s['total_patrimonio_accionistas']
+        out['roa'] = s['ingreso_neto'] / s['total_activos']
+        out['rotacion_activos'] = s['ingresos'] / s['total_activos']
+        out['apalancamiento'] = s['total_pasivos'] / s['total_activos']
+        out['deuda_neta_activos'] = s['deuda_neta'] / s['total_activos']
+        out['liquidez'] = s['total_activos_corrientes'] / s['total_pasivos_corrientes']
+        out['intensidad_id'] = s['gastos_investigacion_desarrollo'] / s['ingresos']
+        out['intensidad_capex'] = s['inversiones_propiedad_planta_y_equipo'].abs() / s['ingresos']
+        out['crecimiento_ingresos'] = s['crecimiento_ingresos']
+        out['cagr_ingresos_3a'] = s['cagr_ingresos_3a']
+    return out[FEATURES].replace([np.inf, -np.inf], np.nan)
+
+
+def fit_scaling(features: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the median and the robust spread (IQR / 1.349) of every feature."""
+    centro = features.median().fillna(0.0)
+    escala = (features.quantile(0.75) - features.quantile(0.25)) / 1.349
+    escala = escala.where(escala > 0, features.std()).where(lambda e: e > 0, 1.0).fillna(1.0)
+    return centro.to_numpy('float64'), escala.to_numpy('float64')
+
+
+def scale_features(features: pd.DataFrame, centro: np.ndarray, escala: np.ndarray) -> np.ndarray:
+    """Scale, clip and fill ``features`` into a ``float32`` matrix; missing values become 0 (the median)."""
+    z = (features.to_numpy('float64') - centro) / escala
+    return np.nan_to_num(np.clip(z, -CORTE, CORTE), nan=0.0).astype('float32')
+
+
+def _read_manifest(directory: str) -> dict:
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fichero:
+        return json.load(fichero)
+
+
+def _write_manifest(directory: str, manifest: dict) -> None:
+    path = os.path.join(directory, MANIFEST)
+    with open(path + '.tmp', 'w') as fichero:
+        json.dump(manifest, fichero)
+    os.replace(path + '.tmp', path)
+
+
+def source_stamps(session: Session) -> Dict[Tuple[str, int], str]:
+    """Return when the sources of every indexable key were last stored.
+
+    The stamp of a ``(symbol, fiscal_year)`` is the latest of the
+    ``statement_hashes`` times of its statements and the computation time
+    of its growth features, ``''`` when neither is known.
+    """
+    hashes = select(
+        bbdd.StatementHash.symbol.label('symbol'),
+        bbdd.StatementHash.fiscal_year.label('fiscal_year'),
+        func.max(bbdd.StatementHash.fecha_actualizacion).label('fecha'),
+    ).group_by(bbdd.StatementHash.symbol, bbdd.StatementHash.fiscal_year).subquery('hashes')
+    query = select(
+        bbdd.IncomeStatement.symbol,
+        bbdd.IncomeStatement.fiscal_year,
+        # max() con dos argumentos es el máximo escalar de SQLite
+        func.max(func.coalesce(hashes.c.fecha, ''), func.coalesce(bbdd.GrowthFeature.fecha_calculo, '')),
+    ).outerjoin(hashes, and_(
+        bbdd.IncomeStatement.symbol == hashes.c.symbol,
+        bbdd.IncomeStatement.fiscal_year == hashes.c.fiscal_year,
+    )).outerjoin(bbdd.GrowthFeature, and_(
+        bbdd.IncomeStatement.symbol == bbdd.GrowthFeature.symbol,
+        bbdd.IncomeStatement.fiscal_year == bbdd.GrowthFeature.fiscal_year,
+    ))
+    return {(symbol, int(year)): fecha for symbol, year, fecha in session.execute(query)}
+
+
+def _vectors(session: Session, symbols: Optional[Iterable[str]] = None,
+             scaling: Optional[Tuple[np.ndarray, np.ndarray]] = None):
+    """Return the indexable keys, their scaled vectors, the skipped keys and the scaling."""
+    statements = load_fundamentals(session, symbols)
+    if statements.empty:
+        vacias = pd.MultiIndex.from_arrays([[], []], names=['symbol', 'fiscal_year'])
+        return vacias, np.empty((0, len(FEATURES)), dtype='float32'), [], scaling or fit_scaling(pd.DataFrame(columns=FEATURES))
+    features = compute_fundamental_features(statements)
+    presentes = features.notna().sum(axis=1) >= MIN_PRESENTES
+    if scaling is None:
+        scaling = fit_scaling(features[presentes])
+    omitidas = [(s, int(y)) for s, y in features.index[~presentes]]
+    features = features[presentes]
+    return features.index, scale_features(features, *scaling), omitidas, scaling
+
+
+def _commit(directory: str, manifest: dict, vectors: np.ndarray) -> None:
+    """Write ``vectors`` as a new generation and publish it with ``manifest``.
+
+    Vector files older than the previous generation are removed; the
+    previous one may still be opened by a reader of the old manifest.
+    """
+    anterior = manifest.get('vectores') or VECTORES
+    generacion = manifest.get('generacion', 0) + 1
+    nombre = f'vectores-{generacion}.f32'
+    path = os.path.join(directory, nombre)
+    vectors.astype('<f4').tofile(path + '.tmp')
+    os.replace(path + '.tmp', path)
+    manifest.update(generacion=generacion, vectores=nombre)
+    _write_manifest(directory, manifest)
+    for fichero in os.listdir(directory):
+        if fichero.startswith('vectores') and fichero.endswith('.f32') and fichero not in (nombre, anterior):
+            try:
+                os.remove(os.path.join(directory, fichero))
+            except OSError as e:
+                logging.warning(f"Could not remove old similarity vectors {fichero}: {e}")
+
+
+def build_index(session: Session, directory: Optional[str] = None) -> int:
+    """Rebuild the index in ``directory`` from every stored statement.
+
+    Returns
+    -------
+    int
+        Number of indexed ``(symbol, fiscal_year)`` keys.
+    """
+    directory = directory or settings.similarity_index_dir
+    os.makedirs(directory, exist_ok=True)
+    with metricas.timed('similarity_index', stage='build'):
+        # Las marcas se leen antes que los datos: un cambio intermedio se reindexa en la siguiente pasada
+        stamps = source_stamps(session)
+        keys, vectors, omitidas, (centro, escala) = _vectors(session)
+        anterior = _read_manifest(directory)
+        _commit(directory, {
+            'features': FEATURES,
+            'centro': centro.tolist(),
+            'escala': escala.tolist(),
+            'symbols': [s for s, _ in keys],
+            'years': [int(y) for _, y in keys],
+            'fechas': [stamps.get((s, int(y)), '') for s, y in keys],
+            'omitidas': [[s, y, stamps.get((s, y), '')] for s, y in omitidas],
+            'generacion': anterior.get('generacion', 0),
+            'vectores': anterior.get('vectores'),
+        }, vectors)
+    logging.info(f"Similarity index built: {len(keys)} vectors")
+    return len(keys)
+
+
+def update_index(session: Session, directory: Optional[str] = None,
+                 changed: Optional[Dict[str, int]] = None) -> int:
+    """Index new years and vectorize again the keys whose sources changed.
+
+    A key is pending when it is not in the index or when its
+    :func:`source_stamps` entry differs from the one it was indexed (or
+    skipped) with. Keys whose statements were deleted are dropped.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for querying.
+    directory:
+        Index directory (default: ``SIMILARITY_INDEX_DIR``). The index is
+        built when it does not exist or its layout or features changed.
+    changed:
+        Mapping of symbol to the first fiscal year whose statements
+        changed; those years are recomputed even if their stamps match.
+
+    Returns
+    -------
+    int
+        Number of vectors written.
+    """
+    directory = directory or settings.similarity_index_dir
+    manifest = _read_manifest(directory)
+    if manifest.get('features') != FEATURES or 'fechas' not in manifest:
+        return build_index(session, directory)
+
+    claves = list(zip(manifest['symbols'], manifest['years']))
+    conocidos = dict(zip(claves, manifest['fechas']))
+    conocidos.update({(s, y): fecha for s, y, fecha in manifest['omitidas']})
+    stamps = source_stamps(session)
+    pendientes = {key for key, fecha in stamps.items() if conocidos.get(key) != fecha}
+    changed = changed or {}
+    pendientes |= {(s, y) for s, y in stamps if s in changed and y >= changed[s]}
+    eliminadas = set(conocidos) - set(stamps)
+    if not pendientes and not eliminadas:
+        logging.info("Similarity index is up to date.")
+        return 0
+
+    with metricas.timed('similarity_index', stage='update'):
+        scaling = (np.asarray(manifest['centro']), np.asarray(manifest['escala']))
+        keys, vectors, omitidas, _ = _vectors(session, {s for s, _ in pendientes}, scaling)
+        wanted = np.array([(s, int(y)) in pendientes for s, y in keys], dtype=bool)
+        keys, vectors = [(s, int(y)) for s, y in keys[wanted]], vectors[wanted]
+        nuevos = dict(zip(keys, range(len(keys))))
+
+        n, d = len(claves), len(FEATURES)
+        path = os.path.join(directory, manifest.get('vectores') or VECTORES)
+        # Sólo las n filas del manifiesto: el resto no llegó a publicarse
+        actuales = np.fromfile(path, dtype='<f4', count=n * d).reshape(n, d) if n else np.empty((0, d), dtype='<f4')
+        fila = np.array([nuevos.get(key, -1) for key in claves], dtype=np.int64)
+        reescritas = fila >= 0
+        actuales = actuales.copy()
+        actuales[reescritas] = vectors[fila[reescritas]]
+        # Claves que ya no se pueden indexar o cuyos estados se borraron
+        conservar = reescritas | np.array([key not in pendientes and key not in eliminadas for key in claves], dtype=bool)
+        indexadas = set(claves)
+        anadidas = [i for i, key in enumerate(keys) if key not in indexadas]
+
+        finales = [key for key, keep in zip(claves, conservar) if keep] + [keys[i] for i in anadidas]
+        manifest['symbols'] = [s for s, _ in finales]
+        manifest['years'] = [y for _, y in finales]
+        manifest['fechas'] = [stamps[key] if key in pendientes else conocidos[key] for key in finales]
+        manifest['omitidas'] = [
+            [s, y, fecha] for s, y, fecha in manifest['omitidas']
+            if (s, y) not in pendientes and (s, y) not in eliminadas
+        ] + [[s, y, stamps[(s, y)]] for s, y in omitidas if (s, y) in pendientes]
+        _commit(directory, manifest, np.vstack([actuales[conservar], vectors[anadidas]]))
+    logging.info(f"Similarity index updated: {len(anadidas)} added, {int(reescritas.sum())} rewritten, "
+                 f"{int((~conservar).sum())} removed")
+    return len(keys)
+
+
+class SimilarityIndex:
+    """Read-only view of an index directory with exact nearest-neighbour search.
+
+    Parameters
+    ----------
+    directory:
+        Directory written by :func:`build_index` and :func:`update_index`.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        manifest = _read_manifest(directory)
+        if not manifest:
+            raise FileNotFoundError(f"No similarity index in {directory}")
+        self.features: List[str] = manifest['features']
+        self.symbols = np.asarray(manifest['symbols'], dtype=object)
+        self.years = np.asarray(manifest['years'], dtype=np.int32)
+        n, d = len(self.symbols), len(self.features)
+        if n:
+            path = os.path.join(directory, manifest.get('vectores') or VECTORES)
+            self.vectors = np.memmap(path, dtype='<f4', mode='r', shape=(n, d))
+        else:
+            self.vectors = np.empty((0, d), dtype='float32')
+        self.norms = np.einsum('ij,ij->i', self.vectors, self.vectors)
+
+        # Códigos enteros de símbolo y último año de cada uno para filtrar sin comparar cadenas
+        codes, uniques = pd.factorize(self.symbols)
+        self.codes = codes.astype(np.int32)
+        self.code_of = {symbol: code for code, symbol in enumerate(uniques)}
+        orden = np.lexsort((self.years, self.codes))
+        ultimas = orden[np.r_[self.codes[orden][1:] != self.codes[orden][:-1], True]] if n else orden
+        self.latest = np.zeros(n, dtype=bool)
+        self.latest[ultimas] = True
+        self.latest_row = dict(zip(self.codes[ultimas].tolist(), ultimas.tolist()))
+        self.rows = {(s, int(y)): i for i, (s, y) in enumerate(zip(self.symbols, self.years))}
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def nearest(self, queries: np.ndarray, k: int = 10, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the ``k`` nearest rows of each query vector.
+
+        Parameters
+        ----------
+        queries:
+            Matrix of scaled vectors, one per row (or a single vector).
+        k:
+            Number of neighbours.
+        mask:
+            Boolean array over the rows; only ``True`` rows are candidates.
+
+        Returns
+        -------
+        tuple
+            ``(distances, rows)`` arrays of shape ``(queries, k)`` sorted by
+            distance. Missing neighbours have distance ``inf`` and row ``-1``.
+        """
+        q = np.atleast_2d(np.asarray(queries, dtype='float32'))
+        qq = np.einsum('ij,ij->i', q, q)[:, None]
+        mejores_d = [np.full((len(q), 0), np.inf)]
+        mejores_i = [np.full((len(q), 0), -1, dtype=np.int64)]
+        for inicio in range(0, len(self), TAMANO_BLOQUE):
+            fin = min(inicio + TAMANO_BLOQUE, len(self))
+            d2 = self.norms[inicio:fin] - 2 * (q @ self.vectors[inicio:fin].T) + qq
+            if mask is not None:
+                d2[:, ~mask[inicio:fin]] = np.inf
+            if d2.shape[1] > k:
+                idx = np.argpartition(d2, k, axis=1)[:, :k]
+                d2 = np.take_along_axis(d2, idx, axis=1)
+            else:
+                idx = np.broadcast_to(np.arange(d2.shape[1]), d2.shape)
+            mejores_d.append(d2)
+            mejores_i.append(idx + inicio)
+        distancias, filas = np.hstack(mejores_d), np.hstack(mejores_i)
+        orden = np.argsort(distancias, axis=1, kind='stable')[:, :k]
+        distancias = np.take_along_axis(distancias, orden, axis=1)
+        filas = np.where(np.isfinite(distancias), np.take_along_axis(filas, orden, axis=1), -1)
+        return np.sqrt(np.maximum(distancias, 0)), filas
+
+    def peers(self, symbol: str, fiscal_year: Optional[int] = None, k: int = 10) -> pd.DataFrame:
+        """Return the ``k`` companies closest to ``symbol``.
+
+        Parameters
+        ----------
+        symbol:
+            Company to find peers of.
+        fiscal_year:
+            Compare that year of ``symbol`` with the same year of every
+            other company. When omitted, the latest indexed year of each
+            company is used.
+        k:
+            Number of peers.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns ``symbol``, ``fiscal_year`` and ``distancia``, nearest
+            first; empty when ``symbol`` (or its year) is not indexed.
+        """
+        vacio = pd.DataFrame({'symbol': pd.Series(dtype=object), 'fiscal_year': pd.Series(dtype='int64'),
+                              'distancia': pd.Series(dtype='float64')})
+        code = self.code_of.get(symbol)
+        if code is None:
+            return vacio
+        if fiscal_year is None:
+            fila, mask = self.latest_row[code], self.latest.copy()
+        else:
+            fila = self.rows.get((symbol, int(fiscal_year)))
+            if fila is None:
+                return vacio
+            mask = self.years == fiscal_year
+        mask &= self.codes != code
+        distancias, filas = self.nearest(self.vectors[fila], k, mask)
+        validas = filas[0] >= 0
+        filas = filas[0][validas]
+        return pd.DataFrame({
+            'symbol': self.symbols[filas],
+            'fiscal_year': self.years[filas].astype('int64'),
+            'distancia': distancias[0][validas].astype('float64'),
+        })
+
+
+_abierto: Dict[str, Tuple[float, SimilarityIndex]] = {}
+_candado = threading.Lock()
+
+
+def get_index(directory: Optional[str] = None) -> SimilarityIndex:
+    """Return the open index of ``directory``, reopened when its manifest changes."""
+    directory = directory or settings.similarity_index_dir
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No similarity index in {directory}")
+    modificado = os.stat(path).st_mtime_ns
+    with _candado:
+        entrada = _abierto.get(directory)
+        if entrada is None or entrada[0] != modificado:
+            entrada = _abierto[directory] = (modificado, SimilarityIndex(directory))
+        return entrada[1]
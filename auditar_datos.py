@@ -0,0 +1,41 @@
+"""Audit the stored fundamentals for accounting inconsistencies.
+
+Every rule of ``bbdd.auditoria.REGLAS`` runs as one set-based SQL
+statement over the whole database. The issues replace the contents of
+the ``data_issues`` table and a per-symbol summary is printed; pass
+``--symbol`` to list the issues of one company.
+"""
+
+import argparse
+import bbdd
+from conf import *
+
+
+def main() -> None:
+    """Entry point of the data audit."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--symbol', default=None, help='List the issues of this company')
+    parser.add_argument('--output', default=None, help='Write the per-symbol summary to this CSV file')
+    parser.add_argument('--top', type=int, default=20, help='Symbols shown in the summary')
+    parser.add_argument('--no-save', action='store_true', help='Do not replace the data_issues table')
+    args = parser.parse_args()
+    configure_logging()
+
+    bbdd.create_tables()
+    with bbdd.session_scope(read_only=args.no_save) as session:
+        issues = bbdd.run_audit(session)
+        if not args.no_save:
+            bbdd.save_issues(session, issues)
+    logging.info(f"Data audit: {len(issues)} issues in {issues['symbol'].nunique()} symbols")
+
+    summary = bbdd.issue_summary(issues)
+    if args.output:
+        summary.to_csv(args.output)
+    if args.symbol:
+        print(issues[issues['symbol'] == args.symbol].to_string(index=False))
+    elif not summary.empty:
+        print(summary.head(args.top).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Backtest value screens and stored model scores for many portfolio sizes."""
+
+import numpy as np
+import pandas as pd
+from typing import List, Sequence
+import bbdd
+from analisis import backtest
+from conf import *
+
+TAMANOS_CARTERA = tuple(range(5, 205, 5))
+COSTE_TRANSACCION = 0.001
+
+
+def main(top_n: Sequence[int] = TAMANOS_CARTERA, cost: float = COSTE_TRANSACCION) -> pd.DataFrame:
+    """Run every signal × portfolio size variant in a single backtest."""
+    configure_logging()
+    with bbdd.session_scope(read_only=True) as session:
+        symbols, years, first, last = backtest.load_price_matrix(session)
+        signals = backtest.value_factors(session, symbols, years)
+        signals.update(backtest.prediction_scores(session, symbols, years))
+
+    returns = backtest.yearly_returns(first, last)
+    tradable = ~np.isnan(returns)
+    stacks: List[np.ndarray] = []
+    names: List[str] = []
+    for name, scores in signals.items():
+        stacks.append(backtest.top_n_weights(backtest.lag_signal(scores), top_n, tradable))
+        names.extend(f'{name}_top{n}' for n in top_n)
+    if not stacks:
+        logging.warning("No signals available to backtest.")
+        return pd.DataFrame()
+
+    result = backtest.run_backtest(np.concatenate(stacks), returns, cost=cost)
+    summary = backtest.summarize(result, names)
+    logging.info(f"Backtested {len(names)} strategies over {len(symbols)} symbols and {len(years)} years")
+    print(summary.head(20).to_string(index=False))
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,56 @@
-from .db import engine, Base, create_tables
-from .models import (
-    CashFlow,
-    BalanceSheet,
-    IncomeStatement,
-    Company,
-    FiscalYear,
-)
-from .crud import (
-    save_cash_flow,
-    save_balance_sheet,
-    save_income_statement,
-    save_company,
-    save_fiscal_year,
-    extract_all_data,
-)
-from .utils import divide, capture_db_errors
-
-__all__ = [
-    'engine', 'Base', 'create_tables',
-    'CashFlow', 'BalanceSheet', 'IncomeStatement', 'Company', 'FiscalYear',
-    'save_cash_flow', 'save_balance_sheet', 'save_income_statement',
-    'save_company', 'save_fiscal_year', 'extract_all_data',
-    'divide', 'capture_db_errors'
-]
+"""Database layer: ORM models, engine and persistence helpers.
+
+Public names are resolved on first access so ``import bbdd`` stays cheap;
+SQLAlchemy and pandas are imported only when a model, the engine or a
+query helper is actually used.
+"""
+
+import importlib
+
+_EXPORTS = {
+    'engine': 'db', 'get_engine': 'db', 'Base': 'db', 'create_tables': 'db',
+    'read_engine': 'db', 'get_read_engine': 'db',
+    'session_scope': 'sesiones', 'get_session_registry': 'sesiones',
+    'CashFlow': 'models', 'BalanceSheet': 'models', 'IncomeStatement': 'models',
+    'Company': 'models', 'FiscalYear': 'models', 'Prediction': 'models',
+    'GrowthFeature': 'models', 'SectorRank': 'models', 'ListedSymbol': 'models',
+    'Job': 'models', 'StatementHash': 'models', 'TableGeneration': 'models',
+    'DailyPrice': 'models', 'Filing': 'models', 'FilingValue': 'models',
+    'RiskMetric': 'models', 'DataIssue': 'models', 'BenchmarkReturn': 'models',
+    'save_cash_flow': 'crud', 'save_balance_sheet': 'crud',
+    'save_income_statement': 'crud', 'save_company': 'crud',
+    'save_fiscal_year': 'crud', 'save_fiscal_years': 'crud',
+    'last_price_date': 'crud', 'save_daily_prices': 'crud', 'load_daily_prices': 'crud',
+    'daily_price_rows': 'crud', 'fiscal_year_rows': 'crud', 'company_row': 'crud',
+    'save_statements': 'crud', 'save_filings': 'crud', 'intern_values': 'crud',
+    'filings_between': 'crud', 'latest_filings_as_of': 'crud', 'changed_reports': 'crud',
+    'extract_all_data': 'crud',
+    'iter_all_data': 'crud', 'count_all_data': 'crud', 'numeric_data_columns': 'crud',
+    'iter_latest_data': 'crud', 'save_predictions': 'crud', 'upsert_rows': 'crud',
+    'save_stock_list': 'crud', 'iter_listed_symbols': 'crud',
+    'enqueue_jobs': 'cola', 'enqueue_listed_symbols': 'cola', 'claim_jobs': 'cola',
+    'complete_job': 'cola', 'fail_job': 'cola', 'release_jobs': 'cola', 'next_due_time': 'cola',
+    'QueryCache': 'cache', 'cached_query': 'cache', 'get_query_cache': 'cache',
+    'table_generations': 'cache',
+    'export_dataset': 'export', 'read_dataset': 'export', 'partition_signatures': 'export',
+    'arrow_schema': 'export',
+    'REGLAS': 'auditoria', 'run_audit': 'auditoria', 'issue_summary': 'auditoria',
+    'save_issues': 'auditoria', 'refresh_data_issues': 'auditoria',
+    'divide': 'utils', 'subtract': 'utils', 'capture_db_errors': 'utils', 'chunked': 'utils',
+    'content_hash': 'utils', 'parse_date': 'utils', 'parse_datetime': 'utils',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{module}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,226 @@
+"""Set-based consistency audit of the stored fundamentals.
+
+Every rule in :data:`REGLAS` is a ``SELECT`` that returns the offending
+``(symbol, fiscal_year)`` rows with the reported and the expected value.
+All rules are combined with ``UNION ALL`` and run as a single statement,
+so the audit never loads ORM objects and missing values simply make a
+rule not apply instead of raising.
+
+Accounting identities are checked with a relative tolerance plus an
+absolute margin, since reported totals are rounded::
+
+    |valor - esperado| > tolerancia * (|valor| + |esperado|) + margen
+"""
+
+from datetime import datetime
+from typing import Dict, List, Optional
+import pandas as pd
+from sqlalchemy import Float, Integer, cast, delete, func, literal, null, select, union_all
+from sqlalchemy.orm import Session
+from conf import *
+from .models import BalanceSheet, CashFlow, DailyPrice, DataIssue, IncomeStatement
+from .crud import upsert_rows
+import metricas
+
+TOLERANCIA = 0.01
+MARGEN = 1.0
+# Los ratios publicados se redondean a pocos decimales
+TOLERANCIA_RATIO = 0.01
+MARGEN_RATIO = 0.001
+TOLERANCIA_EPS = 0.05
+MARGEN_EPS = 0.01
+# Bits de cada estado en la regla de estados incompletos
+ESTADOS = {1: 'income_statement', 2: 'balance_sheet', 4: 'cash_flow'}
+
+REGLAS: Dict[str, str] = {
+    'balance_descuadrado': "Total assets differ from total liabilities and equity",
+    'activos_no_suman': "Total assets differ from current plus non-current assets",
+    'pasivos_no_suman': "Total liabilities differ from current plus non-current liabilities",
+    'pasivo_mas_patrimonio': "Total liabilities and equity differ from liabilities plus equity",
+    'ganancia_bruta': "Gross profit differs from revenue minus cost of revenue",
+    'margen_bruto': "Gross margin differs from gross profit over revenue",
+    'ingreso_neto': "Net income differs from pre-tax income minus taxes",
+    'eps': "EPS differs from net income over average shares",
+    'flujo_libre_caja': "Free cash flow differs from operating cash flow plus capital expenditure",
+    'variacion_caja': "Net change in cash differs from closing minus opening cash",
+    'beneficio_distinto': "Net income differs between the income and cash flow statements",
+    'ingresos_nulos': "Revenue is missing",
+    'activos_nulos': "Total assets are missing",
+    'ingresos_negativos': "Revenue is negative",
+    'acciones_no_positivas': "Average shares outstanding are zero or negative",
+    'estados_incompletos': "Only some of the statements are stored",
+    'anios_ausentes': "Fiscal years are missing before this one",
+    'precios_no_positivos': "Daily closes are zero or negative",
+}
+
+
+def _issue(model, regla: str, valor, esperado, *condiciones):
+    return select(
+        model.symbol.label('symbol'),
+        model.fiscal_year.label('fiscal_year'),
+        literal(regla).label('regla'),
+        cast(valor, Float).label('valor'),
+        cast(esperado, Float).label('esperado'),
+    ).where(*condiciones)
+
+
+def _descuadre(model, regla: str, valor, esperado, *condiciones,
+               tolerancia: float = TOLERANCIA, margen: float = MARGEN):
+    """Rows of ``model`` where ``valor`` and ``esperado`` are both known and differ."""
+    return _issue(
+        model, regla, valor, esperado,
+        valor.isnot(None), esperado.isnot(None),
+        func.abs(valor - esperado) > tolerancia * (func.abs(valor) + func.abs(esperado)) + margen,
+        *condiciones,
+    )
+
+
+def _rules() -> List:
+    bs, inc, cf = BalanceSheet, IncomeStatement, CashFlow
+    reglas = [
+        _descuadre(bs, 'balance_descuadrado', bs.total_activos, bs.total_pasivos_y_patrimonio),
+        _descuadre(bs, 'activos_no_suman', bs.total_activos, bs.total_activos_corrientes + bs.total_activos_no_corrientes),
+        _descuadre(bs, 'pasivos_no_suman', bs.total_pasivos, bs.total_pasivos_corrientes + bs.total_pasivos_no_corrientes),
+        _descuadre(bs, 'pasivo_mas_patrimonio', bs.total_pasivos_y_patrimonio, bs.total_pasivos + bs.total_patrimonio),
+        _descuadre(inc, 'ganancia_bruta', inc.ganancia_bruta, inc.ingresos - inc.costo_ingresos),
+        _descuadre(inc, 'margen_bruto', inc.margen_ganancia_bruta, inc.ganancia_bruta / inc.ingresos, inc.ingresos != 0,
+                   tolerancia=TOLERANCIA_RATIO, margen=MARGEN_RATIO),
+        _descuadre(inc, 'ingreso_neto', inc.ingreso_neto, inc.ingreso_antes_impuestos - inc.impuestos),
+        _descuadre(inc, 'eps', inc.eps, inc.ingreso_neto / inc.acciones_promedio, inc.acciones_promedio > 0,
+                   tolerancia=TOLERANCIA_EPS, margen=MARGEN_EPS),
+        _descuadre(cf, 'flujo_libre_caja', cf.flujo_libre_caja, cf.flujo_operativo_neto + cf.inversiones_propiedad_planta_y_equipo),
+        _descuadre(cf, 'variacion_caja', cf.variacion_neta_flujo_caja, cf.saldo_efectivo_cierre - cf.saldo_efectivo_inicio),
+        _issue(inc, 'ingresos_nulos', null(), null(), inc.ingresos.is_(None)),
+        _issue(bs, 'activos_nulos', null(), null(), bs.total_activos.is_(None)),
+        _issue(inc, 'ingresos_negativos', inc.ingresos, literal(0), inc.ingresos < 0),
+        _issue(inc, 'acciones_no_positivas', inc.acciones_promedio, null(), inc.acciones_promedio <= 0),
+    ]
+
+    # Mismo beneficio en la cuenta de resultados y en el estado de flujos
+    beneficio = select(
+        inc.symbol.label('symbol'), inc.fiscal_year.label('fiscal_year'),
+        literal('beneficio_distinto').label('regla'),
+        cast(inc.ingreso_neto, Float).label('valor'), cast(cf.beneficio_neto, Float).label('esperado'),
+    ).join(cf, (inc.symbol == cf.symbol) & (inc.fiscal_year == cf.fiscal_year)).where(
+        inc.ingreso_neto.isnot(None), cf.beneficio_neto.isnot(None),
+        func.abs(inc.ingreso_neto - cf.beneficio_neto) > TOLERANCIA * (func.abs(inc.ingreso_neto) + func.abs(cf.beneficio_neto)) + MARGEN,
+    )
+    reglas.append(beneficio)
+
+    # Años con sólo algunos estados: suma de un bit por estado presente
+    claves = union_all(*[
+        select(model.symbol.label('symbol'), model.fiscal_year.label('fiscal_year'), literal(bit).label('bit'))
+        for bit, model in zip(ESTADOS, (inc, bs, cf))
+    ]).subquery('claves')
+    presentes = func.sum(claves.c.bit)
+    reglas.append(select(
+        claves.c.symbol, claves.c.fiscal_year, literal('estados_incompletos').label('regla'),
+        cast(presentes, Float).label('valor'), cast(literal(sum(ESTADOS)), Float).label('esperado'),
+    ).group_by(claves.c.symbol, claves.c.fiscal_year).having(presentes != sum(ESTADOS)))
+
+    # Huecos en la serie de años de cada símbolo
+    anios = select(
+        inc.symbol.label('symbol'), inc.fiscal_year.label('fiscal_year'),
+        func.lag(inc.fiscal_year).over(partition_by=inc.symbol, order_by=inc.fiscal_year).label('anterior'),
+    ).subquery('anios')
+    reglas.append(select(
+        anios.c.symbol, anios.c.fiscal_year, literal('anios_ausentes').label('regla'),
+        cast(anios.c.anterior, Float).label('valor'), cast(anios.c.fiscal_year - 1, Float).label('esperado'),
+    ).where(anios.c.fiscal_year - anios.c.anterior > 1))
+
+    anio = cast(func.substr(DailyPrice.fecha, 1, 4), Integer)
+    reglas.append(select(
+        DailyPrice.symbol.label('symbol'), anio.label('fiscal_year'), literal('precios_no_positivos').label('regla'),
+        cast(func.count(), Float).label('valor'), cast(literal(0), Float).label('esperado'),
+    ).where(DailyPrice.close <= 0).group_by(DailyPrice.symbol, anio))
+    return reglas
+
+
+def _detail(issues: pd.DataFrame) -> pd.Series:
+    detalle = issues['regla'].map(REGLAS)
+    incompletos = issues['regla'] == 'estados_incompletos'
+    if incompletos.any():
+        presentes = issues.loc[incompletos, 'valor'].astype(int)
+        faltan = presentes.map(lambda bits: ', '.join(name for bit, name in ESTADOS.items() if not bits & bit))
+        detalle[incompletos] = 'Missing ' + faltan
+    return detalle
+
+
+def run_audit(session: Session, symbols: Optional[List[str]] = None) -> pd.DataFrame:
+    """Run every rule of :data:`REGLAS` in one statement.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for querying.
+    symbols:
+        Restrict the report to these symbols; the rules still run as a
+        single set-based statement.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per broken rule with the columns ``symbol``,
+        ``fiscal_year``, ``regla``, ``valor``, ``esperado`` and
+        ``detalle``, sorted by symbol, year and rule.
+    """
+    todas = union_all(*_rules()).subquery('incidencias')
+    query = select(todas)
+    if symbols is not None:
+        query = query.where(todas.c.symbol.in_(symbols))
+    with metricas.timed('data_audit'):
+        rows = session.execute(query).all()
+    issues = pd.DataFrame(rows, columns=['symbol', 'fiscal_year', 'regla', 'valor', 'esperado'])
+    issues['fiscal_year'] = issues['fiscal_year'].astype('int64')
+    issues = issues.drop_duplicates(['symbol', 'fiscal_year', 'regla'])\
+        .sort_values(['symbol', 'fiscal_year', 'regla'], ignore_index=True)
+    issues['detalle'] = _detail(issues)
+    return issues
+
+
+def issue_summary(issues: pd.DataFrame) -> pd.DataFrame:
+    """Count the issues of each symbol per rule.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Indexed by symbol with one column per broken rule, ``total`` and
+        ``anios`` (fiscal years with at least one issue), worst first.
+    """
+    if issues.empty:
+        return pd.DataFrame(columns=['total', 'anios'])
+    summary = pd.crosstab(issues['symbol'], issues['regla'])
+    summary['total'] = summary.sum(axis=1)
+    summary['anios'] = issues.groupby('symbol')['fiscal_year'].nunique()
+    return summary.sort_values(['total', 'anios'], ascending=False)
+
+
+def save_issues(session: Session, issues: pd.DataFrame) -> int:
+    """Replace the contents of ``data_issues`` with ``issues``.
+
+    Returns
+    -------
+    int
+        Number of rows written.
+    """
+    session.execute(delete(DataIssue))
+    if issues.empty:
+        session.commit()
+        return 0
+    rows = issues.astype(object).where(issues.notna(), None)
+    rows['fecha_calculo'] = datetime.now().isoformat(timespec='seconds')
+    return upsert_rows(session, DataIssue, rows.to_dict('records'))
+
+
+def refresh_data_issues(session: Session) -> int:
+    """Audit the whole database and store the result in ``data_issues``.
+
+    Returns
+    -------
+    int
+        Number of issues found.
+    """
+    issues = run_audit(session)
+    save_issues(session, issues)
+    logging.info(f"Data audit: {len(issues)} issues in {issues['symbol'].nunique()} symbols")
+    return len(issues)
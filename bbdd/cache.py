@@ -0,0 +1,200 @@
+"""Query-result cache invalidated by per-table write generations.
+
+Every write made through a session bumps the generation counter of the
+written table in ``table_generations`` (see :mod:`bbdd.db`). A cached
+result is stored together with the generations of the tables it reads
+and is only served while they are unchanged, so checking freshness costs
+one small indexed query and a result is never served stale.
+
+Results live in an in-memory LRU. When ``QUERY_CACHE_DIR`` is set,
+DataFrame results are also written there as Parquet files, so a new
+process can reuse them while the data is unchanged.
+"""
+
+import functools
+import glob
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, Optional, Tuple
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from conf import *
+from .models import TableGeneration
+from .utils import content_hash
+import metricas
+
+
+def table_generations(session: Session, tables: Iterable[str]) -> Optional[Tuple[int, ...]]:
+    """Return the current write generation of each of ``tables``.
+
+    Returns ``None`` when the database has no ``table_generations`` table
+    (it was created by an older version and opened without
+    :func:`bbdd.create_tables`); nothing can be cached then.
+    """
+    tables = list(tables)
+    try:
+        stored = dict(
+            session.query(TableGeneration.tabla, TableGeneration.generacion)
+            .filter(TableGeneration.tabla.in_(tables))
+        )
+    except OperationalError as e:
+        logging.debug(f"Write generations unavailable, query cache bypassed: {e}")
+        return None
+    return tuple(stored.get(table, 0) for table in tables)
+
+
+def _copy(value: Any) -> Any:
+    """Return a copy the caller can modify without corrupting the cache."""
+    if isinstance(value, tuple):
+        return tuple(_copy(v) for v in value)
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if hasattr(value, 'copy'):
+        return value.copy()
+    return value
+
+
+class QueryCache:
+    """LRU cache of query results keyed by query, parameters and table generations.
+
+    Parameters
+    ----------
+    max_entries:
+        Number of results kept in memory. ``0`` disables the cache.
+    directory:
+        Optional directory for Parquet copies of DataFrame results.
+    """
+
+    def __init__(self, max_entries: int = 16, directory: Optional[str] = None) -> None:
+        self.max_entries = max_entries
+        self.directory = directory
+        self._entries: 'OrderedDict[str, Tuple[Tuple[int, ...], Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session: Session, name: str, tables: Iterable[str], compute: Callable[[], Any], params: Any = ()) -> Any:
+        """Return the cached result of ``name`` or compute and cache it.
+
+        Parameters
+        ----------
+        session:
+            Session the query runs in.
+        name:
+            Name of the query.
+        tables:
+            Tables the query reads.
+        compute:
+            Callable that runs the query.
+        params:
+            Query parameters; their ``repr`` is part of the key.
+
+        Returns
+        -------
+        Any
+            A copy of the result.
+        """
+        tables = sorted(tables)
+        # Escrituras sin confirmar en esta sesión o base sin generaciones: el resultado no es cacheable
+        generations = None
+        if self.max_entries and not set(tables) & session.info.get('tablas_escritas', set()):
+            generations = table_generations(session, tables)
+        if generations is None:
+            metricas.increment('query_cache_total', result='bypass', query=name)
+            return compute()
+
+        key = content_hash([str(session.get_bind().url), name, repr(params)])
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generations:
+                self._entries.move_to_end(key)
+                metricas.increment('query_cache_total', result='memory', query=name)
+                return _copy(entry[1])
+
+        value = self._read_disk(name, key, generations)
+        if value is not None:
+            metricas.increment('query_cache_total', result='disk', query=name)
+        else:
+            metricas.increment('query_cache_total', result='miss', query=name)
+            value = compute()
+            self._write_disk(name, key, generations, value)
+
+        with self._lock:
+            self._entries[key] = (generations, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return _copy(value)
+
+    def clear(self) -> None:
+        """Drop every in-memory entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def _path(self, name: str, key: str, generations: Tuple[int, ...]) -> str:
+        return os.path.join(self.directory, f"{name}-{key[:16]}-{content_hash(list(generations))[:16]}.parquet")
+
+    def _read_disk(self, name: str, key: str, generations: Tuple[int, ...]) -> Any:
+        if not self.directory:
+            return None
+        path = self._path(name, key, generations)
+        if not os.path.exists(path):
+            return None
+        import pandas as pd
+
+        try:
+            return pd.read_parquet(path)
+        except Exception as e:
+            logging.warning(f"Could not read cached result {path}: {e}")
+            return None
+
+    def _write_disk(self, name: str, key: str, generations: Tuple[int, ...], value: Any) -> None:
+        if not self.directory or not hasattr(value, 'to_parquet'):
+            return
+        path = self._path(name, key, generations)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            value.to_parquet(path + '.tmp', index=False)
+            os.replace(path + '.tmp', path)
+        except Exception as e:  # pyarrow ausente o tipos no soportados
+            logging.warning(f"Could not write cached result {path}: {e}")
+            return
+        # Borrar las copias de generaciones anteriores
+        for old in glob.glob(os.path.join(self.directory, f"{name}-{key[:16]}-*.parquet")):
+            if old != path:
+                os.remove(old)
+
+
+_cache: Optional[QueryCache] = None
+
+
+def get_query_cache() -> QueryCache:
+    """Return the process-wide cache configured from ``settings``."""
+    global _cache
+    if _cache is None:
+        _cache = QueryCache(settings.query_cache_size, settings.query_cache_dir)
+    return _cache
+
+
+def cached_query(*tables: str) -> Callable:
+    """Decorate a ``func(session, ...)`` query so its result is cached.
+
+    Parameters
+    ----------
+    tables:
+        Names of the tables the query reads.
+
+    The undecorated function stays available as ``func.uncached``.
+    """
+
+    def decorate(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(session: Session, *args, **kwargs):
+            return get_query_cache().get(
+                session, func.__name__, tables,
+                lambda: func(session, *args, **kwargs),
+                (args, sorted(kwargs.items())),
+            )
+
+        wrapper.uncached = func
+        return wrapper
+
+    return decorate
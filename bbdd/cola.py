@@ -0,0 +1,209 @@
+"""Persistent priority queue of refresh jobs stored in the ``jobs`` table.
+
+Workers claim due jobs with a lease: the claim is a single ``UPDATE ...
+RETURNING`` statement, which SQLite executes atomically under its write
+lock, so two workers never receive the same job. A worker that dies
+without finishing simply lets its lease expire and the job becomes
+claimable again.
+"""
+
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+from sqlalchemy import Row, func, literal, or_, select, true, tuple_, update
+from sqlalchemy.orm import Session
+from conf import *
+from .models import Job, ListedSymbol
+from .utils import chunked, insert_on_conflict
+import metricas
+
+REINTENTO_BASE = timedelta(minutes=5)
+REINTENTO_MAXIMO = timedelta(days=1)
+
+
+def timestamp(moment: Optional[datetime] = None) -> str:
+    """Format ``moment`` (default: now) as stored in the ``jobs`` table."""
+    return (moment or datetime.now()).isoformat(timespec='seconds')
+
+
+def enqueue_jobs(session: Session, symbols: Iterable[str], endpoints: Iterable[str],
+                 prioridad: int = 0, due: Optional[datetime] = None) -> int:
+    """Add a job for every symbol and endpoint that is not queued yet.
+
+    Existing jobs keep their schedule.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for persistence.
+    symbols:
+        Ticker symbols to schedule.
+    endpoints:
+        Endpoints to refresh for every symbol.
+    prioridad:
+        Priority of the new jobs.
+    due:
+        Time from which the new jobs are due. Defaults to now.
+
+    Returns
+    -------
+    int
+        Number of jobs inserted.
+    """
+    endpoints = list(endpoints)
+    proxima = timestamp(due)
+    dialecto = session.get_bind().dialect.name
+    total = 0
+    for batch in chunked(symbols, 1000):
+        rows = [
+            {'symbol': symbol, 'endpoint': endpoint, 'prioridad': prioridad,
+             'proxima_ejecucion': proxima, 'intentos': 0}
+            for symbol in batch for endpoint in endpoints
+        ]
+        # Sobre la tabla y no sobre el modelo: el insert masivo del ORM no devuelve rowcount
+        total += session.execute(insert_on_conflict(dialecto, Job.__table__).on_conflict_do_nothing(), rows).rowcount
+    session.commit()
+    metricas.increment('jobs_enqueued_total', total)
+    return total
+
+
+def enqueue_listed_symbols(session: Session, endpoints: Iterable[str], prioridad: int = 0) -> int:
+    """Queue every endpoint for every symbol of the ``stock_list`` cache.
+
+    Runs as one ``INSERT ... SELECT`` per endpoint, so the symbol list is
+    never loaded into Python.
+
+    Returns
+    -------
+    int
+        Number of jobs inserted.
+    """
+    proxima = timestamp()
+    dialecto = session.get_bind().dialect.name
+    total = 0
+    for endpoint in endpoints:
+        # SQLite necesita un WHERE en el SELECT para distinguir el ON CONFLICT
+        origen = select(
+            ListedSymbol.symbol, literal(endpoint), literal(prioridad), literal(proxima), literal(0),
+        ).where(true())
+        stmt = insert_on_conflict(dialecto, Job).from_select(
+            ['symbol', 'endpoint', 'prioridad', 'proxima_ejecucion', 'intentos'], origen,
+        ).on_conflict_do_nothing()
+        total += session.execute(stmt).rowcount
+    session.commit()
+    metricas.increment('jobs_enqueued_total', total)
+    return total
+
+
+def claim_jobs(session: Session, worker: str, limit: int = 1,
+               lease: timedelta = timedelta(minutes=10)) -> List[Row]:
+    """Atomically claim up to ``limit`` due jobs for ``worker``.
+
+    Jobs are taken by descending priority and then by how long they have
+    been due. Jobs whose previous claim expired are claimable again.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for persistence.
+    worker:
+        Identifier of the claiming worker.
+    limit:
+        Maximum number of jobs to claim.
+    lease:
+        How long the claim is held before other workers may take the job.
+
+    Returns
+    -------
+    list
+        Rows with ``symbol``, ``endpoint``, ``prioridad`` and ``intentos``.
+    """
+    ahora = datetime.now()
+    disponibles = select(Job.symbol, Job.endpoint)\
+        .where(Job.proxima_ejecucion <= timestamp(ahora))\
+        .where(or_(Job.reclamado_hasta.is_(None), Job.reclamado_hasta < timestamp(ahora)))\
+        .order_by(Job.prioridad.desc(), Job.proxima_ejecucion)\
+        .limit(limit)
+    stmt = update(Job)\
+        .where(tuple_(Job.symbol, Job.endpoint).in_(disponibles))\
+        .values(reclamado_por=worker, reclamado_hasta=timestamp(ahora + lease), intentos=Job.intentos + 1)\
+        .returning(Job.symbol, Job.endpoint, Job.prioridad, Job.intentos)\
+        .execution_options(synchronize_session=False)
+    jobs = session.execute(stmt).all()
+    session.commit()
+    metricas.increment('jobs_claimed_total', len(jobs))
+    return jobs
+
+
+def complete_job(session: Session, worker: str, symbol: str, endpoint: str,
+                 proxima: datetime, prioridad: int = 0) -> bool:
+    """Release a finished job and schedule its next run.
+
+    Returns ``False`` when ``worker`` no longer holds the claim, e.g.
+    because its lease expired and another worker took the job.
+    """
+    stmt = update(Job)\
+        .where(Job.symbol == symbol, Job.endpoint == endpoint, Job.reclamado_por == worker)\
+        .values(
+            proxima_ejecucion=timestamp(proxima), prioridad=prioridad, intentos=0,
+            reclamado_por=None, reclamado_hasta=None,
+            ultima_ejecucion=timestamp(), ultimo_error=None,
+        )\
+        .execution_options(synchronize_session=False)
+    done = session.execute(stmt).rowcount == 1
+    session.commit()
+    metricas.increment('jobs_completed_total', endpoint=endpoint)
+    return done
+
+
+def fail_job(session: Session, worker: str, symbol: str, endpoint: str, intentos: int, error: str) -> bool:
+    """Release a failed job and retry it with exponential backoff.
+
+    Returns ``False`` when ``worker`` no longer holds the claim.
+    """
+    espera = min(REINTENTO_BASE * 2 ** max(intentos - 1, 0), REINTENTO_MAXIMO)
+    stmt = update(Job)\
+        .where(Job.symbol == symbol, Job.endpoint == endpoint, Job.reclamado_por == worker)\
+        .values(
+            proxima_ejecucion=timestamp(datetime.now() + espera),
+            reclamado_por=None, reclamado_hasta=None, ultimo_error=error[:500],
+        )\
+        .execution_options(synchronize_session=False)
+    done = session.execute(stmt).rowcount == 1
+    session.commit()
+    metricas.increment('jobs_failed_total', endpoint=endpoint)
+    return done
+
+
+def release_jobs(session: Session, worker: str, jobs: Iterable[Tuple[str, str]], due: datetime) -> int:
+    """Give back claimed jobs that were not run and make them due at ``due``.
+
+    Used when the API refuses requests: the claim is not counted as an
+    attempt and the jobs do not wait for their lease to expire.
+
+    Returns
+    -------
+    int
+        Number of jobs released; jobs whose claim ``worker`` no longer
+        holds are left alone.
+    """
+    total = 0
+    for batch in chunked(jobs, 500):
+        stmt = update(Job)\
+            .where(tuple_(Job.symbol, Job.endpoint).in_(batch), Job.reclamado_por == worker)\
+            .values(
+                proxima_ejecucion=timestamp(due), intentos=func.max(Job.intentos - 1, 0),
+                reclamado_por=None, reclamado_hasta=None,
+            )\
+            .execution_options(synchronize_session=False)
+        total += session.execute(stmt).rowcount
+    session.commit()
+    metricas.increment('jobs_released_total', total)
+    return total
+
+
+def next_due_time(session: Session) -> Optional[datetime]:
+    """Return when the earliest unclaimed job becomes due, or ``None`` if there is none."""
+    proxima = session.query(Job.proxima_ejecucion)\
+        .filter(Job.reclamado_hasta.is_(None))\
+        .order_by(Job.proxima_ejecucion).limit(1).scalar()
+    return datetime.fromisoformat(proxima) if proxima else None
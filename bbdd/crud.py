@@ -1,39 +1,36 @@
 """CRUD utilities for persisting and querying financial data."""
 
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from datetime import date, datetime
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import Float, Integer, and_, func
 from conf import *
-from typing import Any, Dict, Optional
-import pandas as pd
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Tuple
 from .models import (
     CashFlow,
     BalanceSheet,
     IncomeStatement,
     Company,
     FiscalYear,
+    Prediction,
+    ListedSymbol,
+    StatementHash,
+    DailyPrice,
+    Filing,
+    FilingValue,
 )
-from .utils import capture_db_errors
+from .utils import capture_db_errors, chunked, content_hash, insert_on_conflict, parse_date, parse_datetime
+from .cache import cached_query
+import metricas
 
+if TYPE_CHECKING:
+    import pandas as pd
 
-@capture_db_errors
-def save_cash_flow(session: Session, report: Dict[str, Any]) -> None:
-    """Persist a cash flow report.
 
-    Parameters
-    ----------
-    session:
-        Active SQLAlchemy session used for persistence.
-    report:
-        Raw cash flow data as returned by the API.
-    """
-    nuevo_cash_flow = CashFlow(
+def cash_flow_from_report(report: Dict[str, Any]) -> CashFlow:
+    """Map a cash flow report of the API to a new ``CashFlow`` row."""
+    return CashFlow(
         symbol=report.get('symbol', None),
         fiscal_year=report.get('calendarYear', None),
-        moneda_reportada=report.get('reportedCurrency', None),
-        cik=report.get('cik', None),
-        fecha_presentacion=report.get('fillingDate', None),
-        fecha_aceptacion=report.get('acceptedDate', None),
-        periodo=report.get('period', None),
         beneficio_neto=report.get("netIncome", None),
         depreciacion_y_amortizacion=report.get('depreciationAndAmortization', None),
         impuestos_diferidos=report.get('deferredIncomeTax', None),
@@ -62,36 +59,36 @@ def save_cash_flow(session: Session, report: Dict[str, Any]) -> None:
         saldo_efectivo_inicio=report.get('cashAtBeginningOfPeriod', None),
         saldo_efectivo_cierre=report.get('cashAtEndOfPeriod', None),
         flujo_libre_caja=report.get('freeCashFlow', None),
-        enlace=report.get('link', None),
-        enlace_final=report.get('finalLink', None),
     )
-    session.add(nuevo_cash_flow)
-    try:
-        session.commit()
-    except Exception as e:
-        session.rollback()
-        logging.error(f"Error saving cash flow: {e}")
 
 
 @capture_db_errors
-def save_balance_sheet(session: Session, report: Dict[str, Any]) -> None:
-    """Persist a balance sheet report.
+def save_cash_flow(session: Session, report: Dict[str, Any]) -> Optional[Dict[str, int]]:
+    """Persist a cash flow report with its filing and content hash.
+
+    Single-report form of :func:`save_statements`; errors are logged and
+    ``None`` is returned.
 
     Parameters
     ----------
     session:
         Active SQLAlchemy session used for persistence.
     report:
-        Raw balance sheet data as returned by the API.
+        Raw cash flow data as returned by the API.
+
+    Returns
+    -------
+    Optional[dict]
+        See :func:`save_statements`.
     """
-    nuevo_balance = BalanceSheet(
+    return save_statements(session, 'cash_flow', [report])
+
+
+def balance_sheet_from_report(report: Dict[str, Any]) -> BalanceSheet:
+    """Map a balance sheet report of the API to a new ``BalanceSheet`` row."""
+    return BalanceSheet(
         symbol=report.get('symbol', None),
         fiscal_year=report.get('calendarYear', None),
-        moneda_reportada=report.get('reportedCurrency', None),
-        cik=report.get('cik', None),
-        fecha_presentacion=report.get('fillingDate', None),
-        fecha_aceptacion=report.get('acceptedDate', None),
-        periodo=report.get('period', None),
         efectivo_y_equivalentes=report.get('cashAndCashEquivalents', None),
         inversiones_corto_plazo=report.get('shortTermInvestments', None),
         efectivo_y_inversiones_corto_plazo=report.get('cashAndShortTermInvestments', None),
@@ -136,41 +133,36 @@ def save_balance_sheet(session: Session, report: Dict[str, Any]) -> None:
         total_inversiones=report.get('totalInvestments', None),
         total_deuda=report.get('totalDebt', None),
         deuda_neta=report.get('netDebt', None),
-        enlace=report.get('link', None),
-        enlace_final=report.get('finalLink', None),
     )
-    session.add(nuevo_balance)
-    try:
-        session.commit()
-    except Exception as e:
-        session.rollback()
-        logging.error(f"Error saving balance sheet: {e}")
 
 
 @capture_db_errors
-def save_income_statement(session: Session, report: Dict[str, Any]) -> IncomeStatement:
-    """Persist an income statement report.
+def save_balance_sheet(session: Session, report: Dict[str, Any]) -> Optional[Dict[str, int]]:
+    """Persist a balance sheet report with its filing and content hash.
+
+    Single-report form of :func:`save_statements`; errors are logged and
+    ``None`` is returned.
 
     Parameters
     ----------
     session:
         Active SQLAlchemy session used for persistence.
     report:
-        Raw income statement data from the API.
+        Raw balance sheet data as returned by the API.
 
     Returns
     -------
-    IncomeStatement
-        The newly created ORM instance.
+    Optional[dict]
+        See :func:`save_statements`.
     """
-    nueva_cuenta_resultados = IncomeStatement(
+    return save_statements(session, 'balance_sheet', [report])
+
+
+def income_statement_from_report(report: Dict[str, Any]) -> IncomeStatement:
+    """Map an income statement report of the API to a new ``IncomeStatement`` row."""
+    return IncomeStatement(
         symbol=report.get('symbol', None),
         fiscal_year=report.get('calendarYear', None),
-        moneda_reportada=report.get('reportedCurrency', None),
-        cik=report.get('cik', None),
-        fecha_presentacion=report.get('fillingDate', None),
-        fecha_aceptacion=report.get('acceptedDate', None),
-        periodo=report.get('period', None),
         ingresos=report.get('revenue', None),
         costo_ingresos=report.get('costOfRevenue', None),
         ganancia_bruta=report.get('grossProfit', None),
@@ -198,20 +190,48 @@ def save_income_statement(session: Session, report: Dict[str, Any]) -> IncomeSta
         eps_diluido=report.get('epsdiluted', None),
         acciones_promedio=report.get('weightedAverageShsOut', None),
         acciones_promedio_diluidas=report.get('weightedAverageShsOutDil', None),
-        enlace=report.get('link', None),
-        enlace_final=report.get('finalLink', None),
     )
-    session.add(nueva_cuenta_resultados)
-    try:
-        session.commit()
-    except Exception as e:
-        session.rollback()
-        logging.error(f"Error saving income statement: {e}")
 
 
 @capture_db_errors
-def save_company(session: Session, company: Dict[str, Any]) -> Company:
-    """Persist basic company information.
+def save_income_statement(session: Session, report: Dict[str, Any]) -> Optional[Dict[str, int]]:
+    """Persist an income statement report with its filing and content hash.
+
+    Single-report form of :func:`save_statements`; errors are logged and
+    ``None`` is returned.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for persistence.
+    report:
+        Raw income statement data from the API.
+
+    Returns
+    -------
+    Optional[dict]
+        See :func:`save_statements`.
+    """
+    return save_statements(session, 'income_statement', [report])
+
+
+def company_row(company: Dict[str, Any]) -> Dict[str, Any]:
+    """Map a profile of the API to a ``company`` row for :func:`upsert_rows`."""
+    return {
+        'symbol': company.get('symbol'),
+        'company_name': company.get('companyName'),
+        'price': company.get('price'),
+        'exchange': company.get('exchange'),
+        'exchange_short_name': company.get('exchangeShortName'),
+        'sector': company.get('sector'),
+    }
+
+
+def save_company(session: Session, company: Dict[str, Any], commit: bool = True) -> int:
+    """Insert or update basic company information.
+
+    A stored company is overwritten, so price and sector changes reach
+    the database and the sector ranks.
 
     Parameters
     ----------
@@ -219,30 +239,38 @@ def save_company(session: Session, company: Dict[str, Any]) -> Company:
         Active SQLAlchemy session used for persistence.
     company:
         Company profile data returned by the API.
+    commit:
+        Passed to :func:`upsert_rows`.
 
     Returns
     -------
-    Company
-        The newly created company instance.
+    int
+        Number of rows written.
     """
-    nueva_empresa = Company(
-        symbol=company.get('symbol'),
-        company_name=company.get('companyName'),
-        price=company.get('price'),
-        exchange=company.get('exchange'),
-        exchange_short_name=company.get('exchangeShortName'),
-        sector=company.get('sector'),
-    )
-    session.add(nueva_empresa)
-    try:
-        session.commit()
-    except Exception as e:
-        session.rollback()
-        logging.error(f"Error saving company: {e}")
-    return nueva_empresa
+    return upsert_rows(session, Company, [company_row(company)], commit=commit)
+
+
+def _fiscal_year_values(prices) -> Dict[str, Any]:
+    """Map the yearly price statistics to ``FiscalYear`` columns."""
+    return {
+        'price_first': prices.get('open', None),
+        'price_last': prices.get('close', None),
+        'price_min': prices.get('low', None),
+        'price_max': prices.get('high', None),
+        'price_avg': prices.get('close_mean', None),
+        'price_std': prices.get('close_std', None),
+        'price_var': prices.get('close_var', None),
+        'price_change': prices.get('price_change', None),
+        'price_change_pct': prices.get('price_change_pct', None),
+        'price_change_pct_1y': prices.get('price_change_pct_1y', None),
+        'price_change_pct_1m': prices.get('price_change_pct_1m', None),
+        'price_change_pct_3m': prices.get('price_change_pct_3m', None),
+        'price_change_pct_6m': prices.get('price_change_pct_6m', None),
+    }
 
 
 @capture_db_errors
+@metricas.timed('db_write', table='fiscal_year')
 def save_fiscal_year(session: Session, symbol: str, year: int, prices) -> Optional[FiscalYear]:
     """Store yearly price metrics for a company.
 
@@ -267,53 +295,383 @@ def save_fiscal_year(session: Session, symbol: str, year: int, prices) -> Option
         return existing
 
     new_fiscal_year = FiscalYear(
-        symbol=symbol,
-        fiscal_year=year,
-        price_first=prices.get('open', None),
-        price_last=prices.get('close', None),
-        price_min=prices.get('low', None),
-        price_max=prices.get('high', None),
-        price_avg=prices.get('close_mean', None),
-        price_std=prices.get('close_std', None),
-        price_var=prices.get('close_var', None),
-        price_change=prices.get('price_change', None),
-        price_change_pct=prices.get('price_change_pct', None),
-        price_change_pct_1y=prices.get('price_change_pct_1y', None),
-        price_change_pct_1m=prices.get('price_change_pct_1m', None),
-        price_change_pct_3m=prices.get('price_change_pct_3m', None),
-        price_change_pct_6m=prices.get('price_change_pct_6m', None),
+        symbol=symbol, fiscal_year=year, fecha_actualizacion=datetime.now().isoformat(timespec='seconds'),
+        **_fiscal_year_values(prices),
     )
     session.add(new_fiscal_year)
     try:
         session.commit()
+        metricas.increment('db_rows_total', table='fiscal_year')
     except Exception as e:
         session.rollback()
+        metricas.increment('db_errors_total', table='fiscal_year')
         logging.error(f"Error saving fiscal year: {e}")
     return new_fiscal_year
 
 
-def extract_all_data(session: Session) -> pd.DataFrame:
-    """Return a DataFrame joining all financial tables for analysis.
+def save_fiscal_years(session: Session, symbol: str, yearly: Dict[int, Dict[str, Any]]) -> int:
+    """Insert or replace the price statistics of several fiscal years.
+
+    Unlike :func:`save_fiscal_year`, existing rows are overwritten, so
+    the current year can be refreshed as new prices arrive.
 
     Parameters
     ----------
     session:
-        Active SQLAlchemy session used for querying.
+        Active SQLAlchemy session used for persistence.
+    symbol:
+        Ticker symbol of the company.
+    yearly:
+        Price statistics keyed by fiscal year.
 
     Returns
     -------
-    pandas.DataFrame
-        Data combining company information with cash flow, balance
-        sheet and income statement metrics.
+    int
+        Number of rows written.
     """
+    return upsert_rows(session, FiscalYear, fiscal_year_rows(symbol, yearly))
+
+
+def fiscal_year_rows(symbol: str, yearly: Dict[int, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Map yearly price statistics to ``fiscal_year`` rows for :func:`upsert_rows`."""
+    fecha = datetime.now().isoformat(timespec='seconds')
+    return [
+        {'symbol': symbol, 'fiscal_year': int(year), **_fiscal_year_values(prices), 'fecha_actualizacion': fecha}
+        for year, prices in yearly.items()
+    ]
+
+
+def last_price_date(session: Session, symbol: str) -> Optional[str]:
+    """Return the last stored trading day of ``symbol`` (``YYYY-MM-DD``)."""
+    return session.query(func.max(DailyPrice.fecha)).filter(DailyPrice.symbol == symbol).scalar()
+
+
+def save_daily_prices(session: Session, symbol: str, historical: Iterable[Dict[str, Any]], batch_size: int = 5000) -> int:
+    """Insert or replace daily prices from a ``historical-price-full`` payload.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for persistence.
+    symbol:
+        Ticker symbol of the company.
+    historical:
+        Entries of the ``historical`` list of the API response.
+    batch_size:
+        Rows written per statement.
+
+    Returns
+    -------
+    int
+        Number of rows written.
+    """
+    total = 0
+    for batch in chunked(historical, batch_size):
+        total += upsert_rows(session, DailyPrice, daily_price_rows(symbol, batch))
+    return total
+
+
+def daily_price_rows(symbol: str, historical: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Map ``historical-price-full`` entries to ``daily_prices`` rows."""
+    return [
+        {
+            'symbol': symbol,
+            'fecha': entry['date'][:10],
+            'open': entry.get('open'),
+            'high': entry.get('high'),
+            'low': entry.get('low'),
+            'close': entry.get('close'),
+            'adj_close': entry.get('adjClose'),
+            'volume': entry.get('volume'),
+        }
+        for entry in historical
+    ]
+
+
+def load_daily_prices(session: Session, symbol: str) -> 'pd.DataFrame':
+    """Return the stored daily prices of ``symbol`` indexed by date."""
+    import pandas as pd
+
     query = session.query(
+        DailyPrice.fecha.label('date'), DailyPrice.open, DailyPrice.high, DailyPrice.low, DailyPrice.close,
+    ).filter(DailyPrice.symbol == symbol).order_by(DailyPrice.fecha)
+    df = pd.DataFrame(query.all(), columns=['date', 'open', 'high', 'low', 'close'])
+    df['date'] = pd.to_datetime(df['date'])
+    return df.set_index('date')
+
+
+def intern_values(session: Session, values: Iterable[Any]) -> Dict[str, int]:
+    """Return the ``filing_values`` id of every value, adding the missing ones.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for persistence.
+    values:
+        Strings to intern; ``None`` is ignored.
+
+    Returns
+    -------
+    dict
+        Mapping of each value to its id.
+    """
+    values = sorted({str(v) for v in values if v is not None})
+    if not values:
+        return {}
+    stmt = insert_on_conflict(session.get_bind().dialect.name, FilingValue).on_conflict_do_nothing()
+    session.execute(stmt, [{'valor': v} for v in values])
+    return dict(session.query(FilingValue.valor, FilingValue.id).filter(FilingValue.valor.in_(values)))
+
+
+def save_filings(session: Session, reports: List[Dict[str, Any]], commit: bool = True) -> int:
+    """Insert or replace the filing metadata of statement reports.
+
+    The three statements of a year come from the same filing, so they
+    share one ``filing`` row; the last report stored wins.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for persistence.
+    reports:
+        Reports as returned by the API.
+    commit:
+        Passed to :func:`upsert_rows`.
+
+    Returns
+    -------
+    int
+        Number of rows written.
+    """
+    reports = [r for r in reports if r.get('symbol') and r.get('calendarYear') is not None]
+    ids = intern_values(session, (
+        v for r in reports for v in (r.get('cik'), r.get('reportedCurrency'), r.get('period'))
+    ))
+    rows = {
+        (report['symbol'], int(report['calendarYear'])): {
+            'symbol': report['symbol'],
+            'fiscal_year': int(report['calendarYear']),
+            'cik_id': ids.get(str(report.get('cik'))),
+            'moneda_id': ids.get(str(report.get('reportedCurrency'))),
+            'periodo_id': ids.get(str(report.get('period'))),
+            'fecha_presentacion': parse_date(report.get('fillingDate')),
+            'fecha_aceptacion': parse_datetime(report.get('acceptedDate')),
+            'enlace': report.get('link', None),
+            'enlace_final': report.get('finalLink', None),
+        }
+        for report in reports
+    }
+    return upsert_rows(session, Filing, list(rows.values()), commit=commit)
+
+
+def filings_between(session: Session, start: Optional[date] = None, end: Optional[date] = None, accepted: bool = False):
+    """Return the filings submitted within ``[start, end]``.
+
+    The filter is a range scan on ``ix_filing_presentacion`` (or
+    ``ix_filing_aceptacion``), e.g. for the filings of one reporting
+    season.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for querying.
+    start, end:
+        Inclusive bounds; either may be ``None`` for an open range.
+    accepted:
+        Filter on the acceptance time instead of the filing date.
+
+    Returns
+    -------
+    sqlalchemy.orm.Query
+        ``Filing`` rows ordered by the filtered date.
+    """
+    if accepted:
+        column = Filing.fecha_aceptacion
+        start = parse_datetime(start) if start is not None else None
+        # Un día completo cuando ``end`` es una fecha sin hora
+        if end is not None and not isinstance(end, datetime):
+            end = datetime.combine(parse_date(end), datetime.max.time().replace(microsecond=0))
+    else:
+        column = Filing.fecha_presentacion
+        start = parse_date(start) if start is not None else None
+        end = parse_date(end) if end is not None else None
+    query = session.query(Filing)
+    if start is not None:
+        query = query.filter(column >= start)
+    if end is not None:
+        query = query.filter(column <= end)
+    return query.order_by(column)
+
+
+def latest_filings_as_of(session: Session, as_of: date):
+    """Return the latest fiscal year of each symbol filed on or before ``as_of``.
+
+    Filings dated ``as_of`` count as known, so pass the previous day to
+    exclude same-day filings. Resolved per symbol with
+    ``ix_filing_symbol_presentacion``.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for querying.
+    as_of:
+        Date the data must have been public by.
+
+    Returns
+    -------
+    sqlalchemy.sql.Subquery
+        Columns ``symbol`` and ``fiscal_year``.
+    """
+    return session.query(
+        Filing.symbol.label('symbol'),
+        func.max(Filing.fiscal_year).label('fiscal_year'),
+    ).filter(Filing.fecha_presentacion <= parse_date(as_of))\
+     .group_by(Filing.symbol).subquery()
+
+
+# Modelo y constructor de filas de cada tipo de estado financiero
+STATEMENTS = {
+    'cash_flow': (CashFlow, cash_flow_from_report),
+    'balance_sheet': (BalanceSheet, balance_sheet_from_report),
+    'income_statement': (IncomeStatement, income_statement_from_report),
+}
+
+
+def changed_reports(session: Session, tipo: str, reports: Iterable[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], str]]:
+    """Return the reports whose content differs from the stored hash.
+
+    Stored hashes are read with one query per symbol in the payload.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for querying.
+    tipo:
+        Statement type, one of :data:`STATEMENTS`.
+    reports:
+        Reports as returned by the API.
+
+    Returns
+    -------
+    list
+        ``(report, hash)`` pairs of the new or changed reports.
+    """
+    hashed: Dict[str, List[Tuple[Dict[str, Any], str]]] = {}
+    for report in reports:
+        hashed.setdefault(report.get('symbol'), []).append((report, content_hash(report)))
+
+    changed = []
+    for symbol, pairs in hashed.items():
+        stored = dict(
+            session.query(StatementHash.fiscal_year, StatementHash.hash_contenido)
+            .filter(StatementHash.symbol == symbol, StatementHash.tipo == tipo)
+        )
+        for report, digest in pairs:
+            year = report.get('calendarYear')
+            if year is None or stored.get(int(year)) != digest:
+                changed.append((report, digest))
+    return changed
+
+
+def save_statements(session: Session, tipo: str, reports: List[Dict[str, Any]], commit: bool = True) -> Dict[str, int]:
+    """Store the new or changed statement reports of a payload.
+
+    Unchanged reports are skipped before being mapped to ORM objects.
+    Rows of changed reports are replaced, their filings and their hashes
+    are written in the same transaction, so a failed write leaves the old
+    rows and hashes in place and is retried on the next refresh.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for persistence.
+    tipo:
+        Statement type, one of :data:`STATEMENTS`.
+    reports:
+        Reports as returned by the API.
+    commit:
+        Commit the transaction. When ``False`` the writes join the
+        caller's transaction.
+
+    Returns
+    -------
+    dict
+        Mapping of each symbol with written reports to its first written
+        fiscal year, the input of the ``analisis`` refreshes.
+
+    Raises
+    ------
+    Exception
+        Any database error, after rolling back when ``commit`` is set.
+    """
+    model, build = STATEMENTS[tipo]
+    changed = changed_reports(session, tipo, reports)
+    metricas.increment('statements_unchanged_total', len(reports) - len(changed), statement=tipo)
+
+    # Un año sin símbolo o repetido en la respuesta no puede ser clave primaria
+    unique: Dict[Tuple[str, int], Tuple[Dict[str, Any], str]] = {}
+    for report, digest in changed:
+        if report.get('symbol') and report.get('calendarYear') is not None:
+            unique.setdefault((report['symbol'], int(report['calendarYear'])), (report, digest))
+    if len(unique) < len(changed):
+        logging.warning(f"Skipped {len(changed) - len(unique)} {tipo} reports without a unique symbol and year")
+    if not unique:
+        return {}
+    metricas.increment('statements_changed_total', len(unique), statement=tipo)
+
+    keys: Dict[str, List[int]] = {}
+    for symbol, year in unique:
+        keys.setdefault(symbol, []).append(year)
+    fecha = datetime.now().isoformat(timespec='seconds')
+    hashes = [
+        {'symbol': symbol, 'fiscal_year': year, 'tipo': tipo, 'hash_contenido': digest, 'fecha_actualizacion': fecha}
+        for (symbol, year), (_, digest) in unique.items()
+    ]
+    try:
+        with metricas.timed('db_write', table=model.__tablename__):
+            # Borrar en bloque las filas que se van a reemplazar
+            for symbol, years in keys.items():
+                session.query(model).filter(model.symbol == symbol, model.fiscal_year.in_(years))\
+                    .delete(synchronize_session=False)
+            session.add_all([build(report) for report, _ in unique.values()])
+            session.flush()
+            save_filings(session, [report for report, _ in unique.values()], commit=False)
+            upsert_rows(session, StatementHash, hashes, commit=False)
+            if commit:
+                session.commit()
+    except Exception:
+        metricas.increment('db_errors_total', table=model.__tablename__)
+        if commit:
+            session.rollback()
+        raise
+    metricas.increment('db_rows_total', len(unique), table=model.__tablename__)
+    return {symbol: min(years) for symbol, years in keys.items()}
+
+
+def _all_data_query(session: Session):
+    """Build the query joining company, prices and the three statements.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for querying.
+
+    Returns
+    -------
+    sqlalchemy.orm.Query
+        Query selecting one row per ``(symbol, fiscal_year)``.
+    """
+    cik, moneda, periodo = aliased(FilingValue), aliased(FilingValue), aliased(FilingValue)
+    return session.query(
         Company.symbol,
         FiscalYear.fiscal_year,
-        CashFlow.moneda_reportada,
-        CashFlow.cik,
-        CashFlow.fecha_presentacion,
-        CashFlow.fecha_aceptacion,
-        CashFlow.periodo,
+        FiscalYear.price_first,
+        FiscalYear.price_last,
+        moneda.valor.label('moneda_reportada'),
+        cik.valor.label('cik'),
+        Filing.fecha_presentacion,
+        Filing.fecha_aceptacion,
+        periodo.valor.label('periodo'),
         CashFlow.beneficio_neto,
         CashFlow.depreciacion_y_amortizacion,
         CashFlow.impuestos_diferidos,
@@ -417,8 +775,278 @@ def extract_all_data(session: Session) -> pd.DataFrame:
     ).join(FiscalYear, Company.symbol == FiscalYear.symbol)\
      .join(CashFlow, and_(FiscalYear.symbol == CashFlow.symbol, FiscalYear.fiscal_year == CashFlow.fiscal_year))\
      .join(IncomeStatement, and_(FiscalYear.symbol == IncomeStatement.symbol, FiscalYear.fiscal_year == IncomeStatement.fiscal_year))\
-     .join(BalanceSheet, and_(FiscalYear.symbol == BalanceSheet.symbol, FiscalYear.fiscal_year == BalanceSheet.fiscal_year))
+     .join(BalanceSheet, and_(FiscalYear.symbol == BalanceSheet.symbol, FiscalYear.fiscal_year == BalanceSheet.fiscal_year))\
+     .outerjoin(Filing, and_(FiscalYear.symbol == Filing.symbol, FiscalYear.fiscal_year == Filing.fiscal_year))\
+     .outerjoin(cik, Filing.cik_id == cik.id)\
+     .outerjoin(moneda, Filing.moneda_id == moneda.id)\
+     .outerjoin(periodo, Filing.periodo_id == periodo.id)
+
+
+@cached_query('company', 'fiscal_year', 'cash_flow', 'balance_sheet', 'income_statement', 'filing', 'filing_values')
+def extract_all_data(session: Session) -> 'pd.DataFrame':
+    """Return a DataFrame joining all financial tables for analysis.
+
+    The result is cached until one of the joined tables is written
+    (see :mod:`bbdd.cache`).
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for querying.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Data combining company information with cash flow, balance
+        sheet and income statement metrics.
+    """
+    import pandas as pd
 
+    query = _all_data_query(session)
     df = pd.read_sql(query.statement, session.bind)
     df = df.loc[:, ~df.columns.duplicated()]
     return df
+
+
+def iter_all_data(session: Session, chunk_size: int = 5000) -> Iterator['pd.DataFrame']:
+    """Stream :func:`extract_all_data` in chunks instead of one DataFrame.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for querying.
+    chunk_size:
+        Number of rows per yielded DataFrame.
+
+    Yields
+    ------
+    pandas.DataFrame
+        Consecutive slices of the joined data.
+    """
+    query = _all_data_query(session)
+    yield from _read_sql_chunks(session, query.statement, chunk_size)
+
+
+def count_all_data(session: Session) -> int:
+    """Return the number of rows :func:`extract_all_data` would produce."""
+    return _all_data_query(session).count()
+
+
+def numeric_data_columns(session: Session) -> List[str]:
+    """Return the numeric columns of :func:`extract_all_data` in order.
+
+    Types come from the ORM models, so the result does not depend on
+    which values happen to be ``NULL``.
+    """
+    seen = set()
+    columns = []
+    for description in _all_data_query(session).column_descriptions:
+        name = description['name']
+        if name in seen:
+            continue
+        seen.add(name)
+        if isinstance(description['type'], (Float, Integer)):
+            columns.append(name)
+    return columns
+
+
+def iter_latest_data(session: Session, chunk_size: int = 5000) -> Iterator['pd.DataFrame']:
+    """Stream the most recent joined row of every company in chunks.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for querying.
+    chunk_size:
+        Number of rows per yielded DataFrame.
+
+    Yields
+    ------
+    pandas.DataFrame
+        Same columns as :func:`extract_all_data`, restricted to the
+        latest fiscal year available for each symbol.
+    """
+    latest = session.query(
+        FiscalYear.symbol.label('symbol'),
+        func.max(FiscalYear.fiscal_year).label('fiscal_year'),
+    ).join(CashFlow, and_(FiscalYear.symbol == CashFlow.symbol, FiscalYear.fiscal_year == CashFlow.fiscal_year))\
+     .join(IncomeStatement, and_(FiscalYear.symbol == IncomeStatement.symbol, FiscalYear.fiscal_year == IncomeStatement.fiscal_year))\
+     .join(BalanceSheet, and_(FiscalYear.symbol == BalanceSheet.symbol, FiscalYear.fiscal_year == BalanceSheet.fiscal_year))\
+     .group_by(FiscalYear.symbol).subquery()
+
+    query = _all_data_query(session)\
+        .join(latest, and_(FiscalYear.symbol == latest.c.symbol, FiscalYear.fiscal_year == latest.c.fiscal_year))\
+        .order_by(FiscalYear.symbol)
+
+    yield from _read_sql_chunks(session, query.statement, chunk_size)
+
+
+def _read_sql_chunks(session: Session, statement, chunk_size: int) -> Iterator['pd.DataFrame']:
+    """Read ``statement`` in DataFrame chunks over a streaming connection.
+
+    Without ``stream_results`` the driver buffers the whole result set
+    before the first chunk is built. The connection is not the one of
+    ``session``, so ``session`` can commit while the chunks are consumed;
+    the rows may therefore differ from a count taken on ``session`` while
+    another process writes.
+    """
+    import pandas as pd
+
+    with session.bind.connect() as conn:
+        conn = conn.execution_options(stream_results=True)
+        for chunk in pd.read_sql(statement, conn, chunksize=chunk_size):
+            yield chunk.loc[:, ~chunk.columns.duplicated()]
+
+
+def save_predictions(session: Session, predictions: 'pd.DataFrame', model_version: str) -> int:
+    """Bulk upsert model scores into the ``predictions`` table.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for persistence.
+    predictions:
+        DataFrame with ``symbol``, ``fiscal_year`` and ``puntuacion``
+        columns.
+    model_version:
+        Version identifier of the model that produced the scores.
+
+    Returns
+    -------
+    int
+        Number of rows written.
+    """
+    if predictions.empty:
+        return 0
+    fecha_calculo = datetime.now().isoformat(timespec='seconds')
+    rows = [
+        {
+            'symbol': symbol,
+            'fiscal_year': int(fiscal_year),
+            'model_version': model_version,
+            'puntuacion': float(puntuacion),
+            'fecha_calculo': fecha_calculo,
+        }
+        for symbol, fiscal_year, puntuacion in predictions[['symbol', 'fiscal_year', 'puntuacion']].itertuples(index=False)
+    ]
+    return upsert_rows(session, Prediction, rows)
+
+
+def save_stock_list(session: Session, entries: Iterable[Dict[str, Any]], batch_size: int = 5000) -> int:
+    """Cache ``stock/list`` entries in the ``stock_list`` table.
+
+    Entries are consumed lazily and written in batches, so only one batch
+    is held in memory while the list is being downloaded.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for persistence.
+    entries:
+        Iterable of entries as returned by the API.
+    batch_size:
+        Number of entries written per statement.
+
+    Returns
+    -------
+    int
+        Number of entries stored.
+    """
+    fecha = datetime.now().isoformat(timespec='seconds')
+    total = 0
+    for batch in chunked(entries, batch_size):
+        rows = [
+            {
+                'symbol': entry['symbol'],
+                'name': entry.get('name'),
+                'price': entry.get('price'),
+                'exchange': entry.get('exchange'),
+                'exchange_short_name': entry.get('exchangeShortName'),
+                'type': entry.get('type'),
+                'fecha_actualizacion': fecha,
+            }
+            for entry in batch
+            if entry.get('symbol')
+        ]
+        total += upsert_rows(session, ListedSymbol, rows)
+    return total
+
+
+def iter_listed_symbols(session: Session, exchanges: Optional[Iterable[str]] = None, page_size: int = 1000) -> Iterator[str]:
+    """Yield cached symbols in primary key order, one page at a time.
+
+    Pages are fetched with keyset pagination (``symbol > last``), so
+    commits made by the caller between pages do not affect the scan.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for the queries.
+    exchanges:
+        Optional exchange short names to keep, e.g. ``('NYSE', 'NASDAQ')``.
+    page_size:
+        Number of symbols fetched per query.
+
+    Yields
+    ------
+    str
+        Cached ticker symbols.
+    """
+    query = session.query(ListedSymbol.symbol)
+    if exchanges is not None:
+        query = query.filter(ListedSymbol.exchange_short_name.in_(list(exchanges)))
+    last = None
+    while True:
+        page = query
+        if last is not None:
+            page = page.filter(ListedSymbol.symbol > last)
+        symbols = [s for (s,) in page.order_by(ListedSymbol.symbol).limit(page_size)]
+        if not symbols:
+            return
+        yield from symbols
+        last = symbols[-1]
+
+
+def upsert_rows(session: Session, model, rows: List[Dict[str, Any]], commit: bool = True) -> int:
+    """Insert ``rows`` into ``model``'s table, replacing primary key clashes.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for persistence.
+    model:
+        Declarative model class of the target table.
+    rows:
+        Column-name to value mappings. All rows must share the same keys.
+    commit:
+        Commit the statement. When ``False`` it joins the caller's
+        transaction and errors are raised instead of logged, so the caller
+        can roll back every write of its unit of work.
+
+    Returns
+    -------
+    int
+        Number of rows written, ``0`` when the statement failed.
+    """
+    if not rows:
+        return 0
+    keys = [c.name for c in model.__table__.primary_key]
+    stmt = insert_on_conflict(session.get_bind().dialect.name, model)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=keys,
+        set_={name: stmt.excluded[name] for name in rows[0] if name not in keys},
+    )
+    try:
+        with metricas.timed('db_write', table=model.__tablename__):
+            session.execute(stmt, rows)
+            if commit:
+                session.commit()
+    except Exception as e:
+        metricas.increment('db_errors_total', table=model.__tablename__)
+        if not commit:
+            raise
+        session.rollback()
+        logging.error(f"Error saving {model.__tablename__}: {e}")
+        return 0
+    metricas.increment('db_rows_total', len(rows), table=model.__tablename__)
+    return len(rows)
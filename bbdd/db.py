@@ -1,45 +1,212 @@
-"""Database engine and table creation utilities."""
+"""Database engine and table creation utilities.
 
-from sqlalchemy import create_engine
+The engine is created on first use through :func:`get_engine` (or the
+``engine`` module attribute), so importing the package does not touch
+the filesystem. SQLite files run in WAL mode and :func:`get_read_engine`
+adds a separate pool of read-only connections for concurrent readers.
+Session events bump the per-table write generations that
+:mod:`bbdd.cache` uses to invalidate cached query results.
+"""
+
+from itertools import chain
+from typing import Iterable, List, Optional
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL, Connection, Engine, make_url
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session
 from conf import *
+from .utils import insert_on_conflict
+import metricas
 
-# Logging configuration
-logging.basicConfig(level=logging.WARNING)
-logging.getLogger('sqlalchemy').setLevel(logging.WARNING)
-logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
-logging.getLogger('sqlalchemy.pool').setLevel(logging.ERROR)
+Base = declarative_base()
 
-# Clear handlers
-logging.getLogger('sqlalchemy').handlers = []
-logging.getLogger('sqlalchemy.engine').handlers = []
-logging.getLogger('sqlalchemy.pool').handlers = []
+_engine: Optional[Engine] = None
+_read_engine: Optional[Engine] = None
 
-file_handler = logging.FileHandler('sqlalchemy.log')
-file_handler.setLevel(logging.WARNING)
-logging.getLogger('sqlalchemy').addHandler(file_handler)
 
-engine = create_engine(f'sqlite:///{DATA_BASE}', echo=True)
-Base = declarative_base()
+def _configure_sqlalchemy_logging() -> None:
+    """Send SQLAlchemy warnings to ``sqlalchemy.log`` instead of the console."""
+    # Logging configuration
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('sqlalchemy').setLevel(logging.WARNING)
+    logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
+    logging.getLogger('sqlalchemy.pool').setLevel(logging.ERROR)
+
+    # Clear handlers
+    logging.getLogger('sqlalchemy').handlers = []
+    logging.getLogger('sqlalchemy.engine').handlers = []
+    logging.getLogger('sqlalchemy.pool').handlers = []
+
+    file_handler = logging.FileHandler('sqlalchemy.log')
+    file_handler.setLevel(logging.WARNING)
+    logging.getLogger('sqlalchemy').addHandler(file_handler)
+
+
+def get_engine() -> Engine:
+    """Return the process-wide engine, creating it on first call.
+
+    Returns
+    -------
+    sqlalchemy.engine.Engine
+        Engine bound to ``settings.database_url``.
+    """
+    global _engine
+    if _engine is None:
+        _configure_sqlalchemy_logging()
+        url = make_url(settings.database_url)
+        if _is_sqlite_file(url):
+            settings.ensure_data_dir()
+            _engine = create_engine(url, echo=settings.sql_echo, connect_args={'timeout': settings.db_busy_timeout})
+            _configure_sqlite(_engine)
+        else:
+            _engine = create_engine(url, echo=settings.sql_echo)
+    return _engine
+
+
+def get_read_engine() -> Engine:
+    """Return the process-wide read-only engine, creating it on first call.
+
+    For a SQLite file this is a separate pool of ``settings.read_pool_size``
+    connections opened with ``mode=ro`` and ``query_only``. In WAL mode
+    they read the last committed snapshot while the write engine keeps
+    writing, so readers and the writer never wait for each other. Other
+    databases share :func:`get_engine`.
+
+    Returns
+    -------
+    sqlalchemy.engine.Engine
+        Engine for read-only sessions.
+    """
+    global _read_engine
+    if _read_engine is None:
+        engine = get_engine()
+        if not _is_sqlite_file(engine.url):
+            _read_engine = engine
+            return _read_engine
+        url = engine.url.set(database=f'file:{engine.url.database}', query={'mode': 'ro', 'uri': 'true'})
+        _read_engine = create_engine(
+            url, echo=settings.sql_echo, pool_size=settings.read_pool_size, max_overflow=0,
+            connect_args={'timeout': settings.db_busy_timeout},
+        )
+        _configure_sqlite(_read_engine, read_only=True)
+    return _read_engine
+
+
+def _is_sqlite_file(url: URL) -> bool:
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def _configure_sqlite(engine: Engine, read_only: bool = False) -> None:
+    """Set the pragmas every new connection of ``engine`` needs."""
+
+    @event.listens_for(engine, 'connect')
+    def _pragmas(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        if read_only:
+            cursor.execute('PRAGMA query_only = ON')
+        else:
+            # WAL: los lectores no bloquean al escritor ni al revés
+            cursor.execute('PRAGMA journal_mode = WAL')
+            cursor.execute('PRAGMA synchronous = NORMAL')
+        cursor.close()
 
 
-def create_tables(delete_db: bool = False) -> None:
+def __getattr__(name: str):
+    if name == 'engine':
+        return get_engine()
+    if name == 'read_engine':
+        return get_read_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@event.listens_for(Session, 'after_commit')
+def _count_commit(session: Session) -> None:
+    """Count every commit issued by any session."""
+    metricas.increment('db_commits_total')
+    session.info.pop('tablas_escritas', None)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_writes(session: Session) -> None:
+    session.info.pop('tablas_escritas', None)
+
+
+def bump_generations(conn: Connection, tables: Iterable[str]) -> List[str]:
+    """Increment the write generation of ``tables`` in the transaction of ``conn``.
+
+    Sessions bump them from their events; writes that bypass the ORM
+    session, like the migration steps, call this directly.
+
+    Returns
+    -------
+    List[str]
+        Tables bumped, without ``table_generations`` itself.
+    """
+    from .models import TableGeneration
+
+    generations = TableGeneration.__table__
+    tables = sorted(set(tables) - {generations.name})
+    if not tables:
+        return tables
+    stmt = insert_on_conflict(conn.dialect.name, generations).on_conflict_do_update(
+        index_elements=['tabla'],
+        set_={'generacion': generations.c.generacion + 1},
+    )
+    conn.execute(stmt, [{'tabla': table, 'generacion': 1} for table in tables])
+    return tables
+
+
+def _bump_generations(session: Session, tables: Iterable[str]) -> None:
+    """Increment the write generation of ``tables`` in the current transaction."""
+    # Por la conexión y no por la sesión, para no volver a disparar los eventos
+    tables = bump_generations(session.connection(), tables)
+    if tables:
+        session.info.setdefault('tablas_escritas', set()).update(tables)
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_after_flush(session: Session, flush_context) -> None:
+    """Bump the generation of every table written by an ORM flush."""
+    objects = chain(session.new, session.deleted, (o for o in session.dirty if session.is_modified(o)))
+    _bump_generations(session, {o.__table__.name for o in objects})
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _bump_after_dml(state):
+    """Bump the generation of the table written by an INSERT, UPDATE or DELETE statement."""
+    if not (state.is_insert or state.is_update or state.is_delete):
+        return None
+    result = state.invoke_statement()
+    _bump_generations(state.session, [state.statement.table.name])
+    return result
+
+
+def create_tables(delete_db: bool = False, engine: Optional[Engine] = None) -> None:
     """Create the database schema.
 
     Parameters
     ----------
     delete_db:
         If ``True``, existing tables are dropped before being recreated.
+    engine:
+        Engine to create the tables in. Defaults to :func:`get_engine`.
 
     This helper ensures the SQLite database contains all tables defined
-    in the ORM models. Errors are logged but not raised to the caller.
+    in the ORM models and migrates tables left with an older layout (see
+    :mod:`bbdd.migraciones`). Errors are logged but not raised to the
+    caller.
     """
+    from . import models  # noqa: F401  registra todas las tablas en Base.metadata
+    from .migraciones import migrate
+
+    engine = engine or get_engine()
     try:
         if delete_db:
             Base.metadata.drop_all(engine)
             logging.info("Tables dropped successfully in the database.")
         Base.metadata.create_all(engine)
         logging.info("Tables created successfully in the database.")
+        migrate(engine)
     except Exception as e:
         logging.error(f"Error creating tables: {e}")
         logging.error(traceback.format_exc())
@@ -0,0 +1,219 @@
+"""Export of the fundamentals dataset to Arrow IPC (Feather v2) files.
+
+The joined statements, yearly prices, growth features and sector ratios
+are written as one uncompressed Arrow IPC file per fiscal year
+(``fiscal_year=YYYY.arrow``). Consumers memory-map them with
+:func:`read_dataset`, which reads only the requested columns without
+copying or converting anything.
+
+The export is incremental. ``_manifest.json`` stores the table
+generations and a signature per fiscal year built from SQL aggregates
+(row counts, statement content hashes, price sums and update and
+ranking timestamps). Only partitions whose signature changed are rewritten.
+"""
+
+import json
+from typing import Any, Dict, Iterable, List, Optional
+from sqlalchemy import Date, DateTime, Float, Integer, and_, func
+from sqlalchemy.orm import Session
+from conf import *
+from .models import (
+    BalanceSheet,
+    CashFlow,
+    FiscalYear,
+    GrowthFeature,
+    IncomeStatement,
+    RiskMetric,
+    SectorRank,
+    StatementHash,
+)
+from .crud import _all_data_query
+from .cache import table_generations
+from .utils import content_hash
+import metricas
+
+MANIFEST = '_manifest.json'
+TABLAS = ['company', 'fiscal_year', 'cash_flow', 'balance_sheet', 'income_statement',
+          'filing', 'filing_values', 'statement_hashes', 'growth_features', 'sector_ranks',
+          'risk_metrics']
+# Columnas de metadatos que no se exportan
+EXCLUIDAS = {'symbol', 'fiscal_year', 'fecha_calculo', 'ultima_fecha', 'fecha_actualizacion', 'fecha_indice'}
+
+
+def _export_query(session: Session):
+    """Extend :func:`bbdd.crud._all_data_query` with prices, features, ratios and risk metrics."""
+    extra = [c for c in FiscalYear.__table__.columns if c.name not in EXCLUIDAS]
+    extra += [c for c in GrowthFeature.__table__.columns if c.name not in EXCLUIDAS]
+    extra += [c for c in SectorRank.__table__.columns if c.name not in EXCLUIDAS]
+    extra += [c for c in RiskMetric.__table__.columns if c.name not in EXCLUIDAS]
+    return _all_data_query(session).add_columns(*extra)\
+        .outerjoin(GrowthFeature, and_(FiscalYear.symbol == GrowthFeature.symbol, FiscalYear.fiscal_year == GrowthFeature.fiscal_year))\
+        .outerjoin(SectorRank, and_(FiscalYear.symbol == SectorRank.symbol, FiscalYear.fiscal_year == SectorRank.fiscal_year))\
+        .outerjoin(RiskMetric, and_(FiscalYear.symbol == RiskMetric.symbol, FiscalYear.fiscal_year == RiskMetric.fiscal_year))
+
+
+def arrow_schema(query):
+    """Arrow schema of ``query`` built from the ORM column types."""
+    import pyarrow as pa
+
+    fields, seen = [], set()
+    for description in query.column_descriptions:
+        name = description['name']
+        if name in seen:
+            continue
+        seen.add(name)
+        if isinstance(description['type'], Integer):
+            fields.append(pa.field(name, pa.int64()))
+        elif isinstance(description['type'], Float):
+            fields.append(pa.field(name, pa.float64()))
+        elif isinstance(description['type'], DateTime):
+            fields.append(pa.field(name, pa.timestamp('s')))
+        elif isinstance(description['type'], Date):
+            fields.append(pa.field(name, pa.date32()))
+        else:
+            fields.append(pa.field(name, pa.string()))
+    return pa.schema(fields)
+
+
+def partition_signatures(session: Session) -> Dict[int, str]:
+    """Return a signature per fiscal year that changes whenever its data does.
+
+    Statements are covered by the content hashes stored at ingest time,
+    prices by row counts, sums and the time they were last updated, and
+    the derived tables by the time they were last computed.
+    """
+    partes: Dict[int, List[Any]] = {}
+
+    def add(rows) -> None:
+        for year, *values in rows:
+            partes.setdefault(int(year), []).append(values)
+
+    # Las sumas no ven cambios en el resto de estadísticas de precios; la hora de actualización sí
+    add(session.query(
+        FiscalYear.fiscal_year, func.count(), func.total(FiscalYear.price_first), func.total(FiscalYear.price_last),
+        func.max(FiscalYear.fecha_actualizacion),
+    ).group_by(FiscalYear.fiscal_year))
+    for model in (CashFlow, BalanceSheet, IncomeStatement):
+        add(session.query(model.fiscal_year, func.count()).group_by(model.fiscal_year))
+    hashes = session.query(StatementHash.fiscal_year, StatementHash.symbol, StatementHash.tipo, StatementHash.hash_contenido)\
+        .order_by(StatementHash.fiscal_year, StatementHash.symbol, StatementHash.tipo)
+    digests: Dict[int, List[str]] = {}
+    for year, _, _, digest in hashes:
+        digests.setdefault(int(year), []).append(digest)
+    add((year, content_hash(values)) for year, values in digests.items())
+    for model in (GrowthFeature, SectorRank, RiskMetric):
+        add(session.query(model.fiscal_year, func.count(), func.max(model.fecha_calculo)).group_by(model.fiscal_year))
+    return {year: content_hash(values) for year, values in partes.items()}
+
+
+def _read_manifest(directory: str) -> Dict[str, Any]:
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fichero:
+        return json.load(fichero)
+
+
+def _partition_path(directory: str, year: int) -> str:
+    return os.path.join(directory, f'fiscal_year={year}.arrow')
+
+
+def export_dataset(session: Session, directory: str, full: bool = False) -> List[int]:
+    """Write the changed fiscal-year partitions of the dataset to ``directory``.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for querying.
+    directory:
+        Output directory of the partitions and the manifest.
+    full:
+        Rewrite every partition regardless of the manifest.
+
+    Returns
+    -------
+    list
+        Fiscal years whose partition was written.
+    """
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    os.makedirs(directory, exist_ok=True)
+    query = _export_query(session)
+    schema = arrow_schema(query)
+    esquema = content_hash([f'{f.name}:{f.type}' for f in schema])
+    manifest = {} if full else _read_manifest(directory)
+    if manifest.get('schema') != esquema:
+        manifest = {}
+
+    # Sin generaciones (base antigua) sólo las firmas de partición deciden qué reescribir
+    generaciones = table_generations(session, TABLAS)
+    generations = dict(zip(TABLAS, generaciones)) if generaciones is not None else None
+    if manifest and generations is not None and manifest.get('generations') == generations:
+        logging.info("Dataset export is up to date")
+        return []
+
+    signatures = partition_signatures(session)
+    previas = manifest.get('partitions', {})
+    escritas = []
+    for year in sorted(signatures):
+        path = _partition_path(directory, year)
+        if previas.get(str(year)) == signatures[year] and os.path.exists(path):
+            continue
+        with metricas.timed('export_partition'):
+            df = pd.read_sql(query.filter(FiscalYear.fiscal_year == year).statement, session.bind)
+            df = df.loc[:, ~df.columns.duplicated()]
+            table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+            # Sin compresión para que los lectores puedan mapear el fichero sin copias
+            feather.write_feather(table, path + '.tmp', compression='uncompressed')
+            os.replace(path + '.tmp', path)
+        escritas.append(year)
+        logging.info(f"Exported {table.num_rows} rows for {year}")
+
+    # Borrar particiones de años que ya no existen
+    for year in set(map(int, previas)) - set(signatures):
+        path = _partition_path(directory, year)
+        if os.path.exists(path):
+            os.remove(path)
+
+    manifest = {
+        'schema': esquema,
+        'generations': generations,
+        'partitions': {str(year): signature for year, signature in signatures.items()},
+    }
+    with open(os.path.join(directory, MANIFEST + '.tmp'), 'w') as fichero:
+        json.dump(manifest, fichero, indent=2)
+    os.replace(os.path.join(directory, MANIFEST + '.tmp'), os.path.join(directory, MANIFEST))
+    metricas.increment('export_partitions_total', len(escritas))
+    return escritas
+
+
+def read_dataset(directory: str, columns: Optional[List[str]] = None, years: Optional[Iterable[int]] = None):
+    """Memory-map the exported partitions as a single Arrow table.
+
+    Parameters
+    ----------
+    directory:
+        Directory written by :func:`export_dataset`.
+    columns:
+        Columns to read; the others are never touched.
+    years:
+        Fiscal years to read; defaults to every partition.
+
+    Returns
+    -------
+    pyarrow.Table
+        Zero-copy view over the memory-mapped files, one chunk per year.
+    """
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    if years is None:
+        years = sorted(int(y) for y in _read_manifest(directory).get('partitions', {}))
+    tables = [
+        feather.read_table(_partition_path(directory, year), columns=columns, memory_map=True)
+        for year in years
+        if os.path.exists(_partition_path(directory, year))
+    ]
+    return pa.concat_tables(tables) if tables else pa.table({})
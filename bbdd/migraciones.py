@@ -0,0 +1,123 @@
+"""In-place schema migrations run by :func:`bbdd.db.create_tables`.
+
+``create_all`` only creates missing tables, so databases built by an
+older version keep their old layout. Every step checks for the layout
+it converts and does nothing otherwise, so running them again is safe.
+Steps write through a plain connection, outside the session events, so
+each bumps the write generation of the tables it rewrites in its own
+transaction; cached query results read from them are then invalidated.
+"""
+
+from typing import Set
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from conf import *
+from .db import bump_generations
+
+ESTADOS = ('cash_flow', 'balance_sheet', 'income_statement')
+# Columnas de metadatos que se trasladaron a la tabla ``filing``
+COLUMNAS_FILING = (
+    'moneda_reportada', 'cik', 'fecha_presentacion', 'fecha_aceptacion', 'periodo', 'enlace', 'enlace_final',
+)
+
+
+def _columns(conn: Connection, table: str) -> Set[str]:
+    return {column['name'] for column in inspect(conn).get_columns(table)}
+
+
+def move_filing_metadata(conn: Connection) -> None:
+    """Move the filing metadata of the statement tables to ``filing``.
+
+    Values are interned into ``filing_values``, one ``filing`` row is
+    kept per symbol and year, and the columns are dropped from the
+    statement tables, which SQLite rewrites without them.
+    """
+    for table in ESTADOS:
+        if table not in inspect(conn).get_table_names() or 'enlace' not in _columns(conn, table):
+            continue
+        logging.info(f"Moving filing metadata out of {table}")
+        conn.execute(text(f"""
+            INSERT OR IGNORE INTO filing_values (valor)
+            SELECT CAST(cik AS TEXT) FROM {table} WHERE cik IS NOT NULL
+            UNION SELECT moneda_reportada FROM {table} WHERE moneda_reportada IS NOT NULL
+            UNION SELECT periodo FROM {table} WHERE periodo IS NOT NULL
+        """))
+        conn.execute(text(f"""
+            INSERT OR IGNORE INTO filing (
+                symbol, fiscal_year, cik_id, moneda_id, periodo_id,
+                fecha_presentacion, fecha_aceptacion, enlace, enlace_final
+            )
+            SELECT t.symbol, t.fiscal_year,
+                   (SELECT id FROM filing_values WHERE valor = CAST(t.cik AS TEXT)),
+                   (SELECT id FROM filing_values WHERE valor = t.moneda_reportada),
+                   (SELECT id FROM filing_values WHERE valor = t.periodo),
+                   t.fecha_presentacion, t.fecha_aceptacion, t.enlace, t.enlace_final
+            FROM {table} AS t
+        """))
+        for column in COLUMNAS_FILING:
+            conn.execute(text(f'ALTER TABLE {table} DROP COLUMN {column}'))
+        bump_generations(conn, [table, 'filing', 'filing_values'])
+
+
+def type_filing_dates(conn: Connection) -> None:
+    """Normalize the filing dates to the format of their typed columns.
+
+    SQLite has no date storage class: ``Date`` and ``DATETIME`` columns
+    hold ISO text, which sorts chronologically. Free-form values left by
+    older versions are rewritten to that format (or ``NULL`` when they
+    cannot be parsed), and the range indexes are created on databases
+    whose ``filing`` table predates them.
+    """
+    from .models import Filing
+
+    if 'filing' not in inspect(conn).get_table_names():
+        return
+    presentacion = conn.execute(text(
+        "UPDATE filing SET fecha_presentacion = date(fecha_presentacion)"
+        " WHERE fecha_presentacion IS NOT date(fecha_presentacion)"
+    ))
+    aceptacion = conn.execute(text(
+        "UPDATE filing SET fecha_aceptacion = datetime(fecha_aceptacion)"
+        " WHERE fecha_aceptacion IS NOT datetime(fecha_aceptacion)"
+    ))
+    if presentacion.rowcount or aceptacion.rowcount:
+        bump_generations(conn, ['filing'])
+    for index in Filing.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def add_fiscal_year_update_time(conn: Connection) -> None:
+    """Add ``fiscal_year.fecha_actualizacion``, which marks price updates for the sector ranks.
+
+    Existing rows keep ``NULL`` and count as ranked with their current prices.
+    """
+    if 'fiscal_year' not in inspect(conn).get_table_names() or 'fecha_actualizacion' in _columns(conn, 'fiscal_year'):
+        return
+    logging.info("Adding fecha_actualizacion to fiscal_year")
+    conn.execute(text('ALTER TABLE fiscal_year ADD COLUMN fecha_actualizacion VARCHAR'))
+    bump_generations(conn, ['fiscal_year'])
+
+
+def add_risk_metric_benchmark_time(conn: Connection) -> None:
+    """Add ``risk_metrics.fecha_indice``, which ties every beta to the benchmark year it used.
+
+    Existing rows keep ``NULL`` and are recomputed once the benchmark
+    series of their year is stored.
+    """
+    if 'risk_metrics' not in inspect(conn).get_table_names() or 'fecha_indice' in _columns(conn, 'risk_metrics'):
+        return
+    logging.info("Adding fecha_indice to risk_metrics")
+    conn.execute(text('ALTER TABLE risk_metrics ADD COLUMN fecha_indice VARCHAR'))
+    bump_generations(conn, ['risk_metrics'])
+
+
+PASOS = [move_filing_metadata, type_filing_dates, add_fiscal_year_update_time, add_risk_metric_benchmark_time]
+
+
+def migrate(engine: Engine) -> None:
+    """Apply every pending migration step in one transaction per step."""
+    if engine.dialect.name != 'sqlite':
+        return
+    for paso in PASOS:
+        with engine.begin() as conn:
+            paso(conn)
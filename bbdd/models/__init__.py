@@ -3,6 +3,19 @@ from .balance_sheet import BalanceSheet
 from .income_statement import IncomeStatement
 from .company import Company
 from .fiscal_year import FiscalYear
+from .prediction import Prediction
+from .growth_feature import GrowthFeature
+from .sector_rank import SectorRank
+from .listed_symbol import ListedSymbol
+from .job import Job
+from .statement_hash import StatementHash
+from .table_generation import TableGeneration
+from .daily_price import DailyPrice
+from .filing import Filing
+from .filing_value import FilingValue
+from .risk_metric import RiskMetric
+from .data_issue import DataIssue
+from .benchmark_return import BenchmarkReturn
 
 __all__ = [
     'CashFlow',
@@ -10,4 +23,17 @@ __all__ = [
     'IncomeStatement',
     'Company',
     'FiscalYear',
+    'Prediction',
+    'GrowthFeature',
+    'SectorRank',
+    'ListedSymbol',
+    'Job',
+    'StatementHash',
+    'TableGeneration',
+    'DailyPrice',
+    'Filing',
+    'FilingValue',
+    'RiskMetric',
+    'DataIssue',
+    'BenchmarkReturn',
 ]
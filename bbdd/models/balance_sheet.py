@@ -18,12 +18,6 @@ class BalanceSheet(Base):
         primaryjoin="and_(BalanceSheet.symbol == FiscalYear.symbol, BalanceSheet.fiscal_year == FiscalYear.fiscal_year)"
     )
 
-    moneda_reportada = Column(String, comment="Currency used in the report")
-    cik = Column(String, comment="SEC Central Index Key identifier")
-    fecha_presentacion = Column(String, comment="Filing submission date")
-    fecha_aceptacion = Column(String, comment="Filing acceptance date")
-    periodo = Column(String, comment="Reporting period type")
-
     efectivo_y_equivalentes = Column(Float, comment="Cash and cash equivalents")
     inversiones_corto_plazo = Column(Float, comment="Short-term investments")
     efectivo_y_inversiones_corto_plazo = Column(
@@ -104,6 +98,3 @@ class BalanceSheet(Base):
     total_inversiones = Column(Float, comment="Total investments")
     total_deuda = Column(Float, comment="Total debt")
     deuda_neta = Column(Float, comment="Net debt")
-
-    enlace = Column(String, comment="Original filing link")
-    enlace_final = Column(String, comment="Final filing link")
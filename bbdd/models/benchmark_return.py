@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Float, String, PrimaryKeyConstraint
+from conf import *
+from ..db import Base
+
+
+class BenchmarkReturn(Base):
+    """Daily return of the benchmark index used for ``beta``.
+
+    The series is stored so risk refreshes can tell which years of the
+    index changed: every row of a rewritten year gets the same
+    ``fecha_calculo``, and metrics computed before it are stale.
+    """
+
+    __tablename__ = 'benchmark_returns'
+
+    indice = Column(String, nullable=False, comment="Benchmark symbol, or 'equiponderado' for the equal-weighted index")
+    fecha = Column(String, nullable=False, comment="Trading day (YYYY-MM-DD)")
+
+    __table_args__ = (
+        PrimaryKeyConstraint('indice', 'fecha'),
+    )
+
+    rentabilidad = Column(Float, comment="Return of the index over the previous trading day")
+
+    fecha_calculo = Column(String, comment="Timestamp when the year of this day was last rewritten")
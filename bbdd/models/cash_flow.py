@@ -18,12 +18,6 @@ class CashFlow(Base):
         primaryjoin="and_(CashFlow.symbol == FiscalYear.symbol, CashFlow.fiscal_year == FiscalYear.fiscal_year)"
     )
 
-    moneda_reportada = Column(String, comment="Currency used in the report")
-    cik = Column(String, comment="SEC Central Index Key identifier")
-    fecha_presentacion = Column(String, comment="Filing submission date")
-    fecha_aceptacion = Column(String, comment="Filing acceptance date")
-    periodo = Column(String, comment="Reporting period type")
-
     beneficio_neto = Column(Float, comment="Net income")
     depreciacion_y_amortizacion = Column(
         Float,
@@ -67,6 +61,3 @@ class CashFlow(Base):
     saldo_efectivo_inicio = Column(Float, comment="Cash at beginning of period")
     saldo_efectivo_cierre = Column(Float, comment="Cash at end of period")
     flujo_libre_caja = Column(Float, comment="Free cash flow")
-
-    enlace = Column(String, comment="Original filing link")
-    enlace_final = Column(String, comment="Final filing link")
@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, Float, String, PrimaryKeyConstraint
+from conf import *
+from ..db import Base
+
+
+class DailyPrice(Base):
+    """Daily trading prices of a company.
+
+    The stored history lets price refreshes request only the days after
+    the last stored date and recompute the yearly statistics locally.
+    """
+
+    __tablename__ = 'daily_prices'
+
+    symbol = Column(String, nullable=False, comment="Ticker symbol of the company")
+    fecha = Column(String, nullable=False, comment="Trading day (YYYY-MM-DD)")
+
+    __table_args__ = (
+        PrimaryKeyConstraint('symbol', 'fecha'),
+    )
+
+    open = Column(Float, comment="Opening price of the day")
+    high = Column(Float, comment="Highest price of the day")
+    low = Column(Float, comment="Lowest price of the day")
+    close = Column(Float, comment="Closing price of the day")
+    adj_close = Column(Float, comment="Closing price adjusted for splits and dividends")
+    volume = Column(Integer, comment="Number of shares traded")
@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, String, Float, PrimaryKeyConstraint
+from conf import *
+from ..db import Base
+
+
+class DataIssue(Base):
+    """Consistency rule broken by a company's data in a fiscal year.
+
+    The table is replaced on every audit, so it always describes the
+    current contents of the database.
+    """
+
+    __tablename__ = 'data_issues'
+
+    symbol = Column(String, nullable=False, comment="Ticker symbol of the company")
+    fiscal_year = Column(Integer, nullable=False, comment="Fiscal year of the offending data")
+    regla = Column(String, nullable=False, comment="Name of the broken rule (see bbdd.auditoria.REGLAS)")
+
+    __table_args__ = (
+        PrimaryKeyConstraint('symbol', 'fiscal_year', 'regla'),
+    )
+
+    valor = Column(Float, comment="Reported value")
+    esperado = Column(Float, comment="Value implied by the related items")
+    detalle = Column(String, comment="Description of the inconsistency")
+
+    fecha_calculo = Column(String, comment="Timestamp of the audit")
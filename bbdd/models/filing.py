@@ -0,0 +1,42 @@
+from sqlalchemy import Column, Date, Integer, String, ForeignKey, PrimaryKeyConstraint, Index
+from sqlalchemy.dialects.sqlite import DATETIME
+from sqlalchemy.orm import relationship
+from conf import *
+from ..db import Base
+
+
+class Filing(Base):
+    """Filing metadata shared by the three statements of a fiscal year.
+
+    The rarely read strings live here instead of being repeated in every
+    statement row, so scans of the numeric statement tables read fewer
+    pages. Low-cardinality values are ids into ``filing_values``.
+
+    Dates are typed columns stored as ISO text, which sorts like the
+    date itself, so the indexes below serve range filters directly.
+    """
+
+    __tablename__ = 'filing'
+
+    symbol = Column(String, nullable=False, comment="Ticker symbol of the company")
+    fiscal_year = Column(Integer, nullable=False, comment="Fiscal year of the filing")
+
+    __table_args__ = (
+        PrimaryKeyConstraint('symbol', 'fiscal_year'),
+        Index('ix_filing_presentacion', 'fecha_presentacion'),
+        Index('ix_filing_aceptacion', 'fecha_aceptacion'),
+        # Consultas a fecha pasada: última presentación de cada símbolo
+        Index('ix_filing_symbol_presentacion', 'symbol', 'fecha_presentacion', 'fiscal_year'),
+    )
+
+    cik_id = Column(Integer, ForeignKey('filing_values.id'), comment="SEC Central Index Key identifier")
+    moneda_id = Column(Integer, ForeignKey('filing_values.id'), comment="Currency used in the report")
+    periodo_id = Column(Integer, ForeignKey('filing_values.id'), comment="Reporting period type")
+    fecha_presentacion = Column(Date, comment="Filing submission date")
+    fecha_aceptacion = Column(DATETIME(truncate_microseconds=True), comment="Filing acceptance time")
+    enlace = Column(String, comment="Original filing link")
+    enlace_final = Column(String, comment="Final filing link")
+
+    cik = relationship("FilingValue", foreign_keys=[cik_id], viewonly=True)
+    moneda = relationship("FilingValue", foreign_keys=[moneda_id], viewonly=True)
+    periodo = relationship("FilingValue", foreign_keys=[periodo_id], viewonly=True)
@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Integer, String
+from conf import *
+from ..db import Base
+
+
+class FilingValue(Base):
+    """Dictionary of the repeated strings of filing metadata.
+
+    Currencies, period types and CIKs take few distinct values, so
+    :class:`~bbdd.models.filing.Filing` stores the integer id of each one.
+    """
+
+    __tablename__ = 'filing_values'
+
+    id = Column(Integer, primary_key=True, comment="Identifier referenced by the filing table")
+    valor = Column(String, nullable=False, unique=True, comment="Interned string value")
@@ -74,6 +74,7 @@ class FiscalYear(Base):
         Float,
         comment="Percentage price change over the last six months",
     )
+    fecha_actualizacion = Column(String, comment="Timestamp when the price metrics were last stored")
 
     @property
     def market_cap(self):
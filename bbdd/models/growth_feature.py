@@ -0,0 +1,35 @@
+from sqlalchemy import Column, Integer, String, Float, PrimaryKeyConstraint
+from conf import *
+from ..db import Base
+
+
+class GrowthFeature(Base):
+    """Lagged growth, CAGR and margin momentum features per fiscal year."""
+
+    __tablename__ = 'growth_features'
+
+    symbol = Column(String, nullable=False, comment="Ticker symbol of the company")
+    fiscal_year = Column(Integer, nullable=False, comment="Fiscal year of the features")
+
+    __table_args__ = (
+        PrimaryKeyConstraint('symbol', 'fiscal_year'),
+    )
+
+    crecimiento_ingresos = Column(Float, comment="Revenue growth over the previous year")
+    crecimiento_eps = Column(Float, comment="EPS growth over the previous year")
+    crecimiento_flujo_libre_caja = Column(Float, comment="Free cash flow growth over the previous year")
+    crecimiento_patrimonio = Column(Float, comment="Stockholders' equity growth over the previous year")
+    cagr_ingresos_3a = Column(Float, comment="Three-year revenue CAGR")
+    cagr_ingresos_5a = Column(Float, comment="Five-year revenue CAGR")
+    cagr_eps_3a = Column(Float, comment="Three-year EPS CAGR")
+    cagr_eps_5a = Column(Float, comment="Five-year EPS CAGR")
+    cagr_flujo_libre_caja_3a = Column(Float, comment="Three-year free cash flow CAGR")
+    cagr_flujo_libre_caja_5a = Column(Float, comment="Five-year free cash flow CAGR")
+    variacion_margen_bruto = Column(Float, comment="Change in gross margin over the previous year")
+    variacion_margen_operativo = Column(Float, comment="Change in operating margin over the previous year")
+    variacion_margen_neto = Column(Float, comment="Change in net margin over the previous year")
+    variacion_deuda_neta = Column(Float, comment="Change in net debt over the previous year")
+    media_flujo_libre_caja_3a = Column(Float, comment="Three-year rolling mean of free cash flow")
+    media_margen_operativo_5a = Column(Float, comment="Five-year rolling mean of operating margin")
+
+    fecha_calculo = Column(String, comment="Timestamp when the features were computed")
@@ -2,6 +2,7 @@ from sqlalchemy import Column, Integer, String, Float, ForeignKey, and_
 from sqlalchemy.orm import relationship
 from conf import *
 from ..db import Base
+from ..utils import subtract
 
 
 class IncomeStatement(Base):
@@ -18,12 +19,6 @@ class IncomeStatement(Base):
         primaryjoin="and_(IncomeStatement.symbol == FiscalYear.symbol, IncomeStatement.fiscal_year == FiscalYear.fiscal_year)"
     )
 
-    moneda_reportada = Column(String, comment="Currency used in the report")
-    cik = Column(Integer, comment="SEC Central Index Key identifier")
-    fecha_presentacion = Column(String, comment="Filing submission date")
-    fecha_aceptacion = Column(String, comment="Filing acceptance date")
-    periodo = Column(String, comment="Reporting period type")
-
     ingresos = Column(Float, comment="Total revenue")
     costo_ingresos = Column(Float, comment="Cost of revenue")
     coste_de_las_ventas = Column(Float, comment="Cost of goods sold")
@@ -81,30 +76,27 @@ class IncomeStatement(Base):
         comment="Weighted average diluted shares outstanding",
     )
 
-    enlace = Column(String, comment="Original filing link")
-    enlace_final = Column(String, comment="Final filing link")
-
     @property
     def beneficio_bruto(self):
         """Gross profit calculated as revenue minus cost of goods sold."""
-        return self.ingresos - self.coste_de_las_ventas
+        return subtract(self.ingresos, self.coste_de_las_ventas)
 
     @property
     def resultado_operativo(self):
         """Operating income before depreciation and amortization."""
-        return self.beneficio_bruto - self.gastos_operativos
+        return subtract(self.beneficio_bruto, self.gastos_operativos)
 
     @property
     def resultado_explotacion(self):
         """EBIT: operating income minus depreciation and amortization."""
-        return self.resultado_operativo - self.depreciaciones_amortizaciones
+        return subtract(self.resultado_operativo, self.depreciaciones_amortizaciones)
 
     @property
     def beneficio_antes_impuestos(self):
         """Earnings before taxes."""
-        return self.resultado_explotacion - self.gastos_por_intereses
+        return subtract(self.resultado_explotacion, self.gastos_por_intereses)
 
     @property
     def beneficio_neto(self):
         """Net income after taxes."""
-        return self.beneficio_antes_impuestos - self.impuestos
+        return subtract(self.beneficio_antes_impuestos, self.impuestos)
@@ -0,0 +1,29 @@
+from sqlalchemy import Column, Integer, String, PrimaryKeyConstraint, Index
+from conf import *
+from ..db import Base
+
+
+class Job(Base):
+    """Refresh job of one API endpoint for one company.
+
+    Timestamps are ISO strings, so due and lease comparisons are plain
+    string comparisons that SQLite can serve from ``ix_jobs_due``.
+    """
+
+    __tablename__ = 'jobs'
+
+    symbol = Column(String, nullable=False, comment="Ticker symbol of the company")
+    endpoint = Column(String, nullable=False, comment="API endpoint to refresh (profile, cash_flow, ...)")
+
+    __table_args__ = (
+        PrimaryKeyConstraint('symbol', 'endpoint'),
+        Index('ix_jobs_due', 'proxima_ejecucion', 'prioridad'),
+    )
+
+    prioridad = Column(Integer, nullable=False, default=0, comment="Higher values are claimed first")
+    proxima_ejecucion = Column(String, nullable=False, comment="Timestamp from which the job is due")
+    intentos = Column(Integer, nullable=False, default=0, comment="Consecutive failed or unfinished attempts")
+    reclamado_por = Column(String, comment="Worker holding the job")
+    reclamado_hasta = Column(String, comment="Timestamp when the worker's claim expires")
+    ultima_ejecucion = Column(String, comment="Timestamp of the last successful run")
+    ultimo_error = Column(String, comment="Error message of the last failed run")
@@ -0,0 +1,29 @@
+from sqlalchemy import Column, String, Float, Index
+from conf import *
+from ..db import Base
+
+
+class ListedSymbol(Base):
+    """Entry of the cached ``stock/list`` symbol universe.
+
+    The table replaces ``lista_empresas.csv``: symbols are read in primary
+    key order page by page, so a run never needs the whole list in memory.
+    """
+
+    __tablename__ = 'stock_list'
+
+    symbol = Column(
+        String,
+        primary_key=True,
+        comment="Ticker symbol identifying the company",
+    )
+    name = Column(String, comment="Name of the listed company")
+    price = Column(Float, comment="Last price reported by the list")
+    exchange = Column(String, comment="Exchange where the symbol trades")
+    exchange_short_name = Column(String, comment="Abbreviated name of the stock exchange")
+    type = Column(String, comment="Security type (stock, etf, ...)")
+    fecha_actualizacion = Column(String, comment="Timestamp when the entry was last listed")
+
+    __table_args__ = (
+        Index('ix_stock_list_exchange', 'exchange_short_name', 'symbol'),
+    )
@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, String, Float, PrimaryKeyConstraint
+from conf import *
+from ..db import Base
+
+
+class Prediction(Base):
+    """Model score for a company's fiscal year and model version."""
+
+    __tablename__ = 'predictions'
+
+    symbol = Column(String, nullable=False, comment="Ticker symbol of the company")
+    fiscal_year = Column(Integer, nullable=False, comment="Fiscal year of the scored features")
+    model_version = Column(String, nullable=False, comment="Version of the model that produced the score")
+
+    __table_args__ = (
+        PrimaryKeyConstraint('symbol', 'fiscal_year', 'model_version'),
+    )
+
+    puntuacion = Column(Float, comment="Predicted price change percentage")
+    fecha_calculo = Column(String, comment="Timestamp when the score was computed")
@@ -0,0 +1,31 @@
+from sqlalchemy import Column, Integer, String, Float, PrimaryKeyConstraint
+from conf import *
+from ..db import Base
+
+
+class RiskMetric(Base):
+    """Risk metrics of a calendar year computed from the daily prices.
+
+    Rows share the ``(symbol, fiscal_year)`` key of ``fiscal_year``, whose
+    yearly price statistics cover the same calendar year.
+    """
+
+    __tablename__ = 'risk_metrics'
+
+    symbol = Column(String, nullable=False, comment="Ticker symbol of the company")
+    fiscal_year = Column(Integer, nullable=False, comment="Calendar year of the daily prices")
+
+    __table_args__ = (
+        PrimaryKeyConstraint('symbol', 'fiscal_year'),
+    )
+
+    rentabilidad_anual = Column(Float, comment="Total return over the year")
+    volatilidad_anual = Column(Float, comment="Annualized standard deviation of the daily returns")
+    desviacion_bajista = Column(Float, comment="Annualized downside deviation of the daily returns below zero")
+    max_drawdown = Column(Float, comment="Largest fall from a running peak within the year (negative)")
+    beta = Column(Float, comment="Beta of the daily returns against the benchmark index")
+    dias = Column(Integer, comment="Number of daily returns in the year")
+    ultima_fecha = Column(String, comment="Last trading day included (YYYY-MM-DD)")
+
+    fecha_calculo = Column(String, comment="Timestamp when the metrics were computed")
+    fecha_indice = Column(String, comment="fecha_calculo of the benchmark year the beta was computed with")
@@ -0,0 +1,40 @@
+from sqlalchemy import Column, Integer, String, Float, PrimaryKeyConstraint, Index
+from conf import *
+from ..db import Base
+
+
+class SectorRank(Base):
+    """Valuation ratios ranked within their ``(sector, fiscal_year)`` group.
+
+    Percentiles are ascending, so a low ``per_percentil`` means the
+    company is cheap relative to its sector peers that year.
+    """
+
+    __tablename__ = 'sector_ranks'
+
+    symbol = Column(String, nullable=False, comment="Ticker symbol of the company")
+    fiscal_year = Column(Integer, nullable=False, comment="Fiscal year of the ratios")
+    sector = Column(String, comment="Sector the company was ranked in")
+
+    __table_args__ = (
+        PrimaryKeyConstraint('symbol', 'fiscal_year'),
+        Index('ix_sector_ranks_sector_year', 'sector', 'fiscal_year'),
+    )
+
+    per = Column(Float, comment="Price-to-earnings ratio")
+    per_percentil = Column(Float, comment="PER percentile within sector and year")
+    per_zscore = Column(Float, comment="PER z-score within sector and year")
+    pfcf = Column(Float, comment="Price-to-free-cash-flow ratio")
+    pfcf_percentil = Column(Float, comment="P/FCF percentile within sector and year")
+    pfcf_zscore = Column(Float, comment="P/FCF z-score within sector and year")
+    pb = Column(Float, comment="Price-to-book ratio")
+    pb_percentil = Column(Float, comment="P/B percentile within sector and year")
+    pb_zscore = Column(Float, comment="P/B z-score within sector and year")
+    ps = Column(Float, comment="Price-to-sales ratio")
+    ps_percentil = Column(Float, comment="P/S percentile within sector and year")
+    ps_zscore = Column(Float, comment="P/S z-score within sector and year")
+    ev_ebit = Column(Float, comment="Enterprise value to operating income")
+    ev_ebit_percentil = Column(Float, comment="EV/EBIT percentile within sector and year")
+    ev_ebit_zscore = Column(Float, comment="EV/EBIT z-score within sector and year")
+
+    fecha_calculo = Column(String, comment="Timestamp when the group was ranked")
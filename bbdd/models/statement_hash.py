@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, String, PrimaryKeyConstraint
+from conf import *
+from ..db import Base
+
+
+class StatementHash(Base):
+    """Content hash of the last stored payload of a financial statement.
+
+    Refreshes compare incoming payloads against these hashes and skip
+    the reports that did not change.
+    """
+
+    __tablename__ = 'statement_hashes'
+
+    symbol = Column(String, nullable=False, comment="Ticker symbol of the company")
+    fiscal_year = Column(Integer, nullable=False, comment="Fiscal year of the statement")
+    tipo = Column(String, nullable=False, comment="Statement type: cash_flow, balance_sheet or income_statement")
+
+    __table_args__ = (
+        PrimaryKeyConstraint('symbol', 'tipo', 'fiscal_year'),
+    )
+
+    hash_contenido = Column(String, nullable=False, comment="BLAKE2b digest of the canonical JSON payload")
+    fecha_actualizacion = Column(String, comment="Timestamp when the payload was stored")
@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Integer, String
+from conf import *
+from ..db import Base
+
+
+class TableGeneration(Base):
+    """Write counter of a table, bumped by every write through a session.
+
+    Cached query results are keyed by the generations of the tables they
+    read, so any committed write invalidates them.
+    """
+
+    __tablename__ = 'table_generations'
+
+    tabla = Column(String, primary_key=True, comment="Name of the written table")
+    generacion = Column(Integer, nullable=False, default=0, comment="Number of write batches committed to the table")
@@ -0,0 +1,78 @@
+"""Thread-safe sessions for concurrent readers and writers.
+
+Each thread gets its own session from a :class:`~sqlalchemy.orm.scoped_session`
+registry, so analytics threads never share a connection or an identity
+map. Read sessions are bound to :func:`bbdd.db.get_read_engine` and
+write sessions to :func:`bbdd.db.get_engine`; with SQLite in WAL mode
+many readers run next to the single writer without locking each other.
+"""
+
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from conf import *
+from .db import get_engine, get_read_engine
+
+_registries: Dict[bool, scoped_session] = {}
+_lock = threading.Lock()
+
+
+def get_session_registry(read_only: bool = False) -> scoped_session:
+    """Return the thread-local session registry for reads or writes.
+
+    Parameters
+    ----------
+    read_only:
+        Bind the sessions to the read-only engine.
+
+    Returns
+    -------
+    sqlalchemy.orm.scoped_session
+        Registry whose call returns the session of the current thread.
+    """
+    registry = _registries.get(read_only)
+    if registry is None:
+        with _lock:
+            registry = _registries.get(read_only)
+            if registry is None:
+                engine = get_read_engine() if read_only else get_engine()
+                registry = scoped_session(sessionmaker(bind=engine))
+                _registries[read_only] = registry
+    return registry
+
+
+@contextmanager
+def session_scope(read_only: bool = False) -> Iterator[Session]:
+    """Yield the current thread's session and release it on exit.
+
+    Write sessions are committed when the block succeeds and rolled back
+    when it raises; read sessions are only rolled back, which ends their
+    snapshot. Nested scopes in the same thread share the session and only
+    the outermost one commits and removes it.
+
+    Parameters
+    ----------
+    read_only:
+        Use the read-only engine. Writes through this session fail.
+
+    Yields
+    ------
+    sqlalchemy.orm.Session
+        Session owned by the current thread.
+    """
+    registry = get_session_registry(read_only)
+    session = registry()
+    profundidad = session.info.get('profundidad', 0)
+    session.info['profundidad'] = profundidad + 1
+    try:
+        yield session
+        if profundidad == 0 and not read_only:
+            session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.info['profundidad'] = profundidad
+        if profundidad == 0:
+            registry.remove()
@@ -1,7 +1,11 @@
 """Utility helpers used across database modules."""
 
+import hashlib
+import json
+from datetime import date, datetime
+from itertools import islice
 from conf import *
-from typing import Callable, Optional, TypeVar
+from typing import Any, Callable, Iterable, Iterator, List, Optional, TypeVar
 
 
 def divide(a: float, b: float) -> Optional[float]:
@@ -22,6 +26,54 @@ def divide(a: float, b: float) -> Optional[float]:
     return a / b if b != 0 else None
 
 
+def subtract(a: Optional[float], *others: Optional[float]) -> Optional[float]:
+    """Subtract ``others`` from ``a``.
+
+    Parameters
+    ----------
+    a:
+        Minuend.
+    others:
+        Values subtracted from ``a``.
+
+    Returns
+    -------
+    Optional[float]
+        The difference or ``None`` when any operand is missing.
+    """
+    if a is None or any(b is None for b in others):
+        return None
+    return a - sum(others)
+
+
+def insert_on_conflict(dialect: str, table):
+    """Return an ``INSERT`` into ``table`` that supports ``ON CONFLICT`` clauses.
+
+    SQLite and PostgreSQL share the ``on_conflict_do_update`` and
+    ``on_conflict_do_nothing`` API; their constructs only compile for
+    their own dialect, so the one of ``dialect`` is chosen.
+
+    Parameters
+    ----------
+    dialect:
+        Name of the database dialect, e.g. ``connection.dialect.name``.
+    table:
+        Table or declarative model to insert into.
+
+    Raises
+    ------
+    NotImplementedError
+        For databases without ``ON CONFLICT``.
+    """
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        raise NotImplementedError(f"Upserts are not supported on {dialect} databases")
+    return insert(table)
+
+
 F = TypeVar("F", bound=Callable[..., Optional[float]])
 
 
@@ -48,3 +100,87 @@ def capture_db_errors(func: F) -> F:
             return None
 
     return error  # type: ignore[return-value]
+
+
+T = TypeVar("T")
+
+
+def chunked(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Yield consecutive slices of ``items`` with at most ``size`` elements.
+
+    ``items`` is consumed lazily, so generators are never materialized.
+
+    Parameters
+    ----------
+    items:
+        Items to split, e.g. symbols for a SQL ``IN`` clause.
+    size:
+        Maximum length of each slice.
+
+    Yields
+    ------
+    list
+        Consecutive slices of ``items``.
+    """
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def content_hash(payload: Any) -> str:
+    """Return a stable digest of a JSON-serializable payload.
+
+    Keys are sorted, so two payloads with the same content always hash
+    alike whatever the order the API sent them in.
+
+    Parameters
+    ----------
+    payload:
+        Decoded JSON value, e.g. one statement report.
+
+    Returns
+    -------
+    str
+        Hex BLAKE2b digest of 16 bytes.
+    """
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def parse_datetime(value: Any) -> Optional[datetime]:
+    """Parse an API timestamp such as ``2024-02-14 16:39:56``.
+
+    Returns
+    -------
+    Optional[datetime]
+        The parsed value, ``None`` when ``value`` is empty or malformed.
+    """
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime.combine(value, datetime.min.time())
+    try:
+        return datetime.fromisoformat(str(value).strip()[:19])
+    except ValueError:
+        return None
+
+
+def parse_date(value: Any) -> Optional[date]:
+    """Parse the date part of an API date or timestamp.
+
+    Returns
+    -------
+    Optional[date]
+        The parsed value, ``None`` when ``value`` is empty or malformed.
+    """
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value).strip()[:10])
+    except ValueError:
+        return None
@@ -0,0 +1,4 @@
+from .synthetic import SyntheticUniverse
+from .fmp_stub import StubConfig, serve
+
+__all__ = ['SyntheticUniverse', 'StubConfig', 'serve']
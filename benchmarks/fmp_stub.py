@@ -0,0 +1,244 @@
+"""Local stand-in for the FMP API used by ``obtener_datos_empresas.py``.
+
+Usage::
+
+    python -m benchmarks.fmp_stub --port 8765 --companies 500 --latency-ms 40 --rate-limit-rps 50
+    FMP_API_URL=http://127.0.0.1:8765/api/v3/ python obtener_datos_empresas.py
+
+Payloads come from recorded JSON files when available and from a
+:class:`SyntheticUniverse` otherwise. Latency, server errors and HTTP 429
+responses can be injected to load-test concurrency and retry behaviour
+without an API key or quota. ``GET /_stats`` returns the request counters.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter, OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+from conf import *
+from .synthetic import SyntheticUniverse
+
+ENDPOINTS = (
+    'stock/list', 'profile', 'historical-price-full', 'cash-flow-statement',
+    'balance-sheet-statement', 'income-statement',
+)
+
+
+class StubConfig:
+    """Behaviour knobs of the stub server.
+
+    Parameters
+    ----------
+    universe:
+        Source of synthetic payloads.
+    recordings:
+        Optional directory with recorded responses stored as
+        ``<endpoint>/<symbol>.json`` (``stock/list.json`` for the list).
+    latency_ms, jitter_ms:
+        Mean and uniform jitter of the delay added to every response.
+    error_rate:
+        Probability of answering with HTTP 500.
+    rate_limit_rate:
+        Probability of answering with HTTP 429 regardless of load.
+    rate_limit_rps:
+        Requests per second allowed before answering HTTP 429; ``0``
+        disables the limiter.
+    seed:
+        Seed of the fault injection generator.
+    """
+
+    def __init__(self, universe: SyntheticUniverse, recordings: Optional[str] = None,
+                 latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, rate_limit_rps: float = 0.0, seed: int = 0) -> None:
+        self.universe = universe
+        self.recordings = recordings
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rate_limit_rps = rate_limit_rps
+        self.random = random.Random(seed)
+        self.stats: Counter = Counter()
+        self.lock = threading.Lock()
+        self._tokens = rate_limit_rps
+        self._refilled = time.monotonic()
+        self._cache: 'OrderedDict[str, bytes]' = OrderedDict()
+
+    def allow(self) -> bool:
+        """Take a token from the rate limiter bucket."""
+        if self.rate_limit_rps <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate_limit_rps, self._tokens + (now - self._refilled) * self.rate_limit_rps)
+            self._refilled = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def fault(self) -> Optional[int]:
+        """Return the status code of an injected failure, if any."""
+        with self.lock:
+            roll = self.random.random()
+        if roll < self.error_rate:
+            return 500
+        if roll < self.error_rate + self.rate_limit_rate or not self.allow():
+            return 429
+        return None
+
+    def delay(self) -> float:
+        """Return the artificial latency of one response in seconds."""
+        if not self.latency_ms and not self.jitter_ms:
+            return 0.0
+        with self.lock:
+            jitter = self.random.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(0.0, self.latency_ms + jitter) / 1000
+
+    def body(self, url: str) -> Optional[bytes]:
+        """Return the serialized payload of ``url`` or ``None`` for unknown paths."""
+        with self.lock:
+            if url in self._cache:
+                self._cache.move_to_end(url)
+                return self._cache[url]
+        payload = self._recorded(url)
+        if payload is None:
+            payload = self.universe.route(url)
+        if payload is None:
+            return None
+        data = json.dumps(payload).encode()
+        with self.lock:
+            self._cache[url] = data
+            if len(self._cache) > 2048:
+                self._cache.popitem(last=False)
+        return data
+
+    def _recorded(self, url: str) -> Any:
+        """Load a recorded payload for ``url`` when one exists."""
+        if not self.recordings:
+            return None
+        path = urlsplit(url).path.split('/api/v3/', 1)[-1].strip('/')
+        candidate = os.path.join(self.recordings, f'{path}.json')
+        if not os.path.isfile(candidate):
+            return None
+        with open(candidate) as f:
+            return json.load(f)
+
+
+def make_handler(config: StubConfig):
+    """Build the request handler class bound to ``config``."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self) -> None:
+            path = urlsplit(self.path).path
+            if path == '/_stats':
+                with config.lock:
+                    self._send(200, json.dumps(dict(config.stats)).encode())
+                return
+
+            endpoint = path.split('/api/v3/', 1)[-1].strip('/')
+            if endpoint != 'stock/list':
+                endpoint = endpoint.rpartition('/')[0]
+            with config.lock:
+                config.stats['requests'] += 1
+                config.stats[f'endpoint:{endpoint}'] += 1
+
+            time.sleep(config.delay())
+            status = config.fault()
+            if status == 429:
+                self._count('status:429')
+                self._send(429, b'{"Error Message": "Limit Reach"}', {'Retry-After': '1'})
+                return
+            if status == 500:
+                self._count('status:500')
+                self._send(500, b'{"Error Message": "Injected server error"}')
+                return
+
+            body = config.body(self.path) if endpoint in ENDPOINTS else None
+            if body is None:
+                self._count('status:404')
+                self._send(404, b'{"Error Message": "Unknown endpoint"}')
+                return
+            self._count('status:200')
+            with config.lock:
+                config.stats['bytes'] += len(body)
+            self._send(200, body)
+
+        def _count(self, key: str) -> None:
+            with config.lock:
+                config.stats[key] += 1
+
+        def _send(self, status: int, body: bytes, headers: Optional[Dict[str, str]] = None) -> None:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            logging.debug(format % args)
+
+    return Handler
+
+
+def serve(config: StubConfig, host: str = '127.0.0.1', port: int = 8765) -> ThreadingHTTPServer:
+    """Start the stub in a background thread and return the server.
+
+    Call ``shutdown()`` on the returned server to stop it.
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"FMP stub listening on http://{host}:{server.server_port}/api/v3/")
+    return server
+
+
+def main() -> None:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='Serve synthetic or recorded FMP payloads locally.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--companies', type=int, default=100)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--recordings', default=None, help='Directory with recorded <endpoint>/<symbol>.json files')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Probability of HTTP 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Probability of HTTP 429')
+    parser.add_argument('--rate-limit-rps', type=float, default=0.0, help='Requests/sec before HTTP 429 (0 = off)')
+    args = parser.parse_args()
+    configure_logging(logging.INFO)
+
+    config = StubConfig(
+        SyntheticUniverse(args.companies, args.years, args.seed),
+        recordings=args.recordings,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        rate_limit_rps=args.rate_limit_rps,
+        seed=args.seed,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(config))
+    server.daemon_threads = True
+    logging.info(f"FMP stub listening on http://{args.host}:{args.port}/api/v3/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Stub server stopped.")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
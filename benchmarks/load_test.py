@@ -0,0 +1,188 @@
+"""Load test of the query service in ``servidor.py``.
+
+Usage::
+
+    python servidor.py --port 8080 &
+    python -m benchmarks.load_test --url http://127.0.0.1:8080 --concurrency 32 --duration 20
+
+``--concurrency`` keep-alive connections send requests back to back for
+``--duration`` seconds, drawing routes from :data:`MIX` and symbols from
+``/companies``. The JSON report has the requests per second, the p50,
+p90 and p99 latencies overall and per route, and the error count.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+import numpy as np
+from conf import *
+from analisis.ranking import RATIOS
+
+# Ruta -> peso en la mezcla de peticiones
+MIX = {'screen': 3, 'scores': 2, 'ratios': 3, 'fundamentals': 2, 'prices': 2}
+
+
+class Connection:
+    """Minimal HTTP/1.1 keep-alive client for GET requests."""
+
+    def __init__(self, host: str, port: int) -> None:
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def get(self, path: str) -> Tuple[int, bytes]:
+        """Send ``GET path`` and return the status and the whole body."""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(f'GET {path} HTTP/1.1\r\nHost: {self.host}\r\n\r\n'.encode('latin-1'))
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        headers: Dict[str, str] = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding') == 'chunked':
+            parts = []
+            while True:
+                size = int((await self.reader.readline()).strip(), 16)
+                data = await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+                parts.append(data[:-2])
+            body = b''.join(parts)
+        else:
+            body = await self.reader.readexactly(int(headers.get('content-length', 0)))
+        if headers.get('connection') == 'close':
+            await self.close()
+        return status, body
+
+    async def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+def request_path(route: str, symbols: List[str], rng: random.Random, fmt: str, since: date) -> str:
+    """Return a random request of ``route``; price requests start at ``since``."""
+    symbol = rng.choice(symbols)
+    if route == 'screen':
+        path = f'/screen?ratio={rng.choice(RATIOS)}&max_percentile=0.2&limit=50'
+    elif route == 'scores':
+        path = '/scores?limit=50'
+    elif route == 'prices':
+        path = f'/prices/{symbol}?from={since.isoformat()}'
+    else:
+        path = f'/{route}/{symbol}'
+    return path + ('&' if '?' in path else '?') + f'format={fmt}'
+
+
+async def run(url: str, concurrency: int, duration: float, fmt: str = 'json', symbols: int = 500,
+              since: Optional[date] = None, seed: int = 0) -> Dict[str, Any]:
+    """Load the service at ``url`` and return the report."""
+    parts = urlsplit(url)
+    host, port = parts.hostname or '127.0.0.1', parts.port or 80
+    rng = random.Random(seed)
+    since = since or date.today() - timedelta(days=365)
+
+    connection = Connection(host, port)
+    status, body = await connection.get('/companies')
+    await connection.close()
+    if status != 200:
+        raise RuntimeError(f"/companies answered {status}")
+    universe = [row['symbol'] for row in json.loads(body)]
+    if not universe:
+        raise RuntimeError("The database has no companies")
+    universe = rng.sample(universe, min(symbols, len(universe)))
+
+    routes, weights = zip(*MIX.items())
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    received = [0]
+    deadline = time.perf_counter() + duration
+
+    async def worker(index: int) -> None:
+        local = random.Random(seed + index)
+        connection = Connection(host, port)
+        try:
+            while time.perf_counter() < deadline:
+                route = local.choices(routes, weights)[0]
+                path = request_path(route, universe, local, fmt, since)
+                inicio = time.perf_counter()
+                try:
+                    status, body = await connection.get(path)
+                except (ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+                    errors[route] += 1
+                    await connection.close()
+                    continue
+                latencies[route].append(time.perf_counter() - inicio)
+                received[0] += len(body)
+                if status != 200:
+                    errors[route] += 1
+        finally:
+            await connection.close()
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - inicio
+
+    def summary(values: List[float]) -> Dict[str, Any]:
+        if not values:
+            return {'requests': 0}
+        ms = np.asarray(values) * 1000
+        return {
+            'requests': len(values),
+            'p50_ms': round(float(np.percentile(ms, 50)), 2),
+            'p90_ms': round(float(np.percentile(ms, 90)), 2),
+            'p99_ms': round(float(np.percentile(ms, 99)), 2),
+            'max_ms': round(float(ms.max()), 2),
+        }
+
+    todas = [value for values in latencies.values() for value in values]
+    return {
+        'url': url,
+        'format': fmt,
+        'concurrency': concurrency,
+        'seconds': round(elapsed, 3),
+        'requests_per_sec': round(len(todas) / elapsed, 1),
+        'errors': sum(errors.values()),
+        'mb_received': round(received[0] / 1e6, 2),
+        'latency': summary(todas),
+        'routes': {route: dict(summary(latencies[route]), errors=errors[route]) for route in routes},
+    }
+
+
+def main() -> None:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='Load test the query service.')
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--format', choices=['json', 'arrow'], default='json')
+    parser.add_argument('--symbols', type=int, default=500, help='Symbols sampled from /companies')
+    parser.add_argument('--since', type=date.fromisoformat, default=None, help='First day of price requests (default: a year ago)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='Write the JSON report to this file')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.url, args.concurrency, args.duration, args.format, args.symbols, args.since, args.seed))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
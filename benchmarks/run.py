@@ -0,0 +1,267 @@
+"""Time the main pipeline stages on a synthetic universe.
+
+Usage::
+
+    python -m benchmarks.run --companies 200 --years 10 --output data/bench.json
+
+Every stage runs against its own throwaway SQLite database and reports
+wall time, throughput and peak traced memory. The JSON report is meant to
+be stored and diffed between commits to catch regressions.
+
+The ingest is measured through ``run_pipeline`` and the batched
+``save_statements``; the per-report writers and ``process_company`` are
+only run when requested with ``--stages``, as :data:`LEGACY_STAGES`.
+"""
+
+import argparse
+import contextlib
+import gc
+import json
+import platform
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List, Optional
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from conf import *
+import bbdd
+import metricas
+import obtener_datos_empresas
+from .synthetic import SyntheticUniverse
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STAGES = ['save_company', 'save_statements', 'run_pipeline', 'extract_all_data', 'train_model']
+# Escrituras de una fila o un informe por llamada que ya no usa la ingesta
+LEGACY_STAGES = [
+    'save_fiscal_year', 'save_cash_flow', 'save_balance_sheet', 'save_income_statement', 'process_company',
+]
+
+
+@contextlib.contextmanager
+def stub_api(universe: SyntheticUniverse) -> Iterator[None]:
+    """Serve every ``make_request`` call from ``universe`` instead of FMP."""
+    original = obtener_datos_empresas.make_request
+    obtener_datos_empresas.make_request = universe.route
+    try:
+        yield
+    finally:
+        obtener_datos_empresas.make_request = original
+
+
+@contextlib.contextmanager
+def process_database(path: str) -> Iterator[None]:
+    """Point the process-wide engines and sessions at the database in ``path``.
+
+    ``run_pipeline`` opens its own sessions with ``bbdd.session_scope``
+    from several threads, so it cannot be given a session factory.
+    """
+    from bbdd import db, sesiones
+
+    anterior = settings.__dict__.get('database_url')
+    settings.__dict__['database_url'] = f'sqlite:///{path}'
+    db._engine = db._read_engine = None
+    sesiones._registries.clear()
+    try:
+        yield
+    finally:
+        for engine in (db._engine, db._read_engine):
+            if engine is not None:
+                engine.dispose()
+        db._engine = db._read_engine = None
+        sesiones._registries.clear()
+        if anterior is None:
+            settings.__dict__.pop('database_url', None)
+        else:
+            settings.__dict__['database_url'] = anterior
+
+
+def session_factory(path: str) -> sessionmaker:
+    """Create an empty database at ``path`` and return a session factory."""
+    engine = create_engine(f'sqlite:///{path}')
+    bbdd.create_tables(engine=engine)
+    return sessionmaker(bind=engine)
+
+
+def measure(name: str, stage: Callable[[], int], trace_memory: bool = True) -> Dict[str, Any]:
+    """Run ``stage`` once and return its timing and memory figures.
+
+    ``stage`` must return the number of items it processed so throughput
+    can be reported.
+    """
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    items = stage()
+    seconds = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    result = {
+        'seconds': round(seconds, 4),
+        'items': items,
+        'items_per_sec': round(items / seconds, 2) if seconds else None,
+        'peak_mb': round(peak, 2) if peak is not None else None,
+    }
+    logging.warning(f"{name}: {items} items in {seconds:.3f}s")
+    return result
+
+
+def run(companies: int = 100, years: int = 10, seed: int = 0, stages: Optional[List[str]] = None,
+        trace_memory: bool = True) -> Dict[str, Any]:
+    """Run the selected benchmark stages and return the JSON-ready report."""
+    stages = stages or STAGES
+    metricas.REGISTRY.reset()
+    universe = SyntheticUniverse(companies=companies, years=years, seed=seed)
+    report: Dict[str, Any] = {
+        'meta': {
+            'companies': companies,
+            'years': years,
+            'seed': seed,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'stages': {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        def fresh(name: str) -> sessionmaker:
+            return session_factory(os.path.join(tmp, f'{name}.db'))
+
+        # Los payloads se generan fuera del tiempo medido
+        payloads = {
+            'save_cash_flow': [r for s in universe.symbols for r in universe.cash_flow(s)],
+            'save_balance_sheet': [r for s in universe.symbols for r in universe.balance_sheet(s)],
+            'save_income_statement': [r for s in universe.symbols for r in universe.income_statement(s)],
+            'save_company': [universe.profile(s)[0] for s in universe.symbols],
+        }
+        rng = np.random.default_rng(seed)
+        fiscal_years = [
+            (s, y, dict(zip(['open', 'close', 'low', 'high', 'close_mean', 'close_std'], rng.uniform(1, 100, 6))))
+            for s in universe.symbols
+            for y in range(universe.end_year - years + 1, universe.end_year + 1)
+        ]
+
+        if 'save_statements' in stages:
+            Session = fresh('save_statements')
+
+            def stage() -> int:
+                with Session() as session:
+                    for tipo in obtener_datos_empresas.ESTADOS:
+                        bbdd.save_statements(session, tipo, payloads[f'save_{tipo}'])
+                return sum(len(payloads[f'save_{tipo}']) for tipo in obtener_datos_empresas.ESTADOS)
+
+            report['stages']['save_statements'] = measure('save_statements', stage, trace_memory)
+
+        for name in ('save_company', 'save_cash_flow', 'save_balance_sheet', 'save_income_statement'):
+            if name not in stages:
+                continue
+            Session = fresh(name)
+            save = getattr(bbdd, name)
+
+            def stage(save=save, reports=payloads[name], Session=Session) -> int:
+                with Session() as session:
+                    for report in reports:
+                        save(session, report)
+                return len(reports)
+
+            report['stages'][name] = measure(name, stage, trace_memory)
+
+        if 'save_fiscal_year' in stages:
+            Session = fresh('save_fiscal_year')
+
+            def stage() -> int:
+                with Session() as session:
+                    for symbol, year, prices in fiscal_years:
+                        bbdd.save_fiscal_year(session, symbol, year, prices)
+                return len(fiscal_years)
+
+            report['stages']['save_fiscal_year'] = measure('save_fiscal_year', stage, trace_memory)
+
+        if 'process_company' in stages:
+            Session = fresh('process_company')
+
+            def stage() -> int:
+                with stub_api(universe), Session() as session:
+                    for symbol in universe.symbols:
+                        obtener_datos_empresas.process_company(session, symbol)
+                        session.commit()
+                return companies
+
+            report['stages']['process_company'] = measure('process_company', stage, trace_memory)
+
+        ingest = fresh('ingest')
+        if {'run_pipeline', 'extract_all_data', 'train_model'} & set(stages):
+            with ingest() as session:
+                bbdd.save_stock_list(session, universe.stock_list())
+
+            def stage() -> int:
+                with stub_api(universe), process_database(os.path.join(tmp, 'ingest.db')):
+                    with bbdd.session_scope() as session:
+                        return obtener_datos_empresas.run_pipeline(session)
+
+            result = measure('run_pipeline', stage, trace_memory)
+            if 'run_pipeline' in stages:
+                report['stages']['run_pipeline'] = result
+
+        extracted = None
+        if {'extract_all_data', 'train_model'} & set(stages):
+            def stage() -> int:
+                nonlocal extracted
+                with ingest() as session:
+                    extracted = bbdd.extract_all_data(session)
+                return len(extracted)
+
+            result = measure('extract_all_data', stage, trace_memory)
+            if 'extract_all_data' in stages:
+                report['stages']['extract_all_data'] = result
+
+        if 'train_model' in stages:
+            import entrenamiento
+
+            def stage() -> int:
+                with ingest() as session:
+                    X, y, columns, missing = entrenamiento.load_training_data(session)
+                entrenamiento.train_model(X, y, columns, missing)
+                return len(y)
+
+            report['stages']['train_model'] = measure('train_model', stage, trace_memory)
+
+    report['counters'] = metricas.REGISTRY.snapshot()['counters']
+    if resource is not None:
+        # ru_maxrss está en KiB en Linux
+        report['max_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2)
+    return report
+
+
+def main() -> None:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='Benchmark the ingest, extraction and training stages.')
+    parser.add_argument('--companies', type=int, default=100)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='+', choices=STAGES + LEGACY_STAGES, default=None,
+                        help='Stages to run (default: every stage but the legacy ones)')
+    parser.add_argument('--output', default=None, help='Write the JSON report to this file')
+    parser.add_argument('--no-tracemalloc', action='store_true', help='Skip peak memory tracing')
+    args = parser.parse_args()
+
+    configure_logging(logging.WARNING)
+    report = run(args.companies, args.years, args.seed, args.stages, not args.no_tracemalloc)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
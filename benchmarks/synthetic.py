@@ -0,0 +1,353 @@
+"""Deterministic generator of FMP-shaped payloads for a synthetic universe.
+
+Every payload mirrors the JSON returned by the Financial Modeling Prep
+endpoints used in ``obtener_datos_empresas.py`` and is derived only from
+``(seed, symbol)``, so the same universe can be rebuilt byte for byte in
+benchmarks, the local stub server and ad-hoc experiments. Statements are
+internally consistent (assets equal liabilities plus equity, cash flows
+reconcile with the cash balance) so data-quality checks behave as they
+would on real filings.
+"""
+
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+import zlib
+import numpy as np
+import pandas as pd
+
+SECTORES = [
+    'Technology', 'Healthcare', 'Financial Services', 'Consumer Cyclical',
+    'Industrials', 'Energy', 'Utilities', 'Real Estate', 'Basic Materials',
+    'Communication Services', 'Consumer Defensive',
+]
+EXCHANGES = [('New York Stock Exchange', 'NYSE'), ('NASDAQ Global Select', 'NASDAQ'), ('London Stock Exchange', 'LSE')]
+
+
+class SyntheticUniverse:
+    """Universe of ``companies`` symbols with ``years`` of annual filings.
+
+    Parameters
+    ----------
+    companies:
+        Number of symbols in the universe.
+    years:
+        Number of fiscal years of statements and daily prices per symbol.
+    seed:
+        Global seed; each symbol derives its own generator from it.
+    end_year:
+        Last fiscal year generated.
+    missing_rate:
+        Probability that a non-key statement field is ``None``.
+    """
+
+    def __init__(self, companies: int = 100, years: int = 10, seed: int = 0,
+                 end_year: int = 2023, missing_rate: float = 0.0) -> None:
+        self.companies = companies
+        self.years = years
+        self.seed = seed
+        self.end_year = end_year
+        self.missing_rate = missing_rate
+        self.symbols = [f'SYN{i:05d}' for i in range(companies)]
+        self._symbol_set = set(self.symbols)
+        self._statements: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+
+    def _rng(self, symbol: str, salt: str = '') -> np.random.Generator:
+        """Return a generator that depends only on ``seed``, ``symbol`` and ``salt``."""
+        return np.random.default_rng([self.seed, zlib.crc32(f'{symbol}{salt}'.encode())])
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self._symbol_set
+
+    def stock_list(self) -> List[Dict[str, Any]]:
+        """Payload of ``stock/list``."""
+        return [self.stock_list_entry(symbol) for symbol in self.symbols]
+
+    def profile(self, symbol: str) -> List[Dict[str, Any]]:
+        """Payload of ``profile/{symbol}``."""
+        if symbol not in self:
+            return []
+        listing = self.stock_list_entry(symbol)
+        rng = self._rng(symbol, 'profile')
+        return [{
+            'symbol': symbol,
+            'companyName': listing['name'],
+            'price': listing['price'],
+            'currency': 'USD',
+            'exchange': listing['exchange'],
+            'exchangeShortName': listing['exchangeShortName'],
+            'sector': SECTORES[int(rng.integers(len(SECTORES)))],
+            'industry': 'Synthetic',
+            'country': 'US',
+            'isActivelyTrading': True,
+        }]
+
+    def stock_list_entry(self, symbol: str) -> Dict[str, Any]:
+        """Return the ``stock/list`` entry of a single symbol."""
+        rng = self._rng(symbol, 'list')
+        exchange, short = EXCHANGES[int(rng.integers(len(EXCHANGES)))]
+        return {
+            'symbol': symbol,
+            'name': f'Synthetic {symbol} Inc.',
+            'price': round(float(rng.uniform(5, 400)), 2),
+            'exchange': exchange,
+            'exchangeShortName': short,
+            'type': 'stock',
+        }
+
+    def historical_prices(self, symbol: str, date_from: Optional[str] = None,
+                          date_to: Optional[str] = None) -> Dict[str, Any]:
+        """Payload of ``historical-price-full/{symbol}``, newest day first."""
+        if symbol not in self:
+            return {}
+        rng = self._rng(symbol, 'prices')
+        dates = pd.bdate_range(f'{self.end_year - self.years + 1}-01-01', f'{self.end_year}-12-31')
+        returns = rng.normal(0.0003, 0.018, len(dates))
+        close = self.stock_list_entry(symbol)['price'] * np.exp(np.cumsum(returns) - returns.sum())
+        open_ = close * np.exp(rng.normal(0, 0.005, len(dates)))
+        high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.008, len(dates))))
+        low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.008, len(dates))))
+        volume = rng.integers(10_000, 5_000_000, len(dates))
+
+        keep = np.ones(len(dates), dtype=bool)
+        if date_from:
+            keep &= dates >= pd.Timestamp(date_from)
+        if date_to:
+            keep &= dates <= pd.Timestamp(date_to)
+        historical = [
+            {
+                'date': d.strftime('%Y-%m-%d'),
+                'open': round(float(o), 4),
+                'high': round(float(h), 4),
+                'low': round(float(lo), 4),
+                'close': round(float(c), 4),
+                'adjClose': round(float(c), 4),
+                'volume': int(v),
+                'change': round(float(c - o), 4),
+                'changePercent': round(float((c - o) / o * 100), 4),
+            }
+            for d, o, h, lo, c, v in zip(dates[keep], open_[keep], high[keep], low[keep], close[keep], volume[keep])
+        ]
+        historical.reverse()
+        return {'symbol': symbol, 'historical': historical}
+
+    def cash_flow(self, symbol: str) -> List[Dict[str, Any]]:
+        """Payload of ``cash-flow-statement/{symbol}``, newest year first."""
+        return self._generate(symbol)['cash_flow'] if symbol in self else []
+
+    def balance_sheet(self, symbol: str) -> List[Dict[str, Any]]:
+        """Payload of ``balance-sheet-statement/{symbol}``, newest year first."""
+        return self._generate(symbol)['balance_sheet'] if symbol in self else []
+
+    def income_statement(self, symbol: str) -> List[Dict[str, Any]]:
+        """Payload of ``income-statement/{symbol}``, newest year first."""
+        return self._generate(symbol)['income_statement'] if symbol in self else []
+
+    def route(self, url: str) -> Any:
+        """Return the payload FMP would serve for ``url``.
+
+        ``None`` is returned for endpoints that are not part of the
+        synthetic universe.
+        """
+        parts = urlsplit(url)
+        path = parts.path.split('/api/v3/', 1)[-1].strip('/')
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        if path == 'stock/list':
+            return self.stock_list()
+        endpoint, _, symbol = path.rpartition('/')
+        if endpoint == 'profile':
+            return self.profile(symbol)
+        if endpoint == 'historical-price-full':
+            return self.historical_prices(symbol, query.get('from'), query.get('to'))
+        if endpoint == 'cash-flow-statement':
+            return self.cash_flow(symbol)
+        if endpoint == 'balance-sheet-statement':
+            return self.balance_sheet(symbol)
+        if endpoint == 'income-statement':
+            return self.income_statement(symbol)
+        return None
+
+    def _generate(self, symbol: str) -> Dict[str, List[Dict[str, Any]]]:
+        """Build and memoize the three statement series of ``symbol``."""
+        if symbol in self._statements:
+            return self._statements[symbol]
+
+        rng = self._rng(symbol, 'statements')
+        cik = f'{zlib.crc32(symbol.encode()) % 10**10:010d}'
+        revenue = float(rng.lognormal(20, 1.5))
+        gross_margin = float(rng.uniform(0.2, 0.7))
+        shares = float(rng.uniform(2e7, 2e9))
+        cash = revenue * 0.1
+        debt = revenue * float(rng.uniform(0, 0.8))
+        ppe = revenue * float(rng.uniform(0.2, 1.0))
+        goodwill = revenue * float(rng.uniform(0, 0.3))
+        intangibles = revenue * float(rng.uniform(0, 0.2))
+        common_stock = revenue * 0.05
+        payout = float(rng.uniform(0, 0.5))
+
+        cash_flows, balances, incomes = [], [], []
+        for year in range(self.end_year - self.years + 1, self.end_year + 1):
+            growth = float(rng.normal(0.06, 0.12))
+            previous_revenue = revenue
+            revenue = max(revenue * (1 + growth), 1e5)
+            gross_margin = float(np.clip(gross_margin + rng.normal(0, 0.02), 0.05, 0.9))
+
+            cost = revenue * (1 - gross_margin)
+            gross = revenue - cost
+            rnd = revenue * float(rng.uniform(0, 0.1))
+            gna = revenue * float(rng.uniform(0.03, 0.12))
+            sales = revenue * float(rng.uniform(0.02, 0.08))
+            opex = rnd + gna + sales
+            operating = gross - opex
+            depreciation = ppe * 0.08
+            interest_income = cash * 0.02
+            interest_expense = debt * 0.05
+            other = interest_income - interest_expense
+            before_tax = operating + other
+            tax = max(0.0, before_tax * 0.21)
+            net = before_tax - tax
+            shares *= 1 + float(rng.normal(0, 0.02))
+
+            sbc = revenue * 0.01
+            delta_wc = -(revenue - previous_revenue) * 0.1
+            operating_cf = net + depreciation + sbc + delta_wc
+            capex = -revenue * float(rng.uniform(0.03, 0.08))
+            purchases = -revenue * float(rng.uniform(0, 0.03))
+            sales_inv = -purchases * float(rng.uniform(0.5, 1.0))
+            investing_cf = capex + purchases + sales_inv
+            repayment = -debt * 0.1
+            dividends = -max(0.0, net * payout)
+            buybacks = -max(0.0, operating_cf * 0.05)
+            # Nueva deuda si la caja cae por debajo de un mínimo operativo
+            borrowing = max(0.0, revenue * 0.05 - (cash + operating_cf + investing_cf + repayment + dividends + buybacks))
+            financing_cf = repayment + dividends + buybacks + borrowing
+            change = operating_cf + investing_cf + financing_cf
+            cash_begin, cash = cash, cash + change
+            debt = debt + repayment + borrowing
+            ppe = ppe - capex - depreciation
+
+            short_investments = revenue * 0.05
+            receivables = revenue * 0.12
+            inventory = revenue * 0.1
+            other_current = revenue * 0.02
+            current_assets = cash + short_investments + receivables + inventory + other_current
+            long_investments = revenue * 0.04
+            tax_assets = revenue * 0.01
+            other_noncurrent = revenue * 0.02
+            noncurrent_assets = ppe + goodwill + intangibles + long_investments + tax_assets + other_noncurrent
+            assets = current_assets + noncurrent_assets
+
+            payables = revenue * 0.08
+            short_debt = debt * 0.2
+            tax_payables = tax * 0.25
+            deferred_revenue = revenue * 0.02
+            other_current_liab = revenue * 0.03
+            current_liab = payables + short_debt + tax_payables + deferred_revenue + other_current_liab
+            long_debt = debt - short_debt
+            deferred_tax = revenue * 0.01
+            other_noncurrent_liab = revenue * 0.02
+            noncurrent_liab = long_debt + deferred_tax + other_noncurrent_liab
+            liabilities = current_liab + noncurrent_liab
+            equity = assets - liabilities
+            aoci = -revenue * 0.005
+            retained = equity - common_stock - aoci
+
+            filed = f'{year + 1}-02-{int(rng.integers(10, 28)):02d}'
+            header = {
+                'date': f'{year}-12-31',
+                'symbol': symbol,
+                'reportedCurrency': 'USD',
+                'cik': cik,
+                'fillingDate': filed,
+                'acceptedDate': f'{filed} 16:{int(rng.integers(0, 60)):02d}:{int(rng.integers(0, 60)):02d}',
+                'calendarYear': str(year),
+                'period': 'FY',
+            }
+            link = f'https://www.sec.gov/Archives/edgar/data/{int(cik)}/{cik}{year + 1}.htm'
+            footer = {'link': link, 'finalLink': link.replace('.htm', '-10k.htm')}
+
+            incomes.append(self._sparse(rng, header, {
+                'revenue': revenue, 'costOfRevenue': cost, 'grossProfit': gross,
+                'grossProfitRatio': gross / revenue,
+                'researchAndDevelopmentExpenses': rnd,
+                'generalAndAdministrativeExpenses': gna,
+                'sellingAndMarketingExpenses': sales,
+                'sellingGeneralAndAdministrativeExpenses': gna + sales,
+                'otherExpenses': 0.0, 'operatingExpenses': opex,
+                'costAndExpenses': cost + opex,
+                'interestIncome': interest_income, 'interestExpense': interest_expense,
+                'depreciationAndAmortization': depreciation,
+                'ebitda': operating + depreciation, 'ebitdaratio': (operating + depreciation) / revenue,
+                'operatingIncome': operating, 'operatingIncomeRatio': operating / revenue,
+                'totalOtherIncomeExpensesNet': other,
+                'incomeBeforeTax': before_tax, 'incomeBeforeTaxRatio': before_tax / revenue,
+                'incomeTaxExpense': tax, 'netIncome': net, 'netIncomeRatio': net / revenue,
+                'eps': net / shares, 'epsdiluted': net / (shares * 1.01),
+                'weightedAverageShsOut': round(shares), 'weightedAverageShsOutDil': round(shares * 1.01),
+            }, footer))
+            cash_flows.append(self._sparse(rng, header, {
+                'netIncome': net, 'depreciationAndAmortization': depreciation,
+                'deferredIncomeTax': 0.0, 'stockBasedCompensation': sbc,
+                'changeInWorkingCapital': delta_wc,
+                'accountsReceivables': delta_wc * 0.4, 'inventory': delta_wc * 0.4,
+                'accountsPayables': -delta_wc * 0.2, 'otherWorkingCapital': delta_wc * 0.4,
+                'otherNonCashItems': 0.0,
+                'netCashProvidedByOperatingActivities': operating_cf,
+                'investmentsInPropertyPlantAndEquipment': capex,
+                'acquisitionsNet': 0.0, 'purchasesOfInvestments': purchases,
+                'salesMaturitiesOfInvestments': sales_inv, 'otherInvestingActivites': 0.0,
+                'netCashUsedForInvestingActivites': investing_cf,
+                'debtRepayment': repayment, 'commonStockIssued': 0.0,
+                'commonStockRepurchased': buybacks, 'dividendsPaid': dividends,
+                'otherFinancingActivites': borrowing,
+                'netCashUsedProvidedByFinancingActivities': financing_cf,
+                'effectOfForexChangesOnCash': 0.0, 'netChangeInCash': change,
+                'cashAtEndOfPeriod': cash, 'cashAtBeginningOfPeriod': cash_begin,
+                'operatingCashFlow': operating_cf, 'capitalExpenditure': capex,
+                'freeCashFlow': operating_cf + capex,
+            }, footer))
+            balances.append(self._sparse(rng, header, {
+                'cashAndCashEquivalents': cash, 'shortTermInvestments': short_investments,
+                'cashAndShortTermInvestments': cash + short_investments,
+                'netReceivables': receivables, 'inventory': inventory,
+                'otherCurrentAssets': other_current, 'totalCurrentAssets': current_assets,
+                'propertyPlantEquipmentNet': ppe, 'goodwill': goodwill,
+                'intangibleAssets': intangibles, 'goodwillAndIntangibleAssets': goodwill + intangibles,
+                'longTermInvestments': long_investments, 'taxAssets': tax_assets,
+                'otherNonCurrentAssets': other_noncurrent, 'totalNonCurrentAssets': noncurrent_assets,
+                'otherAssets': 0.0, 'totalAssets': assets,
+                'accountPayables': payables, 'shortTermDebt': short_debt,
+                'taxPayables': tax_payables, 'deferredRevenue': deferred_revenue,
+                'otherCurrentLiabilities': other_current_liab, 'totalCurrentLiabilities': current_liab,
+                'longTermDebt': long_debt, 'deferredRevenueNonCurrent': 0.0,
+                'deferredTaxLiabilitiesNonCurrent': deferred_tax,
+                'otherNonCurrentLiabilities': other_noncurrent_liab,
+                'totalNonCurrentLiabilities': noncurrent_liab, 'otherLiabilities': 0.0,
+                'capitalLeaseObligations': 0.0, 'totalLiabilities': liabilities,
+                'preferredStock': 0.0, 'commonStock': common_stock,
+                'retainedEarnings': retained, 'accumulatedOtherComprehensiveIncomeLoss': aoci,
+                'othertotalStockholdersEquity': 0.0, 'totalStockholdersEquity': equity,
+                'totalEquity': equity, 'minorityInterest': 0.0,
+                'totalLiabilitiesAndStockholdersEquity': assets,
+                'totalLiabilitiesAndTotalEquity': assets,
+                'totalInvestments': short_investments + long_investments,
+                'totalDebt': debt, 'netDebt': debt - cash,
+            }, footer))
+
+        # FMP devuelve primero el ejercicio más reciente
+        statements = {
+            'cash_flow': cash_flows[::-1],
+            'balance_sheet': balances[::-1],
+            'income_statement': incomes[::-1],
+        }
+        self._statements[symbol] = statements
+        return statements
+
+    def _sparse(self, rng: np.random.Generator, header: Dict[str, Any],
+                values: Dict[str, float], footer: Dict[str, str]) -> Dict[str, Any]:
+        """Round ``values`` and blank a ``missing_rate`` share of them."""
+        report = dict(header)
+        blank = rng.random(len(values)) < self.missing_rate
+        for (key, value), missing in zip(values.items(), blank):
+            report[key] = None if missing else (value if isinstance(value, int) else round(value, 4))
+        report.update(footer)
+        return report
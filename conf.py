@@ -1,36 +1,169 @@
+"""Project configuration.
+
+Importing this module is cheap and has no side effects: the ``.env``
+file is read the first time an environment-backed setting is accessed,
+the ``data`` directory is created when the database engine is built and
+logging handlers are installed only by :func:`configure_logging`, which
+entry points call from ``main()``.
+"""
+
 import logging
-import colorlog
 import os
 import traceback
-import pandas as pd
-from dotenv import load_dotenv
-
-if not os.path.exists('data'): os.makedirs('data')
-DATA_BASE = os.path.join('data','financial_data.db')
+from functools import cached_property
 
-
-# Cargar las variables del archivo .env
-load_dotenv()
-API_KEY = os.getenv("API_KEY")
-fichero_lista_empresas = os.path.join('data','lista_empresas.csv')
+DATA_DIR = 'data'
+DATA_BASE = os.path.join(DATA_DIR, 'financial_data.db')
+fichero_lista_empresas = os.path.join(DATA_DIR, 'lista_empresas.csv')
+fichero_modelo = os.path.join(DATA_DIR, 'modelo.joblib')
 
 OBTENER_EMPRESAS_CON_API = False
 ELIMINAR_BBDD = False
 
-# Configuración de colorlog
-handler = colorlog.StreamHandler()
-handler.setFormatter(colorlog.ColoredFormatter(
-    '%(log_color)s%(asctime)s - %(levelname)s - %(message)s',
-    log_colors={
-        'DEBUG': 'blue',
-        'INFO': 'green',
-        'WARNING': 'yellow',
-        'ERROR': 'red',
-        'CRITICAL': 'bold_red',
-    }
-))
-
-logger = colorlog.getLogger()
-logger.addHandler(handler)
-logger.setLevel(logging.DEBUG)
 
+class Settings:
+    """Runtime settings resolved lazily from the environment and ``.env``."""
+
+    def __init__(self) -> None:
+        self._env_loaded = False
+
+    def env(self, name: str, default=None):
+        """Return an environment variable, loading ``.env`` on first use."""
+        if not self._env_loaded:
+            from dotenv import load_dotenv
+            load_dotenv()
+            self._env_loaded = True
+        return os.getenv(name, default)
+
+    @cached_property
+    def api_key(self):
+        """FMP API key."""
+        return self.env("API_KEY")
+
+    @cached_property
+    def api_base_url(self) -> str:
+        """Base URL of the API; can point to a local server (benchmarks/fmp_stub.py)."""
+        return self.env("FMP_API_URL", 'https://financialmodelingprep.com/api/v3/').rstrip('/') + '/'
+
+    @cached_property
+    def database_url(self) -> str:
+        """SQLAlchemy URL of the database."""
+        return self.env("DATABASE_URL", f'sqlite:///{DATA_BASE}')
+
+    @cached_property
+    def read_pool_size(self) -> int:
+        """Read-only connections kept open by ``bbdd.get_read_engine``."""
+        return int(self.env("DB_READ_POOL_SIZE", 8))
+
+    @cached_property
+    def db_busy_timeout(self) -> float:
+        """Seconds a SQLite connection waits for a lock before failing."""
+        return float(self.env("DB_BUSY_TIMEOUT", 30))
+
+    @cached_property
+    def sql_echo(self) -> bool:
+        """Whether SQLAlchemy echoes every statement."""
+        return self.env("SQL_ECHO", '1').lower() not in ('0', 'false', 'no')
+
+    @cached_property
+    def fetch_workers(self) -> int:
+        """Threads downloading companies in parallel in ``obtener_datos_empresas``."""
+        return int(self.env("FETCH_WORKERS", 4))
+
+    @cached_property
+    def benchmark_symbol(self):
+        """Index whose stored daily prices are the benchmark of ``beta``.
+
+        When unset or not stored, an equal-weighted index of every stored
+        symbol is used instead.
+        """
+        return self.env("BENCHMARK_SYMBOL")
+
+    @cached_property
+    def similarity_index_dir(self) -> str:
+        """Directory of the fundamentals vector index of ``analisis.similarity``."""
+        return self.env("SIMILARITY_INDEX_DIR", os.path.join(DATA_DIR, 'similares'))
+
+    @cached_property
+    def api_daily_quota(self) -> int:
+        """API requests per day the refresh scheduler may spend."""
+        return int(self.env("FMP_DAILY_QUOTA", 250))
+
+    @cached_property
+    def query_cache_size(self) -> int:
+        """Query results kept in memory by ``bbdd.cache`` (0 disables it)."""
+        return int(self.env("QUERY_CACHE_SIZE", 16))
+
+    @cached_property
+    def query_cache_dir(self):
+        """Optional directory for Parquet copies of cached query results."""
+        return self.env("QUERY_CACHE_DIR")
+
+    @cached_property
+    def metrics_file(self):
+        """Metrics snapshot file (``.prom`` for Prometheus, anything else for JSON)."""
+        return self.env("METRICS_FILE")
+
+    @cached_property
+    def metrics_interval(self) -> float:
+        """Seconds between periodic metrics summaries."""
+        return float(self.env("METRICS_INTERVAL", 60))
+
+    def ensure_data_dir(self) -> None:
+        """Create the ``data`` directory if it does not exist."""
+        os.makedirs(DATA_DIR, exist_ok=True)
+
+
+settings = Settings()
+
+# Nombres antiguos que ahora se resuelven bajo demanda a través de ``settings``
+_LAZY = {
+    'API_KEY': 'api_key',
+    'API_BASE_URL': 'api_base_url',
+    'METRICS_FILE': 'metrics_file',
+    'METRICS_INTERVAL': 'metrics_interval',
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY:
+        return getattr(settings, _LAZY[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+_logging_configured = False
+
+
+def configure_logging(level: int = logging.DEBUG) -> None:
+    """Install the colored console handler on the root logger once."""
+    global _logging_configured
+    if _logging_configured:
+        return
+    import colorlog
+
+    # Configuración de colorlog
+    handler = colorlog.StreamHandler()
+    handler.setFormatter(colorlog.ColoredFormatter(
+        '%(log_color)s%(asctime)s - %(levelname)s - %(message)s',
+        log_colors={
+            'DEBUG': 'blue',
+            'INFO': 'green',
+            'WARNING': 'yellow',
+            'ERROR': 'red',
+            'CRITICAL': 'bold_red',
+        }
+    ))
+
+    logger = colorlog.getLogger()
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    _logging_configured = True
+
+
+# Los nombres perezosos no se incluyen para que ``from conf import *`` no lea ``.env``
+__all__ = [
+    'logging', 'os', 'traceback',
+    'DATA_DIR', 'DATA_BASE', 'fichero_lista_empresas', 'fichero_modelo',
+    'OBTENER_EMPRESAS_CON_API', 'ELIMINAR_BBDD',
+    'settings', 'configure_logging',
+]
@@ -0,0 +1,42 @@
+"""Find comparable companies by their fundamentals.
+
+The vector index is kept in ``SIMILARITY_INDEX_DIR``: each run first adds
+the fiscal years filed since the last run, then prints the nearest peers
+of the given symbol. ``--rebuild`` refits the feature scaling on every
+stored statement.
+"""
+
+import argparse
+import analisis
+import bbdd
+from conf import *
+
+
+def main() -> None:
+    """Entry point of the peer search."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('symbol', nargs='?', help='Company to find peers of')
+    parser.add_argument('--year', type=int, default=None, help='Compare this fiscal year (default: latest of each company)')
+    parser.add_argument('-k', type=int, default=10, help='Number of peers')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the index from scratch')
+    parser.add_argument('--index', default=None, help='Index directory (default: SIMILARITY_INDEX_DIR)')
+    args = parser.parse_args()
+    configure_logging()
+
+    bbdd.create_tables()
+    with bbdd.session_scope(read_only=True) as session:
+        if args.rebuild:
+            analisis.build_index(session, args.index)
+        else:
+            analisis.update_index(session, args.index)
+
+    if args.symbol:
+        peers = analisis.get_index(args.index).peers(args.symbol, args.year, args.k)
+        if peers.empty:
+            logging.warning(f"{args.symbol} is not in the similarity index")
+        else:
+            print(peers.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
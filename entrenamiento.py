@@ -1,37 +1,109 @@
 import bbdd
 
 # Ahora vamos a obtener los datos de todas las empresas y a clasificarlas segun su rendimiento en los últimos n años
-from sqlalchemy.orm import sessionmaker, Session
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.metrics import mean_squared_error
-import pandas as pd
+#
+# Los datos se leen por lotes y se copian directamente a una única matriz float32
+# contigua. Los huecos no descartan la fila: se registran en una máscara y se
+# imputan con la mediana de la columna, y el escalado y la partición train/test
+# se hacen sobre esa misma matriz sin crear copias intermedias.
+from sqlalchemy.orm import Session
+from typing import Any, Dict, Iterable, List, Tuple
+import time
+import warnings
+import numpy as np
+from conf import *
 
-# Crear la sesión
-Session = sessionmaker(bind=bbdd.engine)
-with Session() as session:
-    # Extraer los datos de la base
-    df = bbdd.extract_all_data(session=session)
+# Columnas que no se usan como variables del modelo
+COLUMNAS_EXCLUIDAS = ["symbol", "fiscal_year", "price_first", "price_last", "puntuacion"]
+TAMANO_LOTE = 5000
 
-    # Eliminar filas con valores nulos
-    df = df.dropna()
 
-    # Calcular el incremento porcentual del precio de las acciones
-    df['puntuacion'] = (df['precio_final'] - df['precio_inicial']) / df['precio_inicial'] * 100
+def feature_columns(columns: Iterable[str]) -> List[str]:
+    """Return the numeric columns used as model inputs."""
+    return [c for c in columns if c not in COLUMNAS_EXCLUIDAS]
 
-    # Escalar los datos
-    scaler = MinMaxScaler()
-    scaled_data = scaler.fit_transform(df.drop(columns=["symbol", "anio_fiscal", "precio_inicial", "precio_final"]))
-    df_scaled = pd.DataFrame(scaled_data, columns=df.columns.drop(["symbol", "anio_fiscal", "precio_inicial", "precio_final"]))
 
-    # Añadir el año fiscal a los datos escalados
-    df_scaled['anio_fiscal'] = df['anio_fiscal'].values
+def training_matrix(frames: Iterable, columns: List[str], n_rows: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Copy DataFrame chunks into one preallocated float32 matrix.
 
-    X = df_scaled
-    y = df['puntuacion']
+    The last column of ``X`` holds the fiscal year. Rows without a
+    usable target are skipped; missing feature values stay ``NaN``.
+    ``n_rows`` only sizes the initial buffer: the count and the chunks
+    may come from different snapshots while the ingest writes, so the
+    matrix grows when more rows arrive and is trimmed to the rows read.
 
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    Returns
+    -------
+    tuple
+        ``(X, y, missing)`` where ``missing`` is the boolean mask of
+        ``NaN`` cells of the feature columns.
+    """
+    X = np.empty((n_rows, len(columns) + 1), dtype=np.float32)
+    y = np.empty(n_rows, dtype=np.float32)
+    filled = 0
+    for chunk in frames:
+        first = chunk['price_first'].to_numpy(dtype=np.float64, na_value=np.nan)
+        last = chunk['price_last'].to_numpy(dtype=np.float64, na_value=np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Calcular el incremento porcentual del precio de las acciones
+            target = (last - first) / first * 100
+        keep = np.isfinite(target)
+        rows = int(keep.sum())
+        if filled + rows > len(X):
+            # Más filas que las contadas: ampliar con margen para no copiar en cada lote
+            nuevo = max(filled + rows, len(X) + len(X) // 4)
+            logging.debug(f"Training matrix grows from {len(X)} to {nuevo} rows")
+            X_mayor = np.empty((nuevo, X.shape[1]), dtype=np.float32)
+            X_mayor[:filled] = X[:filled]
+            y_mayor = np.empty(nuevo, dtype=np.float32)
+            y_mayor[:filled] = y[:filled]
+            X, y = X_mayor, y_mayor
+        block = X[filled:filled + rows]
+        block[:, :-1] = chunk.loc[keep, columns].to_numpy(dtype=np.float32, na_value=np.nan)
+        block[:, -1] = chunk.loc[keep, 'fiscal_year'].to_numpy(dtype=np.float32)
+        y[filled:filled + rows] = target[keep]
+        filled += rows
+    # Recortar filas sobrantes: las primeras filas de una matriz C son una vista
+    X, y = X[:filled], y[:filled]
+    return X, y, np.isnan(X[:, :-1])
+
+
+def train_model(X: np.ndarray, y: np.ndarray, columns: List[str], missing: np.ndarray = None) -> Dict[str, Any]:
+    """Fit the model on ``X`` in place and return the artifact used for scoring.
+
+    ``X`` is modified: missing values are imputed, features are scaled
+    and rows are shuffled together with ``y``.
+    """
+    from sklearn.preprocessing import MinMaxScaler
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.metrics import mean_squared_error
+
+    features = X[:, :-1]
+    if missing is None:
+        missing = np.isnan(features)
+
+    # Imputar los huecos con la mediana de cada columna (0 en columnas sin datos)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        fill_values = np.nanmedian(features, axis=0).astype(np.float32)
+    fill_values[np.isnan(fill_values)] = 0
+    rows, cols = np.nonzero(missing)
+    features[rows, cols] = fill_values[cols]
+
+    # Escalar los datos en el sitio (mismo cálculo que MinMaxScaler.transform)
+    scaler = MinMaxScaler(copy=False).fit(features)
+    features *= scaler.scale_.astype(np.float32)
+    features += scaler.min_.astype(np.float32)
+
+    # Barajar X e y con la misma permutación y partir en vistas contiguas
+    rng = np.random.default_rng(42)
+    state = rng.bit_generator.state
+    rng.shuffle(X)
+    rng.bit_generator.state = state
+    rng.shuffle(y)
+    n_train = int(len(y) * 0.8)
+    X_train, X_test = X[:n_train], X[n_train:]
+    y_train, y_test = y[:n_train], y[n_train:]
 
     # Entrenar el modelo
     model = RandomForestRegressor(n_estimators=100, random_state=42)
@@ -40,4 +112,61 @@ with Session() as session:
     # Predecir y evaluar
     y_pred = model.predict(X_test)
     error = mean_squared_error(y_test, y_pred)
-    print(f"Error cuadrático medio: {error}")
\ No newline at end of file
+    print(f"Error cuadrático medio: {error}")
+    logging.info(
+        f"Trained on {len(y)} rows x {len(columns)} features, "
+        f"{missing.mean():.1%} of cells imputed, matrix {X.nbytes / 2**20:.1f} MiB"
+    )
+
+    return {
+        'model': model,
+        'scaler': scaler,
+        'columns': columns,
+        'fill_values': fill_values,
+        'version': time.strftime('%Y%m%d%H%M%S'),
+        'mse': error,
+    }
+
+
+def load_training_data(session: Session, chunk_size: int = TAMANO_LOTE) -> Tuple[np.ndarray, np.ndarray, List[str], np.ndarray]:
+    """Stream the database into a training matrix.
+
+    Returns
+    -------
+    tuple
+        ``(X, y, columns, missing)`` as produced by :func:`training_matrix`.
+    """
+    columns = feature_columns(bbdd.numeric_data_columns(session))
+    n_rows = bbdd.count_all_data(session)
+    X, y, missing = training_matrix(bbdd.iter_all_data(session, chunk_size), columns, n_rows)
+    return X, y, columns, missing
+
+
+def save_model(artifact: Dict[str, Any], path: str = fichero_modelo) -> None:
+    """Serialize the trained model artifact to ``path``."""
+    import joblib
+
+    joblib.dump(artifact, path)
+    logging.info(f"Model {artifact['version']} saved to {path}")
+
+
+def load_model(path: str = fichero_modelo) -> Dict[str, Any]:
+    """Load a model artifact written by :func:`save_model`."""
+    import joblib
+
+    return joblib.load(path)
+
+
+def main() -> None:
+    """Train the model on the whole database and persist it."""
+    configure_logging()
+    # Sesión de solo lectura: no bloquea a la ingesta
+    with bbdd.session_scope(read_only=True) as session:
+        # Extraer los datos de la base
+        X, y, columns, missing = load_training_data(session)
+    artifact = train_model(X, y, columns, missing)
+    save_model(artifact)
+
+
+if __name__ == "__main__":
+    main()
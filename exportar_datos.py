@@ -0,0 +1,29 @@
+"""Export the fundamentals dataset to Arrow IPC files partitioned by fiscal year.
+
+Only partitions whose data changed since the previous export are
+rewritten. Load the result with ``bbdd.read_dataset(directory, columns)``.
+"""
+
+import argparse
+import bbdd
+from conf import *
+
+DIRECTORIO_EXPORTACION = os.path.join(DATA_DIR, 'dataset')
+
+
+def main() -> None:
+    """Entry point of the dataset export."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--output', default=DIRECTORIO_EXPORTACION, help='Directory of the partitions')
+    parser.add_argument('--full', action='store_true', help='Rewrite every partition')
+    args = parser.parse_args()
+    configure_logging()
+
+    bbdd.create_tables()
+    with bbdd.session_scope(read_only=True) as session:
+        years = bbdd.export_dataset(session, args.output, args.full)
+    logging.info(f"Partitions written: {years or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Lightweight in-process metrics for the ingest pipeline.
+
+Counters and latency histograms are kept in a thread-safe registry and
+can be exported as a JSON snapshot or in the Prometheus text format.
+Only the standard library is used so importing this module is cheap.
+
+Example::
+
+    @metricas.timed('fetch', endpoint='profile')
+    def get_company_info(...): ...
+
+    metricas.increment('http_bytes_total', len(body))
+    metricas.write_snapshot('data/metrics.prom')
+"""
+
+import bisect
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import ContextDecorator
+from typing import Any, Dict, List, Optional, Tuple
+
+# Límites superiores (segundos) de los buckets de latencia
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, Any]) -> Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format(key: Key, suffix: str = '', extra: Optional[Tuple[str, str]] = None) -> str:
+    name, labels = key
+    labels = labels + ((extra,) if extra else ())
+    if not labels:
+        return f'{name}{suffix}'
+    inner = ','.join(f'{k}="{v}"' for k, v in labels)
+    return f'{name}{suffix}{{{inner}}}'
+
+
+class Histogram:
+    """Cumulative bucket histogram of durations in seconds."""
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile as the upper bound of its bucket."""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    """Registry of counters and histograms."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.counters: Dict[Key, float] = {}
+        self.histograms: Dict[Key, Histogram] = {}
+        self.started = time.time()
+
+    def increment(self, name: str, value: float = 1, **labels: Any) -> None:
+        """Add ``value`` to the counter ``name``."""
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels: Any) -> None:
+        """Record a duration in the histogram ``name``."""
+        key = _key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def reset(self) -> None:
+        """Drop every recorded value."""
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.started = time.time()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return all metrics as a JSON-serializable dictionary."""
+        with self.lock:
+            return {
+                'uptime_seconds': round(time.time() - self.started, 3),
+                'counters': {_format(k): v for k, v in sorted(self.counters.items())},
+                'histograms': {
+                    _format(k): {
+                        'count': h.count,
+                        'sum': round(h.total, 6),
+                        'p50': h.quantile(0.5),
+                        'p95': h.quantile(0.95),
+                        'p99': h.quantile(0.99),
+                        'buckets': dict(zip([str(b) for b in BUCKETS] + ['+Inf'], h.counts)),
+                    }
+                    for k, h in sorted(self.histograms.items())
+                },
+            }
+
+    def to_prometheus(self) -> str:
+        """Return all metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+        with self.lock:
+            for key, value in sorted(self.counters.items()):
+                lines.append(f'{_format(key)} {value}')
+            for key, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else str(bound)
+                    lines.append(f"{_format(key, '_bucket', ('le', le))} {cumulative}")
+                lines.append(f"{_format(key, '_sum')} {histogram.total}")
+                lines.append(f"{_format(key, '_count')} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        """Return a one-line human readable summary of every histogram.
+
+        ``errors`` adds up the explicit ``*_errors_total`` counters. The ones
+        :class:`timed` derives from its histograms are left out, since the
+        same failure is usually counted explicitly as well.
+        """
+        with self.lock:
+            parts = [
+                f'{_format(k)} n={h.count} total={h.total:.2f}s p50<={h.quantile(0.5)}s'
+                for k, h in sorted(self.histograms.items())
+            ]
+            # Contadores de error de ``timed``: ``<name>_errors_total`` junto a ``<name>_seconds``
+            cronometrados = {name[:-len('_seconds')] + '_errors_total' for name, _ in self.histograms}
+            errors = sum(
+                v for (name, _), v in self.counters.items()
+                if name.endswith('errors_total') and name not in cronometrados
+            )
+        return f"errors={errors:g} | " + ' | '.join(parts)
+
+
+REGISTRY = Metrics()
+
+
+class timed(ContextDecorator):
+    """Time a block or function into the ``<name>_seconds`` histogram.
+
+    Calls are counted in ``<name>_total`` and exceptions in
+    ``<name>_errors_total`` before being re-raised.
+    """
+
+    def __init__(self, name: str, **labels: Any) -> None:
+        self.name = name
+        self.labels = labels
+        self._start: List[float] = []
+
+    def __enter__(self) -> 'timed':
+        self._start.append(time.perf_counter())
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        elapsed = time.perf_counter() - self._start.pop()
+        REGISTRY.observe(f'{self.name}_seconds', elapsed, **self.labels)
+        REGISTRY.increment(f'{self.name}_total', **self.labels)
+        if exc_type is not None:
+            REGISTRY.increment(f'{self.name}_errors_total', **self.labels)
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # Un contexto nuevo por llamada para que sea seguro entre hilos
+            with timed(self.name, **self.labels):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def increment(name: str, value: float = 1, **labels: Any) -> None:
+    """Add ``value`` to a counter of the default registry."""
+    REGISTRY.increment(name, value, **labels)
+
+
+def observe(name: str, seconds: float, **labels: Any) -> None:
+    """Record a duration in a histogram of the default registry."""
+    REGISTRY.observe(name, seconds, **labels)
+
+
+def write_snapshot(path: str) -> None:
+    """Write the default registry to ``path``.
+
+    Files ending in ``.prom`` or ``.txt`` use the Prometheus text format,
+    anything else is written as JSON.
+    """
+    if path.endswith(('.prom', '.txt')):
+        text = REGISTRY.to_prometheus()
+    else:
+        text = json.dumps(REGISTRY.snapshot(), indent=2)
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    # Reemplazo atómico para que los lectores nunca vean un fichero a medias
+    os.replace(tmp, path)
+
+
+def start_reporter(interval: float = 60.0, path: Optional[str] = None) -> threading.Event:
+    """Log a summary (and optionally write a snapshot) every ``interval`` seconds.
+
+    Returns
+    -------
+    threading.Event
+        Set it to stop the background reporter.
+    """
+    stop = threading.Event()
+
+    def report() -> None:
+        while not stop.wait(interval):
+            logging.info(f"Metrics: {REGISTRY.summary()}")
+            if path:
+                try:
+                    write_snapshot(path)
+                except OSError as e:
+                    logging.warning(f"Could not write metrics snapshot: {e}")
+
+    threading.Thread(target=report, name='metrics-reporter', daemon=True).start()
+    return stop
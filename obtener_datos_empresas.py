@@ -1,32 +1,77 @@
 """Fetch company financial data from the FMP API and store it."""
 
+import codecs
+import csv
+import json
+import queue
+import threading
 import requests
+from datetime import date
 import pandas as pd
-from sqlalchemy.orm import sessionmaker, Session
-from typing import Any, Dict, Optional, List, Union
+from sqlalchemy.orm import Session
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, List, Tuple, Union
 import bbdd
-from conf import *  # Ensure that API_KEY is defined in conf.py
+import analisis
+import metricas
+from conf import *  # API key and base URL come from conf.settings
 
 # API URL constants
-API = 'https://financialmodelingprep.com/api/v3/'
+API = settings.api_base_url
 URL_LISTA_EMPRESAS = API + 'stock/list?apikey={api_key}'
 URL_PRECIOS_HISTORICOS = API + 'historical-price-full/{symbol}?apikey={api_key}'
+URL_PRECIOS_HISTORICOS_VENTANA = URL_PRECIOS_HISTORICOS + '&from={desde}&to={hasta}'
 URL_CASH_FLOW = API + 'cash-flow-statement/{symbol}?period=annual&apikey={api_key}'
 URL_BALANCE_GENERAL = API + 'balance-sheet-statement/{symbol}?apikey={api_key}'
 URL_CUENTA_RESULTADOS = API + 'income-statement/{symbol}?apikey={api_key}'
 URL_PERFIL_EMPRESA = API + 'profile/{symbol}?apikey={api_key}'
 
+BOLSAS_EEUU = ('NYSE', 'NASDAQ')
+TAMANO_BLOQUE_HTTP = 64 * 1024
+
+
+class RateLimitError(Exception):
+    """Raised when the API answers HTTP 429.
+
+    Parameters
+    ----------
+    retry_after:
+        Seconds to wait according to the ``Retry-After`` header, ``None``
+        when the API did not say.
+    """
+
+    def __init__(self, retry_after: Optional[float] = None) -> None:
+        super().__init__("API rate limit reached")
+        self.retry_after = retry_after
+
+
+def _rate_limit_error(response: requests.Response) -> RateLimitError:
+    logging.error("API rate limit reached.")
+    try:
+        retry_after = float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        retry_after = None
+    return RateLimitError(retry_after)
+
 
 def make_request(url: str) -> Optional[Dict[str, Any]]:
-    """Perform a GET request and return the JSON body."""
-    response = requests.get(url)
+    """Perform a GET request and return the JSON body.
+
+    Raises
+    ------
+    RateLimitError
+        When the API answers HTTP 429.
+    """
+    with metricas.timed('http_request'):
+        response = requests.get(url)
+    metricas.increment('http_responses_total', status=response.status_code)
+    metricas.increment('http_bytes_total', len(response.content))
     if response.status_code != 200:
+        metricas.increment('http_errors_total', status=response.status_code)
         logging.error(f"API request failed: {response.status_code}")
         logging.debug(response.text)
 
         if response.status_code == 429:
-            logging.error("API rate limit reached.")
-            exit(1)
+            raise _rate_limit_error(response)
         return None
     data = response.json()
     if not data:
@@ -35,72 +80,265 @@ def make_request(url: str) -> Optional[Dict[str, Any]]:
     return data
 
 
+def record_changes(changes: Optional[Dict[str, int]], nuevos: Dict[str, int]) -> None:
+    """Merge ``nuevos`` into ``changes``, keeping the first changed year of each symbol.
+
+    ``changes`` collects what the ``analisis`` refreshes must recompute;
+    ``None`` means the caller does not track changes. Statement and price
+    changes are kept in separate maps: growth features and the similarity
+    index only read statements.
+    """
+    if changes is None:
+        return
+    for symbol, year in nuevos.items():
+        changes[symbol] = min(year, changes.get(symbol, year))
+
+
 def log_no_data(data: Any, kind: str) -> None:
     """Log a warning when no data was returned for a specific report."""
     logging.warning(f'No data found for {kind}')
     return None
 
 
-def get_company_list(api_key: str, only_us: bool = False) -> List[Dict[str, Any]]:
-    """Retrieve the list of companies from the API."""
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """Incrementally decode a JSON array, yielding each element.
+
+    Only the undecoded tail of the body is kept in memory, so a large
+    array is never materialized as a whole.
+    """
+    decoder = json.JSONDecoder()
+    texto = codecs.getincrementaldecoder('utf-8')()
+    buffer, pos, started = '', 0, False
+    chunks = iter(chunks)
+    final = False
+    while not final:
+        chunk = next(chunks, None)
+        final = chunk is None
+        buffer = buffer[pos:] + texto.decode(chunk or b'', final=final)
+        pos = 0
+        while True:
+            # Saltar espacios y separadores entre elementos
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != '[':
+                    logging.error(f"Expected a JSON array, got: {buffer[pos:pos + 200]}")
+                    return
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if final:
+                    raise
+                break  # Elemento incompleto: esperar al siguiente bloque
+            # El elemento solo está completo si le sigue un separador
+            siguiente = end
+            while siguiente < len(buffer) and buffer[siguiente] in ' \t\r\n':
+                siguiente += 1
+            if siguiente == len(buffer) or buffer[siguiente] not in ',]':
+                if not final:
+                    break  # Un número podría continuar en el siguiente bloque
+                raise json.JSONDecodeError("Expecting ',' delimiter", buffer, siguiente)
+            yield item
+            pos = end
+
+
+def stream_request(url: str) -> Iterator[Any]:
+    """Perform a streaming GET request and yield the elements of its JSON array body.
+
+    Raises :class:`RateLimitError` when the API answers HTTP 429.
+    """
+    with metricas.timed('http_request'):
+        response = requests.get(url, stream=True)
+    metricas.increment('http_responses_total', status=response.status_code)
+    with response:
+        if response.status_code != 200:
+            metricas.increment('http_errors_total', status=response.status_code)
+            logging.error(f"API request failed: {response.status_code}")
+            logging.debug(response.text)
+
+            if response.status_code == 429:
+                raise _rate_limit_error(response)
+            return
+
+        def chunks() -> Iterator[bytes]:
+            for chunk in response.iter_content(TAMANO_BLOQUE_HTTP):
+                metricas.increment('http_bytes_total', len(chunk))
+                yield chunk
+
+        yield from iter_json_array(chunks())
+
+
+def iter_company_list(api_key: str, exchanges: Optional[Iterable[str]] = None) -> Iterator[Dict[str, Any]]:
+    """Stream the list of companies from the API, optionally filtered by exchange."""
     url = URL_LISTA_EMPRESAS.format(api_key=api_key)
-    companies = make_request(url)
-    if not companies:
-        return []
-    if only_us:
-        companies = [c for c in companies if c.get('exchangeShortName') in ['NYSE', 'NASDAQ']]
-    return companies
+    exchanges = set(exchanges) if exchanges is not None else None
+    for company in stream_request(url):
+        if exchanges is None or company.get('exchangeShortName') in exchanges:
+            yield company
 
 
-def get_historical_prices(session: Session, api_key: str, symbol: str) -> Optional[pd.DataFrame]:
-    """Fetch and store yearly price statistics for a symbol."""
-    url = URL_PRECIOS_HISTORICOS.format(symbol=symbol, api_key=api_key)
+@metricas.timed('fetch', endpoint='stock_list')
+def get_company_list(api_key: str, only_us: bool = False) -> List[Dict[str, Any]]:
+    """Retrieve the list of companies from the API."""
+    return list(iter_company_list(api_key, BOLSAS_EEUU if only_us else None))
+
+
+def read_company_list_csv(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the entries of a legacy ``lista_empresas.csv`` file row by row."""
+    with open(path, newline='') as fichero:
+        for row in csv.DictReader(fichero):
+            try:
+                row['price'] = float(row['price']) if row.get('price') else None
+            except ValueError:
+                row['price'] = None
+            yield row
+
+
+def cache_company_list(session: Session) -> int:
+    """Fill the ``stock_list`` table and return the number of cached entries.
+
+    With ``OBTENER_EMPRESAS_CON_API`` the list is streamed from the API;
+    otherwise an empty cache is seeded once from ``lista_empresas.csv``.
+    """
+    if OBTENER_EMPRESAS_CON_API:
+        stored = bbdd.save_stock_list(session, iter_company_list(settings.api_key, BOLSAS_EEUU))
+        logging.info(f"Companies obtained from API: {stored}")
+        return stored
+    cached = session.query(bbdd.ListedSymbol).count()
+    if cached:
+        return cached
+    if not os.path.exists(fichero_lista_empresas):
+        logging.error(f"File not found: {fichero_lista_empresas}")
+        return 0
+    stored = bbdd.save_stock_list(session, read_company_list_csv(fichero_lista_empresas))
+    logging.info(f"Companies imported from {fichero_lista_empresas}: {stored}")
+    return stored
+
+
+def yearly_price_stats(precios_df: pd.DataFrame) -> pd.DataFrame:
+    """Summarize daily prices indexed by date into yearly statistics."""
+    # Asegurarse de que las columnas necesarias existan
+    required_columns = {'open', 'close', 'low', 'high'}
+    if not required_columns.issubset(precios_df.columns):
+        raise ValueError(f"Faltan columnas necesarias en los datos: {required_columns - set(precios_df.columns)}")
+
+    # Resumir datos anuales
+    precios_anuales = precios_df.resample('Y').agg({
+        'open': 'first',
+        'low': 'min',
+        'high': 'max',
+        'close': 'last'
+    })
+
+    # Calcular métricas adicionales
+    precios_anuales['close_mean'] = precios_df['close'].resample('Y').mean()
+    precios_anuales['close_std'] = precios_df['close'].resample('Y').std()
+    precios_anuales['close_var'] = precios_df['close'].resample('Y').var()
+    precios_anuales['price_change'] = precios_anuales['close'] - precios_anuales['open']
+    precios_anuales['price_change_pct'] = precios_anuales['price_change'] / precios_anuales['open']
+
+    # Calcular cambios porcentuales mensuales, trimestrales y semestrales
+    mean_close_monthly = precios_df['close'].resample('M').mean()
+    mean_close_quarterly = precios_df['close'].resample('Q').mean()
+    mean_close_semiannually = precios_df['close'].resample('6M').mean()
+
+    precios_anuales['price_change_pct_1y'] = precios_anuales['close'].pct_change(periods=1)
+    precios_anuales['price_change_pct_1m'] = mean_close_monthly.pct_change(periods=1).resample('Y').last()
+    precios_anuales['price_change_pct_3m'] = mean_close_quarterly.pct_change(periods=1).resample('Y').last()
+    precios_anuales['price_change_pct_6m'] = mean_close_semiannually.pct_change(periods=1).resample('Y').last()
+    return precios_anuales
+
+
+def fetch_historical_prices(api_key: str, symbol: str, desde: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Download the daily prices of ``symbol`` from ``desde`` (the whole history when ``None``)."""
+    if desde:
+        url = URL_PRECIOS_HISTORICOS_VENTANA.format(
+            symbol=symbol, api_key=api_key, desde=desde, hasta=date.today().isoformat(),
+        )
+    else:
+        url = URL_PRECIOS_HISTORICOS.format(symbol=symbol, api_key=api_key)
     data = make_request(url)
-
-    if data and 'historical' in data:
-        # Convertir los datos históricos en un DataFrame
-        precios_df = pd.DataFrame(data['historical'])
-        precios_df['date'] = pd.to_datetime(precios_df['date'])
-        precios_df.set_index('date', inplace=True)
-
-        # Asegurarse de que las columnas necesarias existan
-        required_columns = {'open', 'close', 'low', 'high'}
-        if not required_columns.issubset(precios_df.columns):
-            raise ValueError(f"Faltan columnas necesarias en los datos: {required_columns - set(precios_df.columns)}")
-
-        # Resumir datos anuales
-        precios_anuales = precios_df.resample('Y').agg({
-            'open': 'first',
-            'low': 'min',
-            'high': 'max',
-            'close': 'last'
-        })
-
-        # Calcular métricas adicionales
-        precios_anuales['close_mean'] = precios_df['close'].resample('Y').mean()
-        precios_anuales['close_std'] = precios_df['close'].resample('Y').std()
-        precios_anuales['close_var'] = precios_df['close'].resample('Y').var()
-        precios_anuales['price_change'] = precios_anuales['close'] - precios_anuales['open']
-        precios_anuales['price_change_pct'] = precios_anuales['price_change'] / precios_anuales['open']
-
-        # Calcular cambios porcentuales mensuales, trimestrales y semestrales
-        mean_close_monthly = precios_df['close'].resample('M').mean()
-        mean_close_quarterly = precios_df['close'].resample('Q').mean()
-        mean_close_semiannually = precios_df['close'].resample('6M').mean()
-
-        precios_anuales['price_change_pct_1y'] = precios_anuales['close'].pct_change(periods=1)
-        precios_anuales['price_change_pct_1m'] = mean_close_monthly.pct_change(periods=1).resample('Y').last()
-        precios_anuales['price_change_pct_3m'] = mean_close_quarterly.pct_change(periods=1).resample('Y').last()
-        precios_anuales['price_change_pct_6m'] = mean_close_semiannually.pct_change(periods=1).resample('Y').last()
-
-        # Store in the database
-        for year, prices in precios_anuales.iterrows():
-            bbdd.save_fiscal_year(session=session, symbol=symbol, year=year.year, prices=prices.to_dict())
-
-        return precios_anuales
-
-    logging.debug(f"No historical data found for {symbol}")
-    return None
+    if not data or not data.get('historical'):
+        logging.debug(f"No historical data found for {symbol}")
+        return []
+    metricas.increment('price_rows_fetched_total', len(data['historical']))
+    return data['historical']
+
+
+def price_updates(symbol: str, historical: List[Dict[str, Any]],
+                  stored: Optional[pd.DataFrame] = None) -> Tuple[List[Dict[str, Any]], pd.DataFrame]:
+    """Merge a window of daily prices into the stored history.
+
+    Parameters
+    ----------
+    historical:
+        Entries downloaded by :func:`fetch_historical_prices`.
+    stored:
+        History from :func:`bbdd.load_daily_prices` before the window
+        is written, ``None`` when nothing is stored yet.
+
+    Returns
+    -------
+    tuple
+        The ``daily_prices`` rows of the window and the statistics of the
+        years it touches. They are computed over the whole merged history
+        so year-over-year changes and 6-month periods stay the same.
+    """
+    rows = bbdd.daily_price_rows(symbol, historical)
+    ventana = pd.DataFrame(rows, columns=['fecha', 'open', 'high', 'low', 'close'])
+    ventana = ventana.set_index(pd.DatetimeIndex(pd.to_datetime(ventana.pop('fecha')), name='date'))
+    if stored is None or stored.empty:
+        precios = ventana.sort_index()
+    else:
+        # Los días de la ventana sustituyen a los guardados, como hace el upsert
+        precios = pd.concat([stored[~stored.index.isin(ventana.index)], ventana]).sort_index()
+    precios_anuales = yearly_price_stats(precios)
+    return rows, precios_anuales[precios_anuales.index.year >= ventana.index.min().year]
+
+
+@metricas.timed('fetch', endpoint='historical_prices')
+def get_historical_prices(session: Session, api_key: str, symbol: str, full: bool = False,
+                          changes: Optional[Dict[str, int]] = None) -> Optional[pd.DataFrame]:
+    """Fetch new daily prices for a symbol and refresh its yearly statistics.
+
+    Only the days from the last stored trading day onwards are requested.
+    That day is requested again so a close stored during the session is
+    corrected and the window is never empty while the symbol trades.
+    The window is merged into the stored history and only the years it
+    touches are recomputed.
+
+    Parameters
+    ----------
+    full:
+        Download the whole history even if prices are already stored.
+    changes:
+        Map of price changes that receives the first recomputed year of
+        ``symbol`` (see :func:`record_changes`).
+
+    Returns
+    -------
+    Optional[pd.DataFrame]
+        Statistics of the recomputed years, ``None`` when the API has no
+        prices for ``symbol``.
+    """
+    desde = None if full else bbdd.last_price_date(session, symbol)
+    historical = fetch_historical_prices(api_key, symbol, desde)
+    if not historical:
+        return None
+    rows, precios_anuales = price_updates(symbol, historical, bbdd.load_daily_prices(session, symbol))
+    bbdd.upsert_rows(session, bbdd.DailyPrice, rows)
+    if bbdd.save_fiscal_years(session, symbol, {
+        year.year: prices.to_dict() for year, prices in precios_anuales.iterrows()
+    }):
+        record_changes(changes, {symbol: int(precios_anuales.index.year.min())})
+    return precios_anuales
 
 
 def get_price_by_date(prices_df: pd.DataFrame, date: str) -> Optional[float]:
@@ -124,45 +362,46 @@ def get_price_by_date(prices_df: pd.DataFrame, date: str) -> Optional[float]:
     return close_price
 
 
-def get_cash_flow_fmp(session: Session, api_key: str, symbol: str, save_db: bool = True) -> Optional[List[Dict[str, Any]]]:
-    """Retrieve cash flow statements from FMP."""
+@metricas.timed('fetch', endpoint='cash_flow')
+def get_cash_flow_fmp(session: Session, api_key: str, symbol: str, save_db: bool = True,
+                      changes: Optional[Dict[str, int]] = None) -> Optional[List[Dict[str, Any]]]:
+    """Retrieve cash flow statements from FMP and record the years written in ``changes``."""
     url = URL_CASH_FLOW.format(symbol=symbol, api_key=api_key)
     data = make_request(url)
     if not data:
         return log_no_data(data, 'cash flow')
     if save_db:
-        for report in data:
-            with session:
-                bbdd.save_cash_flow(session=session, report=report)
+        record_changes(changes, bbdd.save_statements(session, 'cash_flow', data))
     return data
 
 
-def get_balance_sheet_fmp(session: Session, api_key: str, symbol: str, save_db: bool = True) -> Optional[List[Dict[str, Any]]]:
-    """Retrieve balance sheets from FMP."""
+@metricas.timed('fetch', endpoint='balance_sheet')
+def get_balance_sheet_fmp(session: Session, api_key: str, symbol: str, save_db: bool = True,
+                          changes: Optional[Dict[str, int]] = None) -> Optional[List[Dict[str, Any]]]:
+    """Retrieve balance sheets from FMP and record the years written in ``changes``."""
     url = URL_BALANCE_GENERAL.format(symbol=symbol, api_key=api_key)
     data = make_request(url)
     if not data:
         return log_no_data(data, 'balance sheet')
     if save_db:
-        for report in data:
-            with session:
-                bbdd.save_balance_sheet(session, report)
+        record_changes(changes, bbdd.save_statements(session, 'balance_sheet', data))
     return data
 
 
-def get_income_statement_fmp(session: Session, api_key: str, symbol: str, save_db: bool = True) -> Optional[List[Dict[str, Any]]]:
-    """Retrieve income statements from FMP."""
+@metricas.timed('fetch', endpoint='income_statement')
+def get_income_statement_fmp(session: Session, api_key: str, symbol: str, save_db: bool = True,
+                             changes: Optional[Dict[str, int]] = None) -> Optional[List[Dict[str, Any]]]:
+    """Retrieve income statements from FMP and record the years written in ``changes``."""
     url = URL_CUENTA_RESULTADOS.format(symbol=symbol, api_key=api_key)
     data = make_request(url)
     if not data:
         return log_no_data(data, 'income statement')
     if save_db:
-        for report in data:
-            with session:
-                bbdd.save_income_statement(session=session, report=report)
+        record_changes(changes, bbdd.save_statements(session, 'income_statement', data))
     return data
 
 
+@metricas.timed('fetch', endpoint='profile')
 def get_company_info(session: Session, api_key: str, symbol: str, save_db: bool = True) -> Union[None, Dict[str, Any]]:
     """Retrieve basic company information."""
     url = URL_PERFIL_EMPRESA.format(symbol=symbol, api_key=api_key)
@@ -176,19 +415,25 @@ def get_company_info(session: Session, api_key: str, symbol: str, save_db: bool
 
 
 def process_company(session: Session, symbol: str) -> bool:
-    """Download and store all available reports for ``symbol``."""
+    """Download and store all available reports for ``symbol``.
+
+    Errors are logged and reported as ``False``, except
+    :class:`RateLimitError`, which the caller must handle.
+    """
     try:
         logging.info(f"Processing company: {symbol}")
-        company = get_company_info(session, api_key=API_KEY, symbol=symbol)
+        company = get_company_info(session, api_key=settings.api_key, symbol=symbol)
         if not company:
             logging.warning(f"No data for company: {symbol}")
             return False
-        get_historical_prices(session, API_KEY, symbol)
-        get_cash_flow_fmp(session, API_KEY, symbol)
-        get_balance_sheet_fmp(session, API_KEY, symbol)
-        get_income_statement_fmp(session, API_KEY, symbol)
+        get_historical_prices(session, settings.api_key, symbol)
+        get_cash_flow_fmp(session, settings.api_key, symbol)
+        get_balance_sheet_fmp(session, settings.api_key, symbol)
+        get_income_statement_fmp(session, settings.api_key, symbol)
         logging.info(f"Company processed: {symbol}")
         return True
+    except RateLimitError:
+        raise
     except Exception as e:
         logging.error(f"Failed to process {symbol}: {e}")
         logging.error(traceback.format_exc())
@@ -196,40 +441,288 @@ def process_company(session: Session, symbol: str) -> bool:
         return False
 
 
+# Límites de cada lote del escritor: empresas y filas de precios diarios
+TAMANO_LOTE_ESCRITURA = 25
+FILAS_LOTE_ESCRITURA = 20000
+ESTADOS = {
+    'cash_flow': URL_CASH_FLOW,
+    'balance_sheet': URL_BALANCE_GENERAL,
+    'income_statement': URL_CUENTA_RESULTADOS,
+}
+
+
+def fetch_company(api_key: str, symbol: str, desde: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Download every payload of ``symbol`` without touching the database.
+
+    Returns
+    -------
+    Optional[dict]
+        The profile, the price window from ``desde`` and the statements,
+        ``None`` when the API has no profile for ``symbol``.
+    """
+    with metricas.timed('fetch', endpoint='profile'):
+        profile = make_request(URL_PERFIL_EMPRESA.format(symbol=symbol, api_key=api_key))
+    if not profile:
+        logging.warning(f"No data for company: {symbol}")
+        return None
+    descarga = {'symbol': symbol, 'company': profile[0], 'desde': desde}
+    with metricas.timed('fetch', endpoint='historical_prices'):
+        descarga['historical'] = fetch_historical_prices(api_key, symbol, desde)
+    for tipo, url in ESTADOS.items():
+        with metricas.timed('fetch', endpoint=tipo):
+            descarga[tipo] = make_request(url.format(symbol=symbol, api_key=api_key)) or []
+    return descarga
+
+
+def transform_company(session: Session, descarga: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn the payloads of :func:`fetch_company` into rows ready to write.
+
+    Parameters
+    ----------
+    session:
+        Session used to read the stored price history.
+    descarga:
+        Output of :func:`fetch_company`.
+    """
+    symbol = descarga['symbol']
+    descarga['daily_prices'], descarga['fiscal_years'] = [], []
+    if descarga['historical']:
+        stored = bbdd.load_daily_prices(session, symbol) if descarga['desde'] else None
+        rows, precios_anuales = price_updates(symbol, descarga.pop('historical'), stored)
+        descarga['daily_prices'] = rows
+        descarga['fiscal_years'] = bbdd.fiscal_year_rows(symbol, {
+            year.year: prices.to_dict() for year, prices in precios_anuales.iterrows()
+        })
+    return descarga
+
+
+def write_companies(session: Session, lote: List[Dict[str, Any]], changes: Optional[Dict[str, int]] = None,
+                    price_changes: Optional[Dict[str, int]] = None) -> None:
+    """Store a batch of transformed companies with one statement per table where possible.
+
+    Nothing is committed: the batch is a single unit of work that the
+    caller commits or rolls back, and any error is raised. The first
+    fiscal year written for each symbol is recorded in ``changes`` for
+    statements and in ``price_changes`` for prices (see
+    :func:`record_changes`).
+    """
+    bbdd.upsert_rows(session, bbdd.Company, [bbdd.company_row(d['company']) for d in lote], commit=False)
+    for batch in bbdd.chunked([row for d in lote for row in d['daily_prices']], 5000):
+        bbdd.upsert_rows(session, bbdd.DailyPrice, batch, commit=False)
+    fiscal_years = [row for d in lote for row in d['fiscal_years']]
+    bbdd.upsert_rows(session, bbdd.FiscalYear, fiscal_years, commit=False)
+    for row in fiscal_years:
+        record_changes(price_changes, {row['symbol']: row['fiscal_year']})
+    for tipo in ESTADOS:
+        reports = [report for d in lote for report in d[tipo]]
+        if reports:
+            record_changes(changes, bbdd.save_statements(session, tipo, reports, commit=False))
+
+
+class _Stopped(Exception):
+    """Raised inside a stage when the pipeline is shutting down."""
+
+
+class Pipeline:
+    """Stages connected by bounded queues and running in their own threads.
+
+    A full queue blocks its producer, so a slow stage throttles the ones
+    before it and memory stays bounded by the queue sizes. The first
+    exception in any stage stops every stage and is re-raised by
+    :meth:`check`.
+    """
+
+    def __init__(self) -> None:
+        self.stop = threading.Event()
+        self.errors: List[BaseException] = []
+        self.threads: List[threading.Thread] = []
+
+    def put(self, cola: queue.Queue, item: Any) -> None:
+        while True:
+            if self.stop.is_set():
+                raise _Stopped
+            try:
+                cola.put(item, timeout=0.2)
+                return
+            except queue.Full:
+                continue
+
+    def get(self, cola: queue.Queue) -> Any:
+        while True:
+            if self.stop.is_set():
+                raise _Stopped
+            try:
+                return cola.get(timeout=0.2)
+            except queue.Empty:
+                continue
+
+    def start(self, name: str, target: Callable[..., None], *args: Any) -> None:
+        def run() -> None:
+            try:
+                target(*args)
+            except _Stopped:
+                pass
+            except BaseException as e:
+                self.errors.append(e)
+                self.stop.set()
+
+        thread = threading.Thread(target=run, name=name, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def check(self) -> None:
+        if self.errors:
+            raise self.errors[0]
+
+    def close(self) -> None:
+        self.stop.set()
+        for thread in self.threads:
+            thread.join()
+
+
+def run_pipeline(session: Session, workers: Optional[int] = None, batch_size: int = TAMANO_LOTE_ESCRITURA,
+                 changes: Optional[Dict[str, int]] = None, price_changes: Optional[Dict[str, int]] = None) -> int:
+    """Fetch and store every cached symbol with overlapping stages.
+
+    ``source -> fetch (workers threads) -> transform -> write``: the
+    source pages through ``stock_list`` and looks up the last stored
+    price, fetchers only do network requests, the transform thread
+    builds the rows, and the calling thread writes them through
+    ``session`` in batches of up to ``batch_size`` companies or
+    :data:`FILAS_LOTE_ESCRITURA` daily prices, each batch in one
+    transaction; a failed batch is rolled back and logged. Memory is
+    bounded by the queue sizes, not by the number of symbols. The years
+    of the committed batches are recorded in ``changes`` and
+    ``price_changes`` (see :func:`write_companies`).
+
+    Returns
+    -------
+    int
+        Number of companies stored.
+    """
+    workers = workers or settings.fetch_workers
+    simbolos: queue.Queue = queue.Queue(2 * workers)
+    descargas: queue.Queue = queue.Queue(2 * workers)
+    filas: queue.Queue = queue.Queue(workers)
+    pipeline = Pipeline()
+
+    def source() -> None:
+        with bbdd.session_scope(read_only=True) as lectura:
+            # Los símbolos se leen por páginas del índice, sin cargar la lista entera
+            for symbol in bbdd.iter_listed_symbols(lectura):
+                pipeline.put(simbolos, (symbol, bbdd.last_price_date(lectura, symbol)))
+        for _ in range(workers):
+            pipeline.put(simbolos, None)
+
+    def fetch() -> None:
+        while (item := pipeline.get(simbolos)) is not None:
+            symbol, desde = item
+            try:
+                descarga = fetch_company(settings.api_key, symbol, desde)
+            except RateLimitError:
+                raise  # Detiene el pipeline: seguir sólo gastaría peticiones rechazadas
+            except Exception as e:
+                logging.error(f"Failed to fetch {symbol}: {e}")
+                metricas.increment('pipeline_errors_total', stage='fetch')
+                continue
+            if descarga is not None:
+                pipeline.put(descargas, descarga)
+        pipeline.put(descargas, None)
+
+    def transform() -> None:
+        pendientes = workers
+        with bbdd.session_scope(read_only=True) as lectura:
+            while pendientes:
+                descarga = pipeline.get(descargas)
+                if descarga is None:
+                    pendientes -= 1
+                    continue
+                try:
+                    with metricas.timed('pipeline', stage='transform'):
+                        pipeline.put(filas, transform_company(lectura, descarga))
+                except _Stopped:
+                    raise
+                except Exception as e:
+                    logging.error(f"Failed to transform {descarga['symbol']}: {e}")
+                    metricas.increment('pipeline_errors_total', stage='transform')
+        pipeline.put(filas, None)
+
+    pipeline.start('source', source)
+    for i in range(workers):
+        pipeline.start(f'fetch-{i}', fetch)
+    pipeline.start('transform', transform)
+
+    guardadas = 0
+    lote: List[Dict[str, Any]] = []
+    precios = 0
+    try:
+        while True:
+            try:
+                descarga = pipeline.get(filas)
+            except _Stopped:
+                descarga = None  # Guardar lo ya transformado antes de salir
+            if descarga is not None:
+                lote.append(descarga)
+                precios += len(descarga['daily_prices'])
+            if lote and (descarga is None or len(lote) >= batch_size or precios >= FILAS_LOTE_ESCRITURA):
+                try:
+                    escritos: Dict[str, int] = {}
+                    precios_escritos: Dict[str, int] = {}
+                    with metricas.timed('pipeline', stage='write'):
+                        write_companies(session, lote, escritos, precios_escritos)
+                        session.commit()
+                    record_changes(changes, escritos)
+                    record_changes(price_changes, precios_escritos)
+                    guardadas += len(lote)
+                    logging.info(f"Stored {guardadas} companies (last: {lote[-1]['symbol']})")
+                except Exception as e:
+                    logging.error(f"Failed to store {[d['symbol'] for d in lote]}: {e}")
+                    logging.error(traceback.format_exc())
+                    metricas.increment('pipeline_errors_total', stage='write')
+                    session.rollback()
+                lote, precios = [], 0
+            if descarga is None:
+                break
+    finally:
+        pipeline.close()
+    pipeline.check()
+    return guardadas
+
+
 def main() -> None:
     """Entry point for fetching and storing company data."""
+    configure_logging()
     bbdd.create_tables(ELIMINAR_BBDD)
 
-    Session = sessionmaker(bind=bbdd.engine)
+    stop_reporter = metricas.start_reporter(settings.metrics_interval, settings.metrics_file)
 
     try:
-        if OBTENER_EMPRESAS_CON_API:
-            companies = get_company_list(API_KEY, True)
-            if not companies:
-                logging.error("No companies returned from the API.")
+        with bbdd.session_scope() as session:
+            if not cache_company_list(session):
+                logging.error("No companies available to process.")
                 return
-            logging.info(f"Companies obtained from API: {len(companies)}")
-            df_empresas = pd.DataFrame(companies)
-            df_empresas.to_csv(fichero_lista_empresas, index=False)
-        else:
-            if not os.path.exists(fichero_lista_empresas):
-                logging.error(f"File not found: {fichero_lista_empresas}")
-                return
-            df_empresas = pd.read_csv(fichero_lista_empresas)
-        with Session() as session:
-            for _, empresa in df_empresas.iterrows():
-                symbol = empresa.get('symbol')
-                if not symbol:
-                    logging.warning(f"Symbol not found for company: {empresa}")
-                    continue
-                process_company(session, symbol)
-                session.commit()
+            session.commit()
+            cambios: Dict[str, int] = {}
+            cambios_precios: Dict[str, int] = {}
+            run_pipeline(session, changes=cambios, price_changes=cambios_precios)
+            # Los rankings y el riesgo también leen precios
+            todos = dict(cambios)
+            record_changes(todos, cambios_precios)
+            analisis.refresh_growth_features(session, cambios)
+            analisis.refresh_sector_ranks(session, changed=todos)
+            analisis.refresh_risk_metrics(session, todos)
+            analisis.update_index(session, changed=cambios)
+            bbdd.refresh_data_issues(session)
     except KeyboardInterrupt:
         logging.info("Execution interrupted by user.")
     except Exception as e:
         logging.error(f"Critical error during processing: {e}")
         logging.error(traceback.format_exc())
     finally:
+        stop_reporter.set()
+        logging.info(f"Metrics: {metricas.REGISTRY.summary()}")
+        if settings.metrics_file:
+            metricas.write_snapshot(settings.metrics_file)
         logging.info("Execution finished.")
 
 if __name__ == "__main__":
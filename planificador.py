@@ -0,0 +1,257 @@
+"""Refresh daemon: keep the database fresh by draining the persistent job queue.
+
+Every ``(symbol, endpoint)`` pair is a job in the ``jobs`` table with a
+priority and a next-due time. Annual statements are due again one year
+after the last filing, prices and profiles on a fixed interval. The
+daemon claims due jobs and paces the requests evenly over the day
+according to the API quota, instead of refreshing the whole universe in
+one burst. Several daemons can share the same database.
+"""
+
+import argparse
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+from sqlalchemy import and_, func
+from sqlalchemy.orm import Session
+import bbdd
+import analisis
+import metricas
+from conf import *
+
+# Prioridad base de cada endpoint; el perfil va primero porque crea la empresa
+PRIORIDADES = {
+    'profile': 30,
+    'income_statement': 20,
+    'balance_sheet': 20,
+    'cash_flow': 20,
+    'historical_prices': 10,
+}
+ENDPOINTS = list(PRIORIDADES)
+# Los símbolos nuevos se adelantan a los refrescos rutinarios
+PRIORIDAD_NUEVOS = 100
+
+# Endpoints que se refrescan a intervalo fijo
+INTERVALOS = {
+    'profile': timedelta(days=30),
+    'historical_prices': timedelta(days=7),
+}
+# Los estados anuales se esperan un año después de la última presentación
+CADENCIA_PRESENTACION = timedelta(days=365)
+MARGEN_PRESENTACION = timedelta(days=14)
+# Una presentación atrasada se vuelve a comprobar cada semana
+REVISION_PRESENTACION = timedelta(days=7)
+# Sin datos en la API: volver a intentarlo más adelante
+REVISION_SIN_DATOS = timedelta(days=30)
+
+RESIEMBRA = timedelta(hours=1)
+# El riesgo y la auditoría recorren todo el universo: se recalculan a intervalo fijo, no por lote
+RECALCULO_GLOBAL = timedelta(hours=1)
+TAMANO_LOTE = 10
+# Pausa tras un HTTP 429, duplicada mientras la API siga rechazando peticiones
+ESPERA_LIMITE = timedelta(minutes=1)
+ESPERA_LIMITE_MAXIMA = timedelta(hours=1)
+
+
+def _tasks() -> Dict[str, Callable[[Session, str, Dict[str, int], Dict[str, int]], Any]]:
+    """Map every endpoint to the fetcher that downloads and stores it.
+
+    Fetchers record the first fiscal year they wrote for the symbol in
+    the dictionary passed as third argument for statements, or as fourth
+    argument for prices.
+    """
+    import obtener_datos_empresas as fmp
+
+    return {
+        'profile': lambda session, symbol, changes, prices: fmp.get_company_info(session, settings.api_key, symbol),
+        'historical_prices': lambda session, symbol, changes, prices: fmp.get_historical_prices(session, settings.api_key, symbol, changes=prices),
+        'cash_flow': lambda session, symbol, changes, prices: fmp.get_cash_flow_fmp(session, settings.api_key, symbol, changes=changes),
+        'balance_sheet': lambda session, symbol, changes, prices: fmp.get_balance_sheet_fmp(session, settings.api_key, symbol, changes=changes),
+        'income_statement': lambda session, symbol, changes, prices: fmp.get_income_statement_fmp(session, settings.api_key, symbol, changes=changes),
+    }
+
+
+def _statement_models() -> Dict[str, Any]:
+    return {
+        'cash_flow': bbdd.CashFlow,
+        'balance_sheet': bbdd.BalanceSheet,
+        'income_statement': bbdd.IncomeStatement,
+    }
+
+
+def next_run(session: Session, symbol: str, endpoint: str, found: bool, now: datetime) -> datetime:
+    """Return when ``endpoint`` should be refreshed again for ``symbol``.
+
+    Statements follow the filing cadence: the next one is expected a year
+    after the latest stored filing date. Once that date has passed
+    without a new filing, the job is checked weekly.
+    """
+    if not found:
+        return now + REVISION_SIN_DATOS
+    if endpoint in INTERVALOS:
+        return now + INTERVALOS[endpoint]
+    model = _statement_models()[endpoint]
+    # Última presentación de la que ya se guardó este estado
+    ultima = session.query(func.max(bbdd.Filing.fecha_presentacion))\
+        .join(model, and_(model.symbol == bbdd.Filing.symbol, model.fiscal_year == bbdd.Filing.fiscal_year))\
+        .filter(bbdd.Filing.symbol == symbol).scalar()
+    if not ultima:
+        return now + REVISION_SIN_DATOS
+    esperada = datetime.combine(ultima, datetime.min.time()) + CADENCIA_PRESENTACION + MARGEN_PRESENTACION
+    return max(esperada, now + REVISION_PRESENTACION)
+
+
+def seed_jobs(session: Session) -> int:
+    """Queue every endpoint of every cached symbol that has no job yet."""
+    total = 0
+    for endpoint in ENDPOINTS:
+        total += bbdd.enqueue_listed_symbols(session, [endpoint], PRIORIDAD_NUEVOS + PRIORIDADES[endpoint])
+    if total:
+        logging.info(f"Queued {total} new jobs")
+    return total
+
+
+def run_jobs(session: Session, worker: str, jobs, tasks: Dict[str, Callable], intervalo: float,
+             changes: Optional[Dict[str, int]] = None, price_changes: Optional[Dict[str, int]] = None) -> int:
+    """Run claimed ``jobs`` one request every ``intervalo`` seconds.
+
+    The first fiscal year written for each symbol is recorded in
+    ``changes`` for statements and in ``price_changes`` for prices.
+
+    Returns
+    -------
+    int
+        Number of jobs that stored new data.
+
+    Raises
+    ------
+    RateLimitError
+        When the API refuses a request. The job and the rest of the batch
+        are released first, without counting an attempt.
+    """
+    from obtener_datos_empresas import RateLimitError
+
+    actualizados = 0
+    for i, job in enumerate(jobs):
+        inicio = time.monotonic()
+        try:
+            with metricas.timed('job', endpoint=job.endpoint):
+                resultado = tasks[job.endpoint](session, job.symbol, changes, price_changes)
+            found = resultado is not None and len(resultado) > 0
+            proxima = next_run(session, job.symbol, job.endpoint, found, datetime.now())
+            if not bbdd.complete_job(session, worker, job.symbol, job.endpoint, proxima, PRIORIDADES[job.endpoint]):
+                logging.warning(f"Lost claim on {job.symbol}/{job.endpoint}")
+            actualizados += found
+        except RateLimitError:
+            session.rollback()
+            bbdd.release_jobs(session, worker, [(j.symbol, j.endpoint) for j in jobs[i:]], datetime.now())
+            raise
+        except Exception as e:
+            session.rollback()
+            logging.error(f"Job {job.symbol}/{job.endpoint} failed: {e}")
+            logging.debug(traceback.format_exc())
+            bbdd.fail_job(session, worker, job.symbol, job.endpoint, job.intentos, str(e))
+        # Repartir la cuota: como mucho una petición cada ``intervalo`` segundos
+        time.sleep(max(0.0, intervalo - (time.monotonic() - inicio)))
+    return actualizados
+
+
+def refresh_universe(session: Session, changed: Optional[Dict[str, int]]) -> None:
+    """Run the refreshes that read every stored symbol.
+
+    ``changed`` accumulates the symbols written since the last call;
+    ``None`` checks all of them.
+    """
+    analisis.refresh_risk_metrics(session, changed)
+    bbdd.refresh_data_issues(session)
+
+
+def run(session: Session, worker: str, quota: int, batch: int = TAMANO_LOTE, once: bool = False) -> None:
+    """Drain the queue forever (or until no job is due when ``once``)."""
+    import obtener_datos_empresas as fmp
+
+    tasks = _tasks()
+    intervalo = 86400 / quota
+    # El lote entero espera su turno, así que la reserva debe cubrirlo
+    lease = timedelta(seconds=intervalo * batch) + timedelta(minutes=10)
+    logging.info(f"Worker {worker}: quota {quota}/day, one request every {intervalo:.1f}s")
+
+    fmp.cache_company_list(session)
+    seed_jobs(session)
+    siguiente_siembra = datetime.now() + RESIEMBRA
+    # Al arrancar no se sabe qué dejó sin recalcular el proceso anterior: se revisa todo
+    pendientes: Optional[Dict[str, int]] = None
+    siguiente_recalculo = datetime.now() + RECALCULO_GLOBAL
+    espera_limite = ESPERA_LIMITE
+    while True:
+        if datetime.now() >= siguiente_siembra:
+            seed_jobs(session)
+            siguiente_siembra = datetime.now() + RESIEMBRA
+        if datetime.now() >= siguiente_recalculo:
+            if pendientes is None or pendientes:
+                refresh_universe(session, pendientes)
+            pendientes = {}
+            siguiente_recalculo = datetime.now() + RECALCULO_GLOBAL
+
+        jobs = bbdd.claim_jobs(session, worker, batch, lease)
+        if not jobs:
+            if once:
+                if pendientes is None or pendientes:
+                    refresh_universe(session, pendientes)
+                return
+            proxima = bbdd.next_due_time(session)
+            espera = (proxima - datetime.now()).total_seconds() if proxima else 60
+            time.sleep(min(max(espera, 1), 60))
+            continue
+
+        cambios: Dict[str, int] = {}
+        cambios_precios: Dict[str, int] = {}
+        pausa = 0.0
+        try:
+            run_jobs(session, worker, jobs, tasks, intervalo, cambios, cambios_precios)
+            espera_limite = ESPERA_LIMITE
+        except fmp.RateLimitError as e:
+            pausa = max(espera_limite.total_seconds(), e.retry_after or 0)
+            espera_limite = min(espera_limite * 2, ESPERA_LIMITE_MAXIMA)
+            metricas.increment('api_rate_limited_total')
+            logging.warning(f"API rate limit reached: claimed jobs released, pausing {pausa:.0f}s")
+        if cambios:
+            analisis.refresh_growth_features(session, cambios)
+            analisis.update_index(session, changed=cambios)
+        # Los rankings y el riesgo también leen precios
+        todos = dict(cambios)
+        fmp.record_changes(todos, cambios_precios)
+        if todos:
+            analisis.refresh_sector_ranks(session, changed=todos)
+            fmp.record_changes(pendientes, todos)
+        if pausa:
+            time.sleep(pausa)
+
+
+def main() -> None:
+    """Entry point of the refresh daemon."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--quota', type=int, default=None, help='API requests per day (default: FMP_DAILY_QUOTA)')
+    parser.add_argument('--batch', type=int, default=TAMANO_LOTE, help='Jobs claimed at a time')
+    parser.add_argument('--worker', default=f'{socket.gethostname()}:{os.getpid()}', help='Worker identifier')
+    parser.add_argument('--once', action='store_true', help='Exit when no job is due')
+    args = parser.parse_args()
+    configure_logging()
+    bbdd.create_tables()
+
+    stop_reporter = metricas.start_reporter(settings.metrics_interval, settings.metrics_file)
+    try:
+        with bbdd.session_scope() as session:
+            run(session, args.worker, args.quota or settings.api_daily_quota, args.batch, args.once)
+    except KeyboardInterrupt:
+        logging.info("Execution interrupted by user.")
+    finally:
+        stop_reporter.set()
+        logging.info(f"Metrics: {metricas.REGISTRY.summary()}")
+        if settings.metrics_file:
+            metricas.write_snapshot(settings.metrics_file)
+
+
+if __name__ == "__main__":
+    main()
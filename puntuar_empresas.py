@@ -0,0 +1,88 @@
+"""Score the latest fiscal year of every company with the trained model."""
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+from typing import Any, Dict, Optional
+import bbdd
+from entrenamiento import load_model
+from conf import *
+
+TAMANO_LOTE = 5000
+
+
+def score_chunk(artifact: Dict[str, Any], chunk: pd.DataFrame) -> pd.DataFrame:
+    """Return ``symbol``, ``fiscal_year`` and ``puntuacion`` for ``chunk``."""
+    columnas = artifact['columns']
+    X = chunk.reindex(columns=columnas).to_numpy(dtype=np.float32, na_value=np.nan)
+    if 'fill_values' in artifact:
+        # Mismos valores de imputación que en el entrenamiento
+        np.copyto(X, artifact['fill_values'], where=np.isnan(X))
+        validas = np.ones(len(X), dtype=bool)
+    else:
+        # Modelos antiguos: las filas incompletas no se pueden puntuar
+        validas = ~np.isnan(X).any(axis=1)
+    resultado = chunk.loc[validas, ['symbol', 'fiscal_year']].reset_index(drop=True)
+    if not validas.any():
+        # El escalador no acepta matrices sin filas
+        resultado['puntuacion'] = pd.Series(dtype='float64')
+        return resultado
+    X = artifact['scaler'].transform(X[validas])
+    X = np.column_stack([X, chunk['fiscal_year'].to_numpy()[validas]])
+    resultado['puntuacion'] = artifact['model'].predict(X)
+    return resultado
+
+
+def score_universe(session: Session, artifact: Dict[str, Any], chunk_size: int = TAMANO_LOTE,
+                   model_version: Optional[str] = None, reader: Optional[Session] = None) -> Dict[str, float]:
+    """Score every company and store the results in ``predictions``.
+
+    Features are streamed through ``reader`` when given, so a read-only
+    session can feed the chunks while ``session`` writes the predictions.
+    """
+    version = model_version or artifact['version']
+    leidas = escritas = 0
+    inicio = time.perf_counter()
+    for chunk in bbdd.iter_latest_data(reader or session, chunk_size=chunk_size):
+        leidas += len(chunk)
+        predicciones = score_chunk(artifact, chunk)
+        escritas += bbdd.save_predictions(session, predicciones, version)
+        transcurrido = time.perf_counter() - inicio
+        logging.info(f"Scored {escritas}/{leidas} rows ({leidas / transcurrido:.0f} rows/s)")
+    transcurrido = time.perf_counter() - inicio
+    stats = {
+        'rows_read': leidas,
+        'rows_written': escritas,
+        'seconds': transcurrido,
+        'rows_per_sec': leidas / transcurrido if transcurrido else 0.0,
+    }
+    logging.info(
+        f"Model {version}: {escritas} predictions written in {transcurrido:.2f}s "
+        f"({stats['rows_per_sec']:.0f} rows/s)"
+    )
+    return stats
+
+
+def main() -> None:
+    """Entry point for scoring the whole universe."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--model', default=fichero_modelo, help='Path to the serialized model')
+    parser.add_argument('--chunk-size', type=int, default=TAMANO_LOTE, help='Rows scored per batch')
+    parser.add_argument('--model-version', default=None, help='Override the version stored in the model')
+    args = parser.parse_args()
+    configure_logging()
+
+    if not os.path.exists(args.model):
+        logging.error(f"File not found: {args.model}")
+        return
+
+    artifact = load_model(args.model)
+    bbdd.create_tables()
+    with bbdd.session_scope() as session, bbdd.session_scope(read_only=True) as reader:
+        score_universe(session, artifact, args.chunk_size, args.model_version, reader)
+
+
+if __name__ == "__main__":
+    main()
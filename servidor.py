@@ -0,0 +1,513 @@
+"""Local asyncio HTTP service that answers queries over the fundamentals database.
+
+Usage::
+
+    python servidor.py --port 8080
+    curl 'http://127.0.0.1:8080/screen?ratio=per&max_percentile=0.2'
+
+Routes (all ``GET``):
+
+* ``/companies``: listed companies, optionally filtered by ``sector``.
+* ``/screen``: companies ranked by a ratio's percentile within their
+  sector (``ratio``, ``fiscal_year``, ``sector``, ``max_percentile``,
+  ``limit``).
+* ``/scores``: model scores of the latest or the given ``model_version``
+  (``fiscal_year``, ``limit``).
+* ``/ratios/<symbol>``: ratios, percentiles and z-scores of every year.
+* ``/fundamentals/<symbol>``: joined statements and yearly prices.
+* ``/prices/<symbol>``: daily prices between ``from`` and ``to``.
+* ``/peers/<symbol>``: nearest companies by fundamentals from the
+  similarity index (``fiscal_year``, ``k``).
+* ``/metrics``: counters and latency histograms in Prometheus format.
+
+Responses are streamed with chunked transfer encoding, as a JSON array
+or, with ``format=arrow``, as an Arrow IPC stream. Queries run in a pool
+of ``DB_READ_POOL_SIZE`` threads, each with its own
+``bbdd.session_scope(read_only=True)`` session, so the event loop never
+waits on SQLite and ingest keeps writing. Screens and scores are cached
+with ``bbdd.cached_query`` until their tables change.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+from urllib.parse import parse_qs, unquote, urlsplit
+import pandas as pd
+from sqlalchemy import func
+from sqlalchemy.orm import Query, Session
+from conf import *
+import bbdd
+from bbdd.crud import _all_data_query
+import metricas
+from analisis.ranking import RATIOS
+from analisis.similarity import get_index
+
+TAMANO_LOTE = 5000
+LIMITE_POR_DEFECTO = 100
+LIMITE_MAXIMO = 10000
+# Lotes en cola entre el hilo de la consulta y el socket; limita la memoria por petición
+LOTES_EN_COLA = 4
+
+ESTADOS_HTTP = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+Params = Dict[str, str]
+Result = Union[pd.DataFrame, Query]
+Rows = List[tuple]
+
+
+class BadRequest(ValueError):
+    """Invalid route or query parameter, answered with HTTP 400."""
+
+
+def _int(params: Params, name: str, default: Optional[int] = None) -> Optional[int]:
+    if name not in params:
+        return default
+    try:
+        return int(params[name])
+    except ValueError:
+        raise BadRequest(f"{name} must be an integer")
+
+
+def _float(params: Params, name: str, default: float) -> float:
+    try:
+        return float(params.get(name, default))
+    except ValueError:
+        raise BadRequest(f"{name} must be a number")
+
+
+def _date(params: Params, name: str) -> Optional[str]:
+    if name not in params:
+        return None
+    fecha = bbdd.parse_date(params[name])
+    if fecha is None:
+        raise BadRequest(f"{name} must be a YYYY-MM-DD date")
+    return fecha.isoformat()
+
+
+def _limit(params: Params) -> int:
+    return max(0, min(_int(params, 'limit', LIMITE_POR_DEFECTO), LIMITE_MAXIMO))
+
+
+@bbdd.cached_query('sector_ranks', 'company')
+def screen(session: Session, ratio: str = 'per', fiscal_year: Optional[int] = None, sector: Optional[str] = None,
+           max_percentile: float = 1.0, limit: int = LIMITE_POR_DEFECTO) -> pd.DataFrame:
+    """Return the companies with the lowest ``ratio`` percentile within their sector.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for querying.
+    ratio:
+        One of :data:`analisis.ranking.RATIOS`.
+    fiscal_year:
+        Year of the ranks; defaults to the latest ranked year.
+    sector:
+        Restrict the screen to one sector.
+    max_percentile:
+        Upper bound of the percentile, between 0 and 1.
+    limit:
+        Maximum number of companies returned.
+    """
+    rank = bbdd.SectorRank
+    if fiscal_year is None:
+        fiscal_year = session.query(func.max(rank.fiscal_year)).scalar()
+    percentil = getattr(rank, f'{ratio}_percentil')
+    query = session.query(
+        rank.symbol, bbdd.Company.company_name, rank.sector, rank.fiscal_year,
+        getattr(rank, ratio), percentil, getattr(rank, f'{ratio}_zscore'),
+    ).outerjoin(bbdd.Company, bbdd.Company.symbol == rank.symbol)\
+     .filter(rank.fiscal_year == fiscal_year, percentil <= max_percentile)
+    if sector is not None:
+        query = query.filter(rank.sector == sector)
+    query = query.order_by(percentil, rank.symbol).limit(limit)
+    return pd.read_sql(query.statement, session.connection())
+
+
+@bbdd.cached_query('predictions', 'company')
+def top_scores(session: Session, model_version: Optional[str] = None, fiscal_year: Optional[int] = None,
+               limit: int = LIMITE_POR_DEFECTO) -> pd.DataFrame:
+    """Return the best model scores of each company's latest scored year.
+
+    Parameters
+    ----------
+    session:
+        Active SQLAlchemy session used for querying.
+    model_version:
+        Version of the model; defaults to the most recently scored one.
+    fiscal_year:
+        Score only this year instead of each company's latest.
+    limit:
+        Maximum number of companies returned.
+    """
+    prediction = bbdd.Prediction
+    if model_version is None:
+        model_version = session.query(prediction.model_version)\
+            .order_by(prediction.fecha_calculo.desc()).limit(1).scalar()
+    query = session.query(
+        prediction.symbol, bbdd.Company.company_name, bbdd.Company.sector,
+        prediction.fiscal_year, prediction.model_version, prediction.puntuacion, prediction.fecha_calculo,
+    ).outerjoin(bbdd.Company, bbdd.Company.symbol == prediction.symbol)\
+     .filter(prediction.model_version == model_version)
+    if fiscal_year is not None:
+        query = query.filter(prediction.fiscal_year == fiscal_year)
+    else:
+        latest = session.query(prediction.symbol, func.max(prediction.fiscal_year).label('fiscal_year'))\
+            .filter(prediction.model_version == model_version).group_by(prediction.symbol).subquery()
+        query = query.join(latest, (prediction.symbol == latest.c.symbol) & (prediction.fiscal_year == latest.c.fiscal_year))
+    query = query.order_by(prediction.puntuacion.desc(), prediction.symbol).limit(limit)
+    return pd.read_sql(query.statement, session.connection())
+
+
+def _companies(session: Session, params: Params, symbol: Optional[str]) -> Result:
+    query = session.query(bbdd.Company.symbol, bbdd.Company.company_name, bbdd.Company.exchange_short_name, bbdd.Company.sector)
+    if 'sector' in params:
+        query = query.filter(bbdd.Company.sector == params['sector'])
+    return query.order_by(bbdd.Company.symbol)
+
+
+def _screen(session: Session, params: Params, symbol: Optional[str]) -> Result:
+    ratio = params.get('ratio', 'per')
+    if ratio not in RATIOS:
+        raise BadRequest(f"ratio must be one of {', '.join(RATIOS)}")
+    return screen(
+        session, ratio, _int(params, 'fiscal_year'), params.get('sector'),
+        _float(params, 'max_percentile', 1.0), _limit(params),
+    )
+
+
+def _scores(session: Session, params: Params, symbol: Optional[str]) -> Result:
+    return top_scores(session, params.get('model_version'), _int(params, 'fiscal_year'), _limit(params))
+
+
+def _ratios(session: Session, params: Params, symbol: Optional[str]) -> Result:
+    return session.query(*bbdd.SectorRank.__table__.columns).filter(bbdd.SectorRank.symbol == symbol)\
+        .order_by(bbdd.SectorRank.fiscal_year)
+
+
+def _fundamentals(session: Session, params: Params, symbol: Optional[str]) -> Result:
+    return _all_data_query(session).filter(bbdd.FiscalYear.symbol == symbol)\
+        .order_by(bbdd.FiscalYear.fiscal_year)
+
+
+def _prices(session: Session, params: Params, symbol: Optional[str]) -> Result:
+    precio = bbdd.DailyPrice
+    query = session.query(*precio.__table__.columns).filter(precio.symbol == symbol)
+    desde, hasta = _date(params, 'from'), _date(params, 'to')
+    if desde is not None:
+        query = query.filter(precio.fecha >= desde)
+    if hasta is not None:
+        query = query.filter(precio.fecha <= hasta)
+    return query.order_by(precio.fecha)
+
+
+def _peers(session: Session, params: Params, symbol: Optional[str]) -> Result:
+    try:
+        index = get_index()
+    except FileNotFoundError as e:
+        raise BadRequest(str(e))
+    return index.peers(symbol, _int(params, 'fiscal_year'), max(1, min(_int(params, 'k', 10), LIMITE_MAXIMO)))
+
+
+# Ruta -> (consulta, si lleva símbolo)
+ROUTES: Dict[str, Tuple[Callable[[Session, Params, Optional[str]], Result], bool]] = {
+    'companies': (_companies, False),
+    'screen': (_screen, False),
+    'scores': (_scores, False),
+    'ratios': (_ratios, True),
+    'fundamentals': (_fundamentals, True),
+    'prices': (_prices, True),
+    'peers': (_peers, True),
+}
+
+
+def _json_default(value: Any) -> str:
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+class _JsonEncoder:
+    """Write batches of rows as the pieces of one JSON array of records."""
+
+    content_type = 'application/json'
+
+    def __init__(self, schema: Any = None) -> None:
+        self.started = False
+
+    def encode(self, columns: List[str], rows: Rows) -> bytes:
+        if not rows:
+            return b''
+        records = json.dumps([dict(zip(columns, row)) for row in rows], default=_json_default)
+        return self._piece(records[1:-1])
+
+    def encode_frame(self, frame: pd.DataFrame) -> bytes:
+        records = frame.to_json(orient='records', date_format='iso')[1:-1]
+        return self._piece(records) if records else b''
+
+    def close(self) -> bytes:
+        return b']' if self.started else b'[]'
+
+    def _piece(self, records: str) -> bytes:
+        prefix = ',' if self.started else '['
+        self.started = True
+        return (prefix + records).encode()
+
+
+class _ArrowEncoder:
+    """Write batches of rows as the record batches of one Arrow IPC stream."""
+
+    content_type = 'application/vnd.apache.arrow.stream'
+
+    def __init__(self, schema: Any = None) -> None:
+        import pyarrow as pa
+
+        self.pa = pa
+        self.schema = schema
+        self.sink = io.BytesIO()
+        self.writer = None
+
+    def encode(self, columns: List[str], rows: Rows) -> bytes:
+        values = dict(zip(columns, map(list, zip(*rows)))) if rows else {column: [] for column in columns}
+        return self._write(self.pa.Table.from_pydict(values, schema=self.schema))
+
+    def encode_frame(self, frame: pd.DataFrame) -> bytes:
+        return self._write(self.pa.Table.from_pandas(frame, schema=self.schema, preserve_index=False))
+
+    def _write(self, table) -> bytes:
+        if self.writer is None:
+            self.writer = self.pa.ipc.new_stream(self.sink, table.schema)
+        self.writer.write_table(table)
+        return self._take()
+
+    def close(self) -> bytes:
+        if self.writer is None:
+            if self.schema is None:
+                return b''
+            self.writer = self.pa.ipc.new_stream(self.sink, self.schema)
+        self.writer.close()
+        return self._take()
+
+    def _take(self) -> bytes:
+        data = self.sink.getvalue()
+        self.sink.seek(0)
+        self.sink.truncate()
+        return data
+
+
+ENCODERS = {'json': _JsonEncoder, 'arrow': _ArrowEncoder}
+
+
+def _query_batches(session: Session, query: Query, chunk_size: int = TAMANO_LOTE) -> Iterator[Tuple[List[str], Rows]]:
+    """Fetch ``query`` in batches of plain rows, without building DataFrames.
+
+    Columns repeated by joins are kept once. The rows come from the
+    session's own connection, so the thread never takes a second
+    connection from the pool.
+    """
+    result = session.execute(query.statement)
+    keys = list(result.keys())
+    keep = [i for i, key in enumerate(keys) if key not in keys[:i]]
+    columns = [keys[i] for i in keep]
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield columns, [tuple(row) for row in rows] if len(keep) == len(keys) else [tuple(row[i] for i in keep) for row in rows]
+
+
+def run_query(route: str, symbol: Optional[str], params: Params, put: Callable[[Tuple[str, Any]], None],
+              cancelled: threading.Event) -> None:
+    """Run one request in a worker thread and hand its encoded pieces to ``put``.
+
+    Pieces are ``('data', bytes)`` items followed by ``('end', None)``,
+    or ``('error', exception)`` when the query fails. ``put`` blocks
+    while the connection is behind, and the query stops once
+    ``cancelled`` is set; the last piece is always ``end`` or ``error``.
+    """
+    handler, _ = ROUTES[route]
+    fmt = params.get('format', 'json')
+    try:
+        if fmt not in ENCODERS:
+            raise BadRequest(f"format must be one of {', '.join(ENCODERS)}")
+        with metricas.timed('api_query', route=route), bbdd.session_scope(read_only=True) as session:
+            result = handler(session, params, symbol)
+            if isinstance(result, pd.DataFrame):
+                # Resultado ya materializado (consultas cacheadas): pocas filas
+                encoder = ENCODERS[fmt]()
+                put(('data', encoder.encode_frame(result) + encoder.close()))
+            else:
+                schema = bbdd.arrow_schema(result) if fmt == 'arrow' else None
+                encoder = ENCODERS[fmt](schema)
+                for columns, rows in _query_batches(session, result):
+                    if cancelled.is_set():
+                        break
+                    data = encoder.encode(columns, rows)
+                    if data:
+                        put(('data', data))
+                else:
+                    put(('data', encoder.close()))
+        put(('end', None))
+    except Exception as e:
+        put(('error', e))
+
+
+class QueryServer:
+    """asyncio HTTP/1.1 server with keep-alive that answers :data:`ROUTES`.
+
+    Parameters
+    ----------
+    workers:
+        Threads running queries; defaults to the size of the read pool so
+        no request waits for a connection while holding a thread.
+    """
+
+    def __init__(self, workers: Optional[int] = None) -> None:
+        self.executor = ThreadPoolExecutor(workers or settings.read_pool_size, thread_name_prefix='consulta')
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serve every request of one client connection."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    method, target, version = line.decode('latin-1').split()
+                except ValueError:
+                    break
+                headers: Dict[str, str] = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                if int(headers.get('content-length', 0) or 0):
+                    await reader.readexactly(int(headers['content-length']))
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                await self.respond(writer, method, target, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer: asyncio.StreamWriter, method: str, target: str, keep_alive: bool) -> None:
+        """Answer one request, streaming the body as it is produced."""
+        url = urlsplit(target)
+        parts = [unquote(p) for p in url.path.strip('/').split('/') if p]
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        route = parts[0] if parts else ''
+        inicio = time.perf_counter()
+        status = 200
+        try:
+            if method != 'GET':
+                status = await self.send(writer, 405, b'{"error": "Only GET is supported"}', keep_alive)
+            elif route == 'metrics' and len(parts) == 1:
+                body = metricas.REGISTRY.to_prometheus().encode()
+                status = await self.send(writer, 200, body, keep_alive, 'text/plain; version=0.0.4')
+            elif route not in ROUTES or len(parts) != 1 + ROUTES[route][1]:
+                status = await self.send(writer, 404, b'{"error": "Unknown route"}', keep_alive)
+            else:
+                status = await self.stream(writer, route, parts[1] if len(parts) > 1 else None, params, keep_alive)
+        finally:
+            label = route if route in ROUTES or route == 'metrics' else 'unknown'
+            metricas.observe('api_request_seconds', time.perf_counter() - inicio, route=label)
+            metricas.increment('api_responses_total', status=status)
+
+    async def stream(self, writer: asyncio.StreamWriter, route: str, symbol: Optional[str], params: Params,
+                     keep_alive: bool) -> int:
+        """Run a query in the pool and relay its pieces as HTTP chunks."""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(LOTES_EN_COLA)
+        cancelled = threading.Event()
+
+        def put(item: Tuple[str, Any]) -> None:
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        task = loop.run_in_executor(self.executor, run_query, route, symbol, params, put, cancelled)
+        kind, value = await queue.get()
+        if kind == 'error':
+            await task
+            if isinstance(value, BadRequest):
+                return await self.send(writer, 400, _error(value), keep_alive)
+            logging.error(f"Query {route} failed: {value}")
+            return await self.send(writer, 500, _error(value), keep_alive)
+
+        content_type = _ArrowEncoder.content_type if params.get('format') == 'arrow' else _JsonEncoder.content_type
+        try:
+            writer.write(_head(200, content_type, keep_alive, {'Transfer-Encoding': 'chunked'}))
+            while kind == 'data':
+                if value:
+                    writer.write(b'%x\r\n%s\r\n' % (len(value), value))
+                    await writer.drain()
+                kind, value = await queue.get()
+            if kind == 'error':
+                # Cabeceras ya enviadas: solo queda cortar la conexión
+                logging.error(f"Query {route} failed while streaming: {value}")
+                raise ConnectionAbortedError
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+        except ConnectionError:
+            cancelled.set()
+            while kind == 'data':
+                kind, value = await queue.get()
+            raise
+        finally:
+            await task
+        return 200
+
+    async def send(self, writer: asyncio.StreamWriter, status: int, body: bytes, keep_alive: bool,
+                   content_type: str = 'application/json') -> int:
+        """Write a complete response with a known length."""
+        writer.write(_head(status, content_type, keep_alive, {'Content-Length': str(len(body))}) + body)
+        await writer.drain()
+        return status
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8080) -> None:
+        """Accept connections until cancelled."""
+        server = await asyncio.start_server(self.handle, host, port)
+        logging.info(f"Serving on http://{host}:{port}/")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _head(status: int, content_type: str, keep_alive: bool, headers: Dict[str, str]) -> bytes:
+    lines = [f'HTTP/1.1 {status} {ESTADOS_HTTP[status]}', f'Content-Type: {content_type}',
+             f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    lines += [f'{name}: {value}' for name, value in headers.items()]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+def _error(error: Exception) -> bytes:
+    return json.dumps({'error': str(error)}).encode()
+
+
+def main() -> None:
+    """Entry point of the query service."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--workers', type=int, default=None, help='Query threads (default: DB_READ_POOL_SIZE)')
+    args = parser.parse_args()
+    configure_logging(logging.INFO)
+
+    bbdd.create_tables()
+    try:
+        asyncio.run(QueryServer(args.workers).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        logging.info("Server stopped.")
+
+
+if __name__ == "__main__":
+    main()
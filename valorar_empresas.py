@@ -0,0 +1,20 @@
+"""Value every company with the Monte Carlo DCF and save the percentiles."""
+
+import bbdd
+from analisis import value_universe
+from conf import *
+
+fichero_valoracion = os.path.join(DATA_DIR, 'valoracion_dcf.csv')
+
+
+def main() -> None:
+    """Entry point for the universe-wide DCF valuation."""
+    configure_logging()
+    with bbdd.session_scope(read_only=True) as session:
+        valoracion = value_universe(session)
+    valoracion.to_csv(fichero_valoracion, index=False)
+    logging.info(f"DCF valuation of {len(valoracion)} companies saved to {fichero_valoracion}")
+
+
+if __name__ == "__main__":
+    main()